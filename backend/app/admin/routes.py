@@ -1,6 +1,8 @@
+from datetime import datetime
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from app.admin.schemas import (
@@ -14,47 +16,74 @@ from app.admin.schemas import (
     AdminScheduleSlotResponse,
     AdminScheduleSlotUpdate,
     AdminStatsResponse,
+    AdminStatsTimeseriesResponse,
     AdminTransactionResponse,
     AdminUserResponse,
     AdminUserUpdate,
     AdminWalletTopUpRequest,
     DoctorVerificationUpdate,
     ExchangeRateUpdate,
+    ExchangeRatesResponse,
+)
+from app.admin.service import (
+    EXPORT_FORMAT_PATTERN,
+    EXPORT_FORMATS,
+    STATS_BUCKET_PATTERN,
+    AdminService,
 )
-from app.admin.service import AdminService
 from app.common.database import get_db
 from app.common.dependencies import get_current_admin
-from app.common.models import User
+from app.common.pagination import NEXT_CURSOR_HEADER
+from app.common.principal import Principal
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
 
+def _set_next_cursor(response: Response, next_cursor: Optional[str]) -> None:
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+
 @router.get("/stats", response_model=AdminStatsResponse)
-async def get_admin_stats(
-    current_user: User = Depends(get_current_admin),
+def get_admin_stats(
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
     stats = AdminService.get_stats(db)
     return stats
 
 
+@router.get("/stats/timeseries", response_model=AdminStatsTimeseriesResponse)
+def get_admin_stats_timeseries(
+    bucket: str = Query("day", pattern=STATS_BUCKET_PATTERN),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: Principal = Depends(get_current_admin),
+    db: Session = Depends(get_db),
+):
+    """Регистрации, консультации и выручка по часам или дням"""
+    return AdminService.get_stats_timeseries(db, bucket, start, end)
+
+
 @router.get("/users", response_model=List[AdminUserResponse])
-async def get_all_users(
+def get_all_users(
+    response: Response,
     role: Optional[str] = None,
-    limit: int = 50,
-    offset: int = 0,
-    current_user: User = Depends(get_current_admin),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
-    users = AdminService.get_users(db, role, limit, offset)
+    users, next_cursor = AdminService.get_users(db, role, limit, cursor)
+    _set_next_cursor(response, next_cursor)
     return users
 
 
 @router.patch("/users/{user_id}", response_model=AdminUserResponse)
-async def update_user(
+def update_user(
     user_id: int,
     user_update: AdminUserUpdate,
-    current_user: User = Depends(get_current_admin),
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
     updated = AdminService.update_user(db, user_id, user_update)
@@ -62,27 +91,36 @@ async def update_user(
 
 
 @router.get("/doctors/pending", response_model=List[AdminDoctorResponse])
-async def get_pending_doctors(
-    current_user: User = Depends(get_current_admin),
+def get_pending_doctors(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
-    doctors = AdminService.get_pending_doctors(db)
+    doctors, next_cursor = AdminService.get_pending_doctors(db, limit, cursor)
+    _set_next_cursor(response, next_cursor)
     return doctors
 
 
 @router.get("/doctors", response_model=List[AdminDoctorProfileResponse])
-async def get_all_doctor_profiles(
-    current_user: User = Depends(get_current_admin),
+def get_all_doctor_profiles(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
-    return AdminService.get_doctor_profiles(db)
+    doctors, next_cursor = AdminService.get_doctor_profiles(db, limit, cursor)
+    _set_next_cursor(response, next_cursor)
+    return doctors
 
 
 @router.put("/doctors/{doctor_id}/verify", response_model=dict)
-async def verify_doctor(
+def verify_doctor(
     doctor_id: int,
     verification_data: DoctorVerificationUpdate,
-    current_user: User = Depends(get_current_admin),
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
     result = AdminService.verify_doctor(db, doctor_id, verification_data)
@@ -90,19 +128,19 @@ async def verify_doctor(
 
 
 @router.get("/doctors/{doctor_id}", response_model=AdminDoctorProfileResponse)
-async def get_doctor_profile(
+def get_doctor_profile(
     doctor_id: int,
-    current_user: User = Depends(get_current_admin),
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
     return AdminService.get_doctor_profile(db, doctor_id)
 
 
 @router.patch("/doctors/{doctor_id}", response_model=AdminDoctorProfileResponse)
-async def update_doctor_profile(
+def update_doctor_profile(
     doctor_id: int,
     payload: AdminDoctorUpdate,
-    current_user: User = Depends(get_current_admin),
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
     return AdminService.update_doctor_profile(db, doctor_id, payload)
@@ -111,10 +149,10 @@ async def update_doctor_profile(
 @router.post(
     "/doctors/{doctor_id}/slots", response_model=List[AdminScheduleSlotResponse]
 )
-async def create_doctor_slots(
+def create_doctor_slots(
     doctor_id: int,
     payload: AdminDoctorSlotsRequest,
-    current_user: User = Depends(get_current_admin),
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
     return AdminService.create_doctor_slots(db, doctor_id, payload)
@@ -123,19 +161,19 @@ async def create_doctor_slots(
 @router.get(
     "/doctors/{doctor_id}/slots", response_model=List[AdminScheduleSlotResponse]
 )
-async def get_doctor_slots(
+def get_doctor_slots(
     doctor_id: int,
-    current_user: User = Depends(get_current_admin),
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
     return AdminService.get_doctor_slots(db, doctor_id)
 
 
 @router.delete("/doctors/{doctor_id}/slots/{slot_id}", status_code=204)
-async def delete_doctor_slot(
+def delete_doctor_slot(
     doctor_id: int,
     slot_id: int,
-    current_user: User = Depends(get_current_admin),
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
     AdminService.delete_doctor_slot(db, doctor_id, slot_id)
@@ -145,11 +183,11 @@ async def delete_doctor_slot(
 @router.patch(
     "/doctors/{doctor_id}/slots/{slot_id}", response_model=AdminScheduleSlotResponse
 )
-async def update_doctor_slot(
+def update_doctor_slot(
     doctor_id: int,
     slot_id: int,
     payload: AdminScheduleSlotUpdate,
-    current_user: User = Depends(get_current_admin),
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
     return AdminService.update_doctor_slot(db, doctor_id, slot_id, payload)
@@ -159,21 +197,23 @@ async def update_doctor_slot(
     "/consultations",
     response_model=List[AdminConsultationResponse],
 )
-async def get_consultations(
+def get_consultations(
+    response: Response,
     status: Optional[str] = None,
-    limit: int = 50,
-    offset: int = 0,
-    current_user: User = Depends(get_current_admin),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
-    consultations = AdminService.get_consultations(db, status, limit, offset)
+    consultations, next_cursor = AdminService.get_consultations(db, status, limit, cursor)
+    _set_next_cursor(response, next_cursor)
     return consultations
 
 
 @router.post("/consultations", response_model=AdminConsultationResponse)
-async def create_consultation(
+def create_consultation(
     payload: AdminConsultationCreate,
-    current_user: User = Depends(get_current_admin),
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
     consultation = AdminService.create_consultation(db, payload)
@@ -184,41 +224,65 @@ async def create_consultation(
     "/consultations/{consultation_id}",
     response_model=AdminConsultationResponse,
 )
-async def update_consultation_status(
+def update_consultation_status(
     consultation_id: int,
     payload: AdminConsultationUpdate,
-    current_user: User = Depends(get_current_admin),
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
     consultation = AdminService.update_consultation_status(db, consultation_id, payload)
     return consultation
 
 
-@router.put("/exchange-rates", response_model=dict)
-async def update_exchange_rates(
+@router.get("/exchange-rates", response_model=ExchangeRatesResponse)
+def get_exchange_rates(
+    current_user: Principal = Depends(get_current_admin),
+):
+    return AdminService.get_exchange_rates()
+
+
+@router.put("/exchange-rates", response_model=ExchangeRatesResponse)
+def update_exchange_rates(
     rates_data: ExchangeRateUpdate,
-    current_user: User = Depends(get_current_admin),
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
-    result = AdminService.update_exchange_rates(rates_data)
+    result = AdminService.update_exchange_rates(db, rates_data, current_user.id)
     return result
 
 
 @router.get("/transactions", response_model=List[AdminTransactionResponse])
-async def get_all_transactions(
-    limit: int = 100,
-    offset: int = 0,
-    current_user: User = Depends(get_current_admin),
+def get_all_transactions(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
-    transactions = AdminService.get_all_transactions(db, limit, offset)
+    transactions, next_cursor = AdminService.get_all_transactions(db, limit, cursor)
+    _set_next_cursor(response, next_cursor)
     return transactions
 
 
+@router.get("/transactions/export")
+def export_transactions(
+    format: str = Query("ndjson", pattern=EXPORT_FORMAT_PATTERN),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: Principal = Depends(get_current_admin),
+):
+    """Потоковая выгрузка всех транзакций кошельков (NDJSON или CSV) за период [start, end)"""
+    return StreamingResponse(
+        AdminService.export_transactions(format, start, end),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="wallet-transactions.{format}"'},
+    )
+
+
 @router.post("/wallets/top-up", response_model=AdminTransactionResponse)
-async def manual_wallet_top_up(
+def manual_wallet_top_up(
     payload: AdminWalletTopUpRequest,
-    current_user: User = Depends(get_current_admin),
+    current_user: Principal = Depends(get_current_admin),
     db: Session = Depends(get_db),
 ):
     transaction = AdminService.manual_top_up(db, payload)
@@ -1,8 +1,8 @@
 from datetime import datetime
 from decimal import Decimal
-from typing import Optional, List
+from typing import Dict, Optional, List
 
-from pydantic import BaseModel, field_validator, model_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 
 
 class AdminStatsResponse(BaseModel):
@@ -12,6 +12,21 @@ class AdminStatsResponse(BaseModel):
     total_consultations: int
     total_revenue_points: int
     active_doctors: int
+    computed_at: datetime
+
+
+class AdminStatsBucket(BaseModel):
+    bucket_start: datetime
+    registrations: int
+    consultations: int
+    completed_consultations: int
+    revenue_points: int
+
+
+class AdminStatsTimeseriesResponse(BaseModel):
+    bucket: str
+    buckets: List[AdminStatsBucket]
+    computed_at: datetime
 
 
 class AdminUserResponse(BaseModel):
@@ -75,9 +90,17 @@ class AdminDoctorProfileResponse(BaseModel):
 
 
 class ExchangeRateUpdate(BaseModel):
-    rate_rub: Optional[float] = None
-    rate_usd: Optional[float] = None
-    rate_eur: Optional[float] = None
+    rate_rub: Optional[Decimal] = Field(None, gt=0)
+    rate_usd: Optional[Decimal] = Field(None, gt=0)
+    rate_eur: Optional[Decimal] = Field(None, gt=0)
+    # Момент вступления в силу; по умолчанию — сразу
+    effective_from: Optional[datetime] = None
+
+
+class ExchangeRatesResponse(BaseModel):
+    rates: Dict[str, Decimal]
+    updated_rates: Dict[str, Decimal] = {}
+    effective_from: Optional[datetime] = None
 
 
 class AdminConsultationResponse(BaseModel):
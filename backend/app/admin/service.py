@@ -1,8 +1,13 @@
-from datetime import timedelta
+import csv
+import enum
+import io
+import json
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from fastapi import HTTPException, status
+from sqlalchemy import func, select, true
 from sqlalchemy.orm import Session
 
 from app.admin.schemas import (
@@ -21,6 +26,7 @@ from app.common.models import (
     Consultation,
     ConsultationStatus,
     DoctorProfile,
+    ExchangeRate,
     PatientProfile,
     ScheduleSlot,
     User,
@@ -29,38 +35,205 @@ from app.common.models import (
     WalletTransaction,
     TransactionType,
 )
+from app.common.cache import TieredCache
+from app.common.database import SessionLocal
+from app.common.pagination import InvalidCursorError, paginate_by_created
+from app.common.principal import invalidate_principal
+from app.config import settings
+from app.payments.rates import rate_store
 from app.services.consultation_service import ConsultationService
+from app.wallet.ledger import Ledger
 from app.wallet.service import WalletService
 from app.doctors.service import DoctorService
+from app.schedule.service import ScheduleService
+
+
+STATS_CACHE_KEY = "summary"
+STATS_BUCKETS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+STATS_BUCKET_PATTERN = "^(hour|day)$"
+STATS_DEFAULT_BUCKETS = 30
+STATS_MAX_BUCKETS = 1000
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_FORMAT_PATTERN = "^(ndjson|csv)$"
+EXPORT_BATCH_SIZE = 1000
+
+# Кэш живёт не дольше допустимой устаревшести; computed_at внутри значения
+# дополнительно отсекает записи, пересидевшие в локальном уровне
+stats_cache = TieredCache(
+    "admin_stats",
+    ttl=settings.ADMIN_STATS_MAX_STALENESS_SECONDS,
+    maxsize=256,
+    local_ttl=settings.CACHE_LOCAL_TTL_SECONDS,
+    use_redis=settings.CACHE_BACKEND == "redis",
+)
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _stats_age(stats: dict) -> float:
+    computed_at = datetime.fromisoformat(stats["computed_at"])
+    return (datetime.now(timezone.utc) - computed_at).total_seconds()
+
+
+def _truncate(value: datetime, bucket: str) -> datetime:
+    value = value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if bucket == "day" else value
+
+
+def _bucket_expression(db: Session, column, bucket: str):
+    if db.get_bind().dialect.name == "postgresql":
+        return func.date_trunc(bucket, func.timezone("UTC", column))
+    # SQLite и прочие: строка вида "YYYY-MM-DD HH:00:00"
+    pattern = "%Y-%m-%d 00:00:00" if bucket == "day" else "%Y-%m-%d %H:00:00"
+    return func.strftime(pattern, column)
+
+
+def _paginate(query, model, cursor: Optional[str], limit: int, descending: bool = True):
+    try:
+        return paginate_by_created(query, model.created_at, model.id, cursor, limit, descending)
+    except InvalidCursorError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
+        )
+
+
+def _export_value(value):
+    # Суммы строкой, чтобы не терять точность Decimal при выгрузке
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _parse_bucket(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return _as_utc(value)
 
 
 class AdminService:
+    @staticmethod
+    def _compute_stats(db: Session) -> dict:
+        # Один запрос: три однострочных агрегата, склеенных JOIN ON true
+        users = select(
+            func.count(User.id).label("total_users"),
+            func.count(User.id).filter(User.role == UserRole.PATIENT).label("total_patients"),
+            func.count(User.id).filter(User.role == UserRole.DOCTOR).label("total_doctors"),
+        ).subquery()
+        consultations = select(
+            func.count(Consultation.id).label("total_consultations"),
+            func.coalesce(
+                func.sum(Consultation.points_cost).filter(
+                    Consultation.status == ConsultationStatus.COMPLETED
+                ),
+                0,
+            ).label("total_revenue_points"),
+        ).subquery()
+        doctors = select(
+            func.count(DoctorProfile.id).label("active_doctors")
+        ).where(DoctorProfile.is_verified.is_(True)).subquery()
+
+        row = db.execute(
+            select(users, consultations, doctors).select_from(
+                users.join(consultations, true()).join(doctors, true())
+            )
+        ).one()
+        stats = {key: int(value or 0) for key, value in row._mapping.items()}
+        stats["computed_at"] = datetime.now(timezone.utc).isoformat()
+        return stats
+
     @staticmethod
     def get_stats(db: Session) -> dict:
-        total_users = db.query(User).count()
-        total_patients = db.query(User).filter(User.role == UserRole.PATIENT).count()
-        total_doctors = db.query(User).filter(User.role == UserRole.DOCTOR).count()
-        total_consultations = db.query(Consultation).count()
-        
-        total_revenue_points = (
-            db.query(Consultation.points_cost)
-            .filter(Consultation.status == ConsultationStatus.COMPLETED)
-            .all()
-        )
-        revenue_sum = sum(points for (points,) in total_revenue_points)
-        
-        active_doctors = (
-            db.query(DoctorProfile).filter(DoctorProfile.is_verified.is_(True)).count()
+        """
+        Сводка для дашборда из кэша; данные не старше ADMIN_STATS_MAX_STALENESS_SECONDS.
+        """
+        stats = stats_cache.get(STATS_CACHE_KEY)
+        if stats is None or _stats_age(stats) > settings.ADMIN_STATS_MAX_STALENESS_SECONDS:
+            stats = AdminService._compute_stats(db)
+            stats_cache.set(STATS_CACHE_KEY, stats)
+        return stats
+
+    @staticmethod
+    def get_stats_timeseries(
+        db: Session,
+        bucket: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> dict:
+        """
+        Регистрации, консультации и выручка по часовым или дневным корзинам
+        в полуинтервале [start, end). Пустые корзины заполняются нулями.
+        """
+        step = STATS_BUCKETS[bucket]
+        # По умолчанию — до конца текущей корзины, чтобы ключ кэша не менялся каждый запрос
+        end = _as_utc(end) if end else _truncate(datetime.now(timezone.utc), bucket) + step
+        start = _as_utc(start) if start else end - step * STATS_DEFAULT_BUCKETS
+        first = _truncate(start, bucket)
+        if first >= end:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="start must be before end",
+            )
+        if (end - first) / step > STATS_MAX_BUCKETS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Range is too large: at most {STATS_MAX_BUCKETS} buckets",
+            )
+
+        cache_key = f"series:{bucket}:{first.isoformat()}:{end.isoformat()}"
+        cached = stats_cache.get(cache_key)
+        if cached is not None and _stats_age(cached) <= settings.ADMIN_STATS_MAX_STALENESS_SECONDS:
+            return cached
+
+        series = {}
+        current = first
+        while current < end:
+            series[current] = {
+                "bucket_start": current.isoformat(),
+                "registrations": 0,
+                "consultations": 0,
+                "completed_consultations": 0,
+                "revenue_points": 0,
+            }
+            current += step
+
+        def collect(column, where, **aggregates):
+            key = _bucket_expression(db, column, bucket).label("bucket")
+            query = (
+                select(key, *[value.label(name) for name, value in aggregates.items()])
+                .where(column >= first, column < end, *where)
+                .group_by(key)
+            )
+            for row in db.execute(query):
+                point = series.get(_parse_bucket(row.bucket))
+                if point is None:
+                    continue
+                for name in aggregates:
+                    point[name] += int(getattr(row, name) or 0)
+
+        collect(User.created_at, [], registrations=func.count(User.id))
+        collect(Consultation.created_at, [], consultations=func.count(Consultation.id))
+        collect(
+            Consultation.ended_at,
+            [Consultation.status == ConsultationStatus.COMPLETED],
+            completed_consultations=func.count(Consultation.id),
+            revenue_points=func.coalesce(func.sum(Consultation.points_cost), 0),
         )
-        
-        return {
-            "total_users": total_users,
-            "total_patients": total_patients,
-            "total_doctors": total_doctors,
-            "total_consultations": total_consultations,
-            "total_revenue_points": revenue_sum,
-            "active_doctors": active_doctors,
+
+        result = {
+            "bucket": bucket,
+            "buckets": list(series.values()),
+            "computed_at": datetime.now(timezone.utc).isoformat(),
         }
+        stats_cache.set(cache_key, result)
+        return result
 
     @staticmethod
     def _full_name_from_profiles(
@@ -130,9 +303,9 @@ class AdminService:
         db: Session,
         role: Optional[str] = None,
         limit: int = 50,
-        offset: int = 0,
-    ) -> List[dict]:
-        query = db.query(User).order_by(User.created_at.desc())
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        query = db.query(User)
         if role:
             try:
                 query = query.filter(User.role == UserRole(role.lower()))
@@ -142,7 +315,7 @@ class AdminService:
                     detail="Invalid role filter",
                 )
 
-        users = query.limit(limit).offset(offset).all()
+        users, next_cursor = _paginate(query, User, cursor, limit)
         user_ids = [user.id for user in users]
 
         patient_profiles = {
@@ -167,7 +340,7 @@ class AdminService:
                 user, patient_profiles, doctor_profiles, wallets
             )
             for user in users
-        ]
+        ], next_cursor
 
     @staticmethod
     def update_user(
@@ -196,6 +369,8 @@ class AdminService:
 
         AdminService._ensure_profiles_for_user(db, user)
         db.commit()
+        # Роль, статус и профили закэшированы в Principal
+        invalidate_principal(user.id)
 
         patient_profiles = {
             profile.user_id: profile
@@ -219,30 +394,19 @@ class AdminService:
         )
     
     @staticmethod
-    def get_pending_doctors(db: Session) -> List[dict]:
-        doctor_users = db.query(User).filter(User.role == UserRole.DOCTOR).all()
-        if doctor_users:
-            existing_profiles = {
-                profile.user_id for profile in db.query(DoctorProfile.user_id).all()
-            }
-            missing_profiles = {user.id for user in doctor_users} - existing_profiles
-            if missing_profiles:
-                for user in doctor_users:
-                    if user.id in missing_profiles:
-                        db.add(
-                            DoctorProfile(
-                                user_id=user.id,
-                                verification_status="pending",
-                                is_verified=False,
-                            )
-                        )
-                db.commit()
-
-        doctors = (
-            db.query(DoctorProfile)
-            .filter(DoctorProfile.verification_status == "pending")
-            .order_by(DoctorProfile.created_at.asc())
-            .all()
+    def get_pending_doctors(
+        db: Session,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        # Профили врачей создают регистрация и смена роли (_ensure_profiles_for_user),
+        # старым пользователям их досоздала миграция c8e2f5a9b1d4
+        doctors, next_cursor = _paginate(
+            db.query(DoctorProfile).filter(DoctorProfile.verification_status == "pending"),
+            DoctorProfile,
+            cursor,
+            limit,
+            descending=False,
         )
         users = {
             user.id: user
@@ -274,11 +438,15 @@ class AdminService:
                     else None,
                 }
             )
-        return result
+        return result, next_cursor
     
     @staticmethod
-    def get_doctor_profiles(db: Session) -> List[AdminDoctorProfileResponse]:
-        doctors = db.query(DoctorProfile).order_by(DoctorProfile.created_at.desc()).all()
+    def get_doctor_profiles(
+        db: Session,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[AdminDoctorProfileResponse], Optional[str]]:
+        doctors, next_cursor = _paginate(db.query(DoctorProfile), DoctorProfile, cursor, limit)
         user_ids = [doctor.user_id for doctor in doctors]
         users = {
             user.id: user
@@ -287,7 +455,7 @@ class AdminService:
         return [
             AdminService._serialize_doctor_profile(doctor, users.get(doctor.user_id))
             for doctor in doctors
-        ]
+        ], next_cursor
 
     @staticmethod
     def get_doctor_profile(db: Session, doctor_id: int) -> AdminDoctorProfileResponse:
@@ -341,6 +509,7 @@ class AdminService:
             doctor.is_verified = verification_status == "approved"
         db.commit()
         db.refresh(doctor)
+        DoctorService.invalidate_catalog()
         user = db.query(User).filter(User.id == doctor.user_id).first()
         return AdminService._serialize_doctor_profile(doctor, user)
 
@@ -379,6 +548,7 @@ class AdminService:
         db.commit()
         for schedule in created:
             db.refresh(schedule)
+        ScheduleService.invalidate_next_slots(doctor.id)
         return [
             {
                 "id": schedule.id,
@@ -448,6 +618,7 @@ class AdminService:
             )
         db.delete(slot)
         db.commit()
+        ScheduleService.invalidate_next_slots(doctor.id)
 
     @staticmethod
     def update_doctor_slot(
@@ -494,6 +665,7 @@ class AdminService:
         slot.end_time = payload.end_time
         db.commit()
         db.refresh(slot)
+        ScheduleService.invalidate_next_slots(doctor.id)
         return {
             "id": slot.id,
             "doctor_id": slot.doctor_id,
@@ -520,6 +692,7 @@ class AdminService:
         doctor.is_verified = verification_data.verification_status == "approved"
         
         db.commit()
+        DoctorService.invalidate_catalog()
         
         return {
             "status": "success",
@@ -576,9 +749,9 @@ class AdminService:
         db: Session,
         status: Optional[str],
         limit: int,
-        offset: int,
-    ) -> List[dict]:
-        query = db.query(Consultation).order_by(Consultation.created_at.desc())
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        query = db.query(Consultation)
         if status and status != "all":
             try:
                 query = query.filter(Consultation.status == ConsultationStatus(status))
@@ -588,7 +761,7 @@ class AdminService:
                     detail="Invalid consultation status",
                 )
 
-        consultations = query.limit(limit).offset(offset).all()
+        consultations, next_cursor = _paginate(query, Consultation, cursor, limit)
 
         patient_profile_ids = [c.patient_id for c in consultations]
         doctor_profile_ids = [c.doctor_id for c in consultations]
@@ -623,7 +796,7 @@ class AdminService:
                 consultation, patient_profiles, doctor_profiles, users
             )
             for consultation in consultations
-        ]
+        ], next_cursor
 
     @staticmethod
     def get_consultation_detail(db: Session, consultation_id: int) -> dict:
@@ -749,17 +922,13 @@ class AdminService:
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Patient wallet has insufficient points",
                 )
-            patient_wallet.balance = wallet_balance + shortfall
-            top_up_transaction = WalletTransaction(
-                wallet_id=patient_wallet.id,
-                transaction_type=TransactionType.CREDIT,
-                amount=shortfall,
-                balance_before=wallet_balance,
-                balance_after=patient_wallet.balance,
+            Ledger.post(
+                db,
+                patient_user.id,
+                TransactionType.CREDIT,
+                shortfall,
                 description="Пополнение администратором для бронирования консультации",
             )
-            db.add(top_up_transaction)
-            db.flush()
 
         start_time = payload.start_time
         end_time = start_time + timedelta(minutes=payload.duration_minutes)
@@ -824,40 +993,124 @@ class AdminService:
         return AdminService.get_consultation_detail(db, consultation_id)
     
     @staticmethod
-    def update_exchange_rates(rates_data: ExchangeRateUpdate) -> dict:
-        updated_rates = {}
-        
-        if rates_data.rate_rub is not None:
-            updated_rates["RUB"] = rates_data.rate_rub
-        if rates_data.rate_usd is not None:
-            updated_rates["USD"] = rates_data.rate_usd
-        if rates_data.rate_eur is not None:
-            updated_rates["EUR"] = rates_data.rate_eur
-        
+    def get_exchange_rates() -> dict:
+        return {"rates": rate_store.current_rates()}
+
+    @staticmethod
+    def update_exchange_rates(db: Session, rates_data: ExchangeRateUpdate, admin_id: int) -> dict:
+        """Добавляет новые курсы в историю; старые записи остаются для аудита"""
+        updated_rates = {
+            currency: rate
+            for currency, rate in (
+                ("RUB", rates_data.rate_rub),
+                ("USD", rates_data.rate_usd),
+                ("EUR", rates_data.rate_eur),
+            )
+            if rate is not None
+        }
+        if not updated_rates:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="No exchange rates provided",
+            )
+
+        effective_from = rates_data.effective_from or datetime.now(timezone.utc)
+        db.add_all(
+            ExchangeRate(
+                currency=currency,
+                rate=rate,
+                effective_from=effective_from,
+                created_by_id=admin_id,
+            )
+            for currency, rate in updated_rates.items()
+        )
+        db.commit()
+        rate_store.notify_changed()
+
         return {
-            "status": "success",
+            "rates": rate_store.current_rates(),
             "updated_rates": updated_rates,
-            "message": "Exchange rates updated (in production, save to database)",
+            "effective_from": effective_from,
         }
     
     @staticmethod
     def get_all_transactions(
         db: Session,
         limit: int = 100,
-        offset: int = 0,
-    ) -> List[dict]:
-        transactions = (
-            db.query(WalletTransaction)
-            .order_by(WalletTransaction.created_at.desc())
-            .limit(limit)
-            .offset(offset)
-            .all()
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        transactions, next_cursor = _paginate(
+            db.query(WalletTransaction), WalletTransaction, cursor, limit
         )
 
         return [
             AdminService._serialize_transaction(transaction)
             for transaction in transactions
-        ]
+        ], next_cursor
+
+    @staticmethod
+    def export_transactions(
+        export_format: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> Iterator[str]:
+        """
+        Потоковая выгрузка транзакций кошельков в NDJSON или CSV.
+
+        Читает серверным курсором пачками по EXPORT_BATCH_SIZE строк и отдаёт
+        текст по пачке за раз, так что память не зависит от объёма выгрузки.
+        Сессия своя: генератор живёт дольше запроса, в котором создан.
+        """
+        query = (
+            select(
+                WalletTransaction.id,
+                WalletTransaction.created_at,
+                Wallet.user_id,
+                WalletTransaction.wallet_id,
+                WalletTransaction.transaction_type,
+                WalletTransaction.amount,
+                WalletTransaction.balance_before,
+                WalletTransaction.balance_after,
+                WalletTransaction.related_consultation_id,
+                WalletTransaction.description,
+            )
+            .join(Wallet, Wallet.id == WalletTransaction.wallet_id)
+            .order_by(WalletTransaction.created_at.asc(), WalletTransaction.id.asc())
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        if start:
+            query = query.where(WalletTransaction.created_at >= start)
+        if end:
+            query = query.where(WalletTransaction.created_at < end)
+
+        db = SessionLocal()
+        try:
+            result = db.execute(query)
+            columns = list(result.keys())
+            if export_format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(columns)
+                for batch in result.partitions():
+                    writer.writerows(
+                        [_export_value(value) for value in row] for row in batch
+                    )
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                yield buffer.getvalue()
+            else:
+                for batch in result.partitions():
+                    yield "".join(
+                        json.dumps(
+                            dict(zip(columns, (_export_value(value) for value in row))),
+                            ensure_ascii=False,
+                        )
+                        + "\n"
+                        for row in batch
+                    )
+        finally:
+            db.close()
 
     @staticmethod
     def _serialize_transaction(transaction: WalletTransaction) -> dict:
@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.common.database import get_db
-from app.common.dependencies import get_current_user
-from app.common.models import User
-from app.auth.schemas import UserRegister, UserLogin, Token, TokenRefresh, UserResponse, EmailVerification
+from app.common.database import get_async_db, get_db
+from app.common.dependencies import get_current_user, security
+from app.common.principal import Principal
+from app.common.security import decode_token
+from app.auth.schemas import (
+    UserRegister, UserLogin, Token, TokenRefresh, UserResponse, EmailVerification,
+    SessionResponse, SessionsRevokedResponse,
+)
 from app.auth.service import AuthService
+from app.auth.sessions import SessionStore
 
 router = APIRouter()
 
@@ -12,36 +20,37 @@ router = APIRouter()
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register(
     user_data: UserRegister,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Регистрация нового пользователя"""
-    user = AuthService.register_user(db, user_data)
+    user = await AuthService.register_user_async(db, user_data)
     return user
 
 
 @router.post("/login", response_model=Token)
 async def login(
     login_data: UserLogin,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Авторизация пользователя"""
-    user = AuthService.authenticate_user(db, login_data)
-    tokens = AuthService.create_tokens(db, user)
+    user = await AuthService.authenticate_user_async(db, login_data)
+    tokens = await AuthService.create_tokens_async(db, user, request.headers.get("user-agent"))
     return tokens
 
 
 @router.post("/refresh", response_model=Token)
 async def refresh_token(
     token_data: TokenRefresh,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Обновление access token"""
-    tokens = AuthService.refresh_access_token(db, token_data.refresh_token)
+    tokens = await AuthService.refresh_access_token_async(db, token_data.refresh_token)
     return tokens
 
 
 @router.post("/verify-email")
-async def verify_email(
+def verify_email(
     verification_data: EmailVerification,
     db: Session = Depends(get_db)
 ):
@@ -53,17 +62,58 @@ async def verify_email(
 @router.post("/logout")
 async def logout(
     token_data: TokenRefresh,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Выход из системы"""
-    result = AuthService.logout(db, token_data.refresh_token)
+    result = await AuthService.logout_async(db, token_data.refresh_token)
     return {"logged_out": result}
 
 
 @router.get("/me", response_model=UserResponse)
 async def get_current_user_info(
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     """Получение информации о текущем пользователе"""
     return current_user
 
+
+def _current_session_id(credentials: HTTPAuthorizationCredentials) -> Optional[int]:
+    payload = decode_token(credentials.credentials) or {}
+    return payload.get("sid")
+
+
+@router.get("/sessions", response_model=List[SessionResponse])
+async def list_sessions(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Активные сессии текущего пользователя, новые сверху"""
+    current_session_id = _current_session_id(credentials)
+    sessions = await SessionStore.list_for_user(db, current_user.id)
+    return [
+        SessionResponse.model_validate(session).model_copy(update={"current": session.id == current_session_id})
+        for session in sessions
+    ]
+
+
+@router.delete("/sessions/{session_id}", response_model=SessionsRevokedResponse)
+async def revoke_session(
+    session_id: int,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Отозвать сессию: её refresh token больше не обновляется"""
+    revoked = await SessionStore.revoke(db, current_user.id, session_id)
+    if not revoked:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found")
+    return {"revoked": revoked}
+
+
+@router.delete("/sessions", response_model=SessionsRevokedResponse)
+async def revoke_all_sessions(
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Выйти на всех устройствах"""
+    return {"revoked": await SessionStore.revoke(db, current_user.id)}
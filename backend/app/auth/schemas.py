@@ -38,6 +38,23 @@ class UserResponse(BaseModel):
         from_attributes = True
 
 
+class SessionResponse(BaseModel):
+    """Активная сессия пользователя (одно устройство/вход)"""
+    id: int
+    user_agent: Optional[str] = None
+    created_at: Optional[datetime] = None
+    last_used_at: Optional[datetime] = None
+    expires_at: datetime
+    current: bool = False
+    
+    class Config:
+        from_attributes = True
+
+
+class SessionsRevokedResponse(BaseModel):
+    revoked: int
+
+
 class EmailVerification(BaseModel):
     email: EmailStr
     code: str
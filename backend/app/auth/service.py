@@ -1,16 +1,27 @@
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
-from datetime import datetime, timedelta, timezone, date
+from datetime import datetime, timezone, date
 from typing import Optional, Tuple
 from app.common.models import (
     User,
-    RefreshToken,
     UserRole,
     Wallet,
     PatientProfile,
     DoctorProfile,
 )
-from app.common.security import verify_password, get_password_hash, create_access_token, create_refresh_token, decode_token
+from app.auth.sessions import SessionStore
+from app.common.principal import Principal, get_principal_async, principal_cache
+from app.common.security import (
+    PasswordHashBusyError,
+    create_access_token,
+    create_refresh_token,
+    decode_token,
+    password_hasher,
+    password_needs_rehash,
+)
 from app.auth.schemas import UserRegister, UserLogin
 import secrets
 
@@ -35,26 +46,49 @@ def _convert_date(dt: Optional[date]) -> Optional[datetime]:
     return datetime.combine(dt, datetime.min.time(), tzinfo=timezone.utc)
 
 
+def _password_hash_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many authentication requests, try again later",
+        headers={"Retry-After": "1"},
+    )
+
+
+def _email_taken() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Email already registered"
+    )
+
+
 class AuthService:
     @staticmethod
-    def register_user(db: Session, user_data: UserRegister) -> User:
+    async def register_user_async(db: AsyncSession, user_data: UserRegister) -> User:
         # Проверка существования пользователя
-        existing_user = db.query(User).filter(User.email == user_data.email).first()
-        if existing_user:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already registered"
-            )
+        existing_user_id = await db.scalar(select(User.id).where(User.email == user_data.email))
+        if existing_user_id:
+            raise _email_taken()
+        
+        # bcrypt — в пуле password_hasher, не в event loop
+        try:
+            password_hash = await password_hasher.hash(user_data.password)
+        except PasswordHashBusyError:
+            raise _password_hash_busy()
         
         # Создание пользователя
         user = User(
             email=user_data.email,
-            password_hash=get_password_hash(user_data.password),
+            password_hash=password_hash,
             role=UserRole(user_data.role) if user_data.role else UserRole.PATIENT,
             is_verified=False
         )
         db.add(user)
-        db.flush()
+        try:
+            await db.flush()
+        except IntegrityError:
+            # Тот же email успели зарегистрировать параллельно
+            await db.rollback()
+            raise _email_taken()
         
         # Создание кошелька и профилей
         wallet = Wallet(user_id=user.id, balance=0, frozen_balance=0)
@@ -81,20 +115,29 @@ class AuthService:
             doctor_profile.middle_name = middle_name
             db.add(doctor_profile)
         
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
         return user
     
     @staticmethod
-    def authenticate_user(db: Session, login_data: UserLogin) -> User:
-        user = db.query(User).filter(User.email == login_data.email).first()
+    async def authenticate_user_async(db: AsyncSession, login_data: UserLogin) -> User:
+        user = await db.scalar(select(User).where(User.email == login_data.email))
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect email or password"
             )
         
-        if not verify_password(login_data.password, user.password_hash):
+        try:
+            valid = await password_hasher.verify(login_data.password, user.password_hash)
+            if valid and password_needs_rehash(user.password_hash):
+                # Стоимость BCRYPT_ROUNDS поменялась — пароль известен только сейчас
+                user.password_hash = await password_hasher.hash(login_data.password)
+                await db.commit()
+        except PasswordHashBusyError:
+            raise _password_hash_busy()
+        
+        if not valid:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect email or password"
@@ -109,35 +152,39 @@ class AuthService:
         return user
     
     @staticmethod
-    def create_tokens(db: Session, user: User) -> dict:
-        access_token_expires = timedelta(minutes=30)
-        access_token = create_access_token(
-            data={"sub": str(user.id), "email": user.email, "role": user.role.value},
-            expires_delta=access_token_expires
+    def _access_token(principal: Principal, session_id: int) -> str:
+        # sid — id сессии: по нему список сессий отмечает текущую;
+        # роль и профили нужны режиму AUTH_MODE=stateless
+        return create_access_token(
+            data={"sub": str(principal.id), "sid": session_id, **principal.to_claims()}
         )
-        
+    
+    @staticmethod
+    async def create_tokens_async(
+        db: AsyncSession,
+        user: User,
+        user_agent: Optional[str] = None
+    ) -> dict:
         refresh_token = create_refresh_token(
             data={"sub": str(user.id)}
         )
         
-        # Сохранение refresh token в БД
-        expires_at = datetime.now(timezone.utc) + timedelta(days=7)
-        db_refresh_token = RefreshToken(
-            user_id=user.id,
-            token=refresh_token,
-            expires_at=expires_at
+        # В БД и Redis попадает только хэш refresh token
+        session = await SessionStore.create(
+            db, user.id, refresh_token, SessionStore.refresh_expires_at(), user_agent
         )
-        db.add(db_refresh_token)
-        db.commit()
+        await SessionStore.commit_created(db, session)
+        # Из БД, а не из кэша: claims токена должны быть свежими
+        principal = await get_principal_async(db, user.id, use_cache=False)
         
         return {
-            "access_token": access_token,
+            "access_token": AuthService._access_token(principal, session.id),
             "refresh_token": refresh_token,
             "token_type": "bearer"
         }
     
     @staticmethod
-    def refresh_access_token(db: Session, refresh_token: str) -> dict:
+    async def refresh_access_token_async(db: AsyncSession, refresh_token: str) -> dict:
         payload = decode_token(refresh_token)
         if payload is None or payload.get("type") != "refresh":
             raise HTTPException(
@@ -145,48 +192,37 @@ class AuthService:
                 detail="Invalid refresh token"
             )
         
-        # Проверка токена в БД
-        db_token = db.query(RefreshToken).filter(
-            RefreshToken.token == refresh_token
-        ).first()
-        
-        if not db_token or db_token.expires_at < datetime.now(timezone.utc):
+        resolved = await SessionStore.resolve(db, refresh_token)
+        if resolved is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Refresh token expired or invalid"
             )
+        session_id, user_id = resolved
         
-        user = db.query(User).filter(User.id == db_token.user_id).first()
-        if not user or not user.is_active:
+        # Мимо кэша: после отзыва токенов в нём ещё может быть старая роль
+        principal = await get_principal_async(db, user_id, use_cache=False)
+        if principal is None or not principal.is_active:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="User not found or inactive"
             )
         
-        # Создание новых токенов
-        access_token_expires = timedelta(minutes=30)
-        new_access_token = create_access_token(
-            data={"sub": str(user.id), "email": user.email, "role": user.role.value},
-            expires_delta=access_token_expires
-        )
-        
+        # Новый токен той же сессии; старый перестаёт действовать
         new_refresh_token = create_refresh_token(
-            data={"sub": str(user.id)}
+            data={"sub": str(user_id)}
         )
-        
-        # Удаление старого refresh token и добавление нового
-        db.delete(db_token)
-        expires_at = datetime.now(timezone.utc) + timedelta(days=7)
-        db_new_refresh_token = RefreshToken(
-            user_id=user.id,
-            token=new_refresh_token,
-            expires_at=expires_at
+        rotated = await SessionStore.rotate(
+            db, session_id, refresh_token, new_refresh_token, SessionStore.refresh_expires_at()
         )
-        db.add(db_new_refresh_token)
-        db.commit()
+        if not rotated:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Refresh token expired or invalid"
+            )
         
         return {
-            "access_token": new_access_token,
+            "access_token": AuthService._access_token(principal, session_id),
             "refresh_token": new_refresh_token,
             "token_type": "bearer"
         }
@@ -202,19 +238,17 @@ class AuthService:
                 detail="User not found"
             )
         
+        if user.is_verified:
+            return True
         user.is_verified = True
         db.commit()
+        # Только сброс кэша, без отзыва токенов: эндпоинт без аутентификации,
+        # и отзыв позволил бы любому разлогинивать пользователя по email.
+        # В stateless-режиме is_verified в токене обновится при refresh.
+        principal_cache.delete(user.id)
         return True
     
     @staticmethod
-    def logout(db: Session, refresh_token: str) -> bool:
-        db_token = db.query(RefreshToken).filter(
-            RefreshToken.token == refresh_token
-        ).first()
-        
-        if db_token:
-            db.delete(db_token)
-            db.commit()
-        
+    async def logout_async(db: AsyncSession, refresh_token: str) -> bool:
+        await SessionStore.revoke_token(db, refresh_token)
         return True
-
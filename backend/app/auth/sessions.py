@@ -0,0 +1,259 @@
+"""Хранилище сессий (refresh token'ов).
+
+В БД лежит не сам токен, а его SHA-256 (64 символа, уникальный индекс):
+утечка таблицы не даёт готовых токенов, а поиск идёт по ключу
+фиксированной длины. Строка refresh_tokens — это сессия: при обновлении
+токена хэш меняется на месте, поэтому id сессии стабилен и по нему сессию
+можно показать в списке и отозвать.
+
+При SESSION_STORE_BACKEND=redis активные сессии дублируются в Redis с
+родным TTL (session:<хэш> -> "<id сессии>:<id пользователя>"), и refresh
+находит сессию без запроса к БД. Решение всё равно принимает Postgres:
+ротация — UPDATE по id и старому хэшу, так что ключ, который не удалось
+стереть из Redis при отзыве, сессию не воскресит. Просроченные строки
+удаляет SessionPurger.
+"""
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+import structlog
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.common.database import SessionLocal
+from app.common.models import RefreshToken
+from app.config import settings
+
+logger = structlog.get_logger()
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _redis_key(token_hash: str) -> str:
+    return f"session:{token_hash}"
+
+
+class SessionStore:
+    use_redis = settings.SESSION_STORE_BACKEND == "redis"
+
+    @staticmethod
+    def refresh_expires_at() -> datetime:
+        return datetime.now(timezone.utc) + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+
+    @staticmethod
+    async def _cache(token_hash: str, session_id: int, user_id: int, expires_at: datetime) -> None:
+        if not SessionStore.use_redis:
+            return
+        from app.common.redis import get_async_redis
+
+        ttl = int((_as_utc(expires_at) - datetime.now(timezone.utc)).total_seconds())
+        if ttl <= 0:
+            return
+        try:
+            await get_async_redis().set(_redis_key(token_hash), f"{session_id}:{user_id}", ex=ttl)
+        except Exception as exc:
+            logger.warning("Session cache write failed", error=str(exc))
+
+    @staticmethod
+    async def _forget(*token_hashes: str) -> None:
+        if not SessionStore.use_redis or not token_hashes:
+            return
+        from app.common.redis import get_async_redis
+
+        try:
+            await get_async_redis().delete(*(_redis_key(token_hash) for token_hash in token_hashes))
+        except Exception as exc:
+            # Не страшно: ротация всё равно сверяется с БД
+            logger.warning("Session cache delete failed", error=str(exc))
+
+    @staticmethod
+    async def _cached(token_hash: str) -> Optional[Tuple[int, int]]:
+        if not SessionStore.use_redis:
+            return None
+        from app.common.redis import get_async_redis
+
+        try:
+            value = await get_async_redis().get(_redis_key(token_hash))
+        except Exception as exc:
+            logger.warning("Session cache read failed", error=str(exc))
+            return None
+        if value is None:
+            return None
+        session_id, user_id = value.split(":")
+        return int(session_id), int(user_id)
+
+    @staticmethod
+    async def create(
+        db: AsyncSession,
+        user_id: int,
+        token: str,
+        expires_at: datetime,
+        user_agent: Optional[str] = None,
+    ) -> RefreshToken:
+        """Добавляет сессию в транзакцию db; в Redis она попадает после commit_created."""
+        session = RefreshToken(
+            user_id=user_id,
+            token_hash=hash_token(token),
+            user_agent=(user_agent or "")[:255] or None,
+            expires_at=expires_at,
+        )
+        db.add(session)
+        await db.flush()
+        return session
+
+    @staticmethod
+    async def commit_created(db: AsyncSession, session: RefreshToken) -> None:
+        await db.commit()
+        await SessionStore._cache(session.token_hash, session.id, session.user_id, session.expires_at)
+
+    @staticmethod
+    async def resolve(db: AsyncSession, token: str) -> Optional[Tuple[int, int]]:
+        """(id сессии, id пользователя) для живого токена или None."""
+        token_hash = hash_token(token)
+        cached = await SessionStore._cached(token_hash)
+        if cached is not None:
+            return cached
+        row = (
+            await db.execute(
+                select(RefreshToken.id, RefreshToken.user_id, RefreshToken.expires_at).where(
+                    RefreshToken.token_hash == token_hash,
+                    RefreshToken.expires_at > datetime.now(timezone.utc),
+                )
+            )
+        ).first()
+        if row is None:
+            return None
+        # Redis мог потерять ключ (рестарт, вытеснение) — вернём его
+        await SessionStore._cache(token_hash, row.id, row.user_id, row.expires_at)
+        return row.id, row.user_id
+
+    @staticmethod
+    async def rotate(
+        db: AsyncSession,
+        session_id: int,
+        old_token: str,
+        new_token: str,
+        expires_at: datetime,
+    ) -> bool:
+        """Заменяет токен сессии; False — токен уже использован или сессия отозвана."""
+        old_hash, new_hash = hash_token(old_token), hash_token(new_token)
+        result = await db.execute(
+            update(RefreshToken)
+            .where(
+                RefreshToken.id == session_id,
+                RefreshToken.token_hash == old_hash,
+                RefreshToken.expires_at > datetime.now(timezone.utc),
+            )
+            .values(token_hash=new_hash, expires_at=expires_at, last_used_at=datetime.now(timezone.utc))
+            .returning(RefreshToken.user_id)
+        )
+        user_id = result.scalar()
+        await db.commit()
+        await SessionStore._forget(old_hash)
+        if user_id is None:
+            return False
+        await SessionStore._cache(new_hash, session_id, user_id, expires_at)
+        return True
+
+    @staticmethod
+    async def list_for_user(db: AsyncSession, user_id: int) -> List[RefreshToken]:
+        result = await db.execute(
+            select(RefreshToken)
+            .where(RefreshToken.user_id == user_id, RefreshToken.expires_at > datetime.now(timezone.utc))
+            .order_by(RefreshToken.created_at.desc(), RefreshToken.id.desc())
+        )
+        return list(result.scalars())
+
+    @staticmethod
+    async def revoke(db: AsyncSession, user_id: int, session_id: Optional[int] = None) -> int:
+        """Отзывает сессию пользователя (без session_id — все); возвращает число отозванных."""
+        statement = delete(RefreshToken).where(RefreshToken.user_id == user_id)
+        if session_id is not None:
+            statement = statement.where(RefreshToken.id == session_id)
+        result = await db.execute(statement.returning(RefreshToken.token_hash))
+        token_hashes = list(result.scalars())
+        await db.commit()
+        await SessionStore._forget(*token_hashes)
+        return len(token_hashes)
+
+    @staticmethod
+    async def revoke_token(db: AsyncSession, token: str) -> bool:
+        token_hash = hash_token(token)
+        result = await db.execute(
+            delete(RefreshToken).where(RefreshToken.token_hash == token_hash).returning(RefreshToken.id)
+        )
+        revoked = result.scalar() is not None
+        await db.commit()
+        await SessionStore._forget(token_hash)
+        return revoked
+
+    @staticmethod
+    def purge_expired(batch_size: int) -> int:
+        """Удаляет пачку просроченных сессий по индексу expires_at; возвращает их число."""
+        db = SessionLocal()
+        try:
+            expired_ids = (
+                select(RefreshToken.id)
+                .where(RefreshToken.expires_at <= datetime.now(timezone.utc))
+                .limit(batch_size)
+                .scalar_subquery()
+            )
+            result = db.execute(
+                delete(RefreshToken).where(RefreshToken.id.in_(expired_ids)),
+                execution_options={"synchronize_session": False},
+            )
+            db.commit()
+            return result.rowcount
+        finally:
+            db.close()
+
+
+class SessionPurger:
+    """Фоновое удаление просроченных сессий внутри API-процесса."""
+
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is None and settings.SESSION_PURGE_INTERVAL_SECONDS > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        batch_size = settings.SESSION_PURGE_BATCH_SIZE
+        while True:
+            purged = 0
+            try:
+                # Пачками, чтобы не держать длинную транзакцию на большой таблице
+                while True:
+                    deleted = await asyncio.to_thread(SessionStore.purge_expired, batch_size)
+                    purged += deleted
+                    if deleted < batch_size:
+                        break
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error("Session purge failed", error=str(exc))
+            if purged:
+                logger.info("Expired sessions purged", count=purged)
+            await asyncio.sleep(settings.SESSION_PURGE_INTERVAL_SECONDS)
+
+
+session_purger = SessionPurger()
@@ -0,0 +1,159 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+import structlog
+
+logger = structlog.get_logger()
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш в памяти процесса с ограничением времени жизни."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class TieredCache:
+    """Двухуровневый кэш: локальный TTLCache и, опционально, общий Redis.
+
+    Значения во втором уровне хранятся как JSON, поэтому кэшировать нужно
+    сериализуемые структуры (dict/list/str/числа). Ошибки Redis не ломают
+    запрос: кэш просто считается пустым.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: float,
+        maxsize: int = 10_000,
+        local_ttl: Optional[float] = None,
+        use_redis: bool = False,
+    ) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=min(ttl, local_ttl or ttl))
+        self.use_redis = use_redis
+
+    def _key(self, key: Hashable) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    def get(self, key: Hashable) -> Any:
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if not self.use_redis:
+            return None
+        try:
+            from app.common.redis import get_redis
+
+            raw = get_redis().get(self._key(key))
+        except Exception as exc:
+            logger.warning("Cache read failed", namespace=self.namespace, error=str(exc))
+            return None
+        if raw is None:
+            return None
+        value = json.loads(raw)
+        self.local.set(key, value)
+        return value
+
+    async def get_async(self, key: Hashable) -> Any:
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if not self.use_redis:
+            return None
+        try:
+            from app.common.redis import get_async_redis
+
+            raw = await get_async_redis().get(self._key(key))
+        except Exception as exc:
+            logger.warning("Cache read failed", namespace=self.namespace, error=str(exc))
+            return None
+        if raw is None:
+            return None
+        value = json.loads(raw)
+        self.local.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.local.set(key, value)
+        if not self.use_redis:
+            return
+        try:
+            from app.common.redis import get_redis
+
+            get_redis().set(self._key(key), json.dumps(value), ex=int(self.ttl))
+        except Exception as exc:
+            logger.warning("Cache write failed", namespace=self.namespace, error=str(exc))
+
+    async def set_async(self, key: Hashable, value: Any) -> None:
+        self.local.set(key, value)
+        if not self.use_redis:
+            return
+        try:
+            from app.common.redis import get_async_redis
+
+            await get_async_redis().set(self._key(key), json.dumps(value), ex=int(self.ttl))
+        except Exception as exc:
+            logger.warning("Cache write failed", namespace=self.namespace, error=str(exc))
+
+    def delete(self, key: Hashable) -> None:
+        self.local.delete(key)
+        if not self.use_redis:
+            return
+        try:
+            from app.common.redis import get_redis
+
+            get_redis().delete(self._key(key))
+        except Exception as exc:
+            logger.warning("Cache delete failed", namespace=self.namespace, error=str(exc))
+
+    async def delete_async(self, key: Hashable) -> None:
+        self.local.delete(key)
+        if not self.use_redis:
+            return
+        try:
+            from app.common.redis import get_async_redis
+
+            await get_async_redis().delete(self._key(key))
+        except Exception as exc:
+            logger.warning("Cache delete failed", namespace=self.namespace, error=str(exc))
@@ -1,9 +1,14 @@
+from typing import Optional, Tuple
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.common.database import get_db
-from app.common.models import User, UserRole
+from app.common.database import get_async_db
+from app.common.models import UserRole
+from app.common.principal import Principal, get_principal, get_principal_async, token_revocations
 from app.common.security import decode_token
+from app.config import settings
 
 security = HTTPBearer()
 
@@ -12,8 +17,7 @@ class TokenValidationError(ValueError):
     """Raised when a token cannot be validated."""
 
 
-def get_user_by_token(db: Session, token: str) -> User:
-    """Возвращает пользователя по строковому JWT токену или бросает TokenValidationError."""
+def _decode_access_token(token: str) -> Tuple[int, dict]:
     payload = decode_token(token)
 
     if payload is None:
@@ -24,33 +28,75 @@ def get_user_by_token(db: Session, token: str) -> User:
         raise TokenValidationError("invalid_token")
 
     try:
-        user_id = int(user_id_str)
+        return int(user_id_str), payload
     except (ValueError, TypeError):
         raise TokenValidationError("invalid_token")
 
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
+
+def _ensure_active(principal: Principal) -> Principal:
+    if principal is None:
         raise TokenValidationError("user_not_found")
 
-    if not user.is_active:
+    if not principal.is_active:
         raise TokenValidationError("inactive_user")
 
-    return user
+    return principal
+
+
+def _principal_from_claims(user_id: int, payload: dict) -> Optional[Principal]:
+    """Principal из токена в stateless-режиме; None — идти в кэш/БД."""
+    if settings.AUTH_MODE != "stateless" or "iat" not in payload:
+        return None
+    try:
+        return Principal.from_claims(user_id, payload)
+    except (KeyError, ValueError, TypeError):
+        # Токен выдан до появления claims профиля
+        return None
+
+
+def _ensure_not_revoked(principal: Principal, payload: dict, valid_after: float) -> Principal:
+    if payload["iat"] < valid_after:
+        raise TokenValidationError("revoked_token")
+    return principal
+
+
+def get_user_by_token(db: Session, token: str) -> Principal:
+    """Возвращает пользователя по строковому JWT токену или бросает TokenValidationError."""
+    user_id, payload = _decode_access_token(token)
+    principal = _principal_from_claims(user_id, payload)
+    if principal is not None:
+        valid_after = token_revocations.valid_after(user_id)
+        if valid_after is not None:
+            return _ensure_not_revoked(principal, payload, valid_after)
+        # Отзыв проверить не удалось — сверяемся с БД, как в режиме principal
+    return _ensure_active(get_principal(db, user_id))
+
+
+async def get_user_by_token_async(db: AsyncSession, token: str) -> Principal:
+    """Асинхронный вариант get_user_by_token, не блокирует event loop."""
+    user_id, payload = _decode_access_token(token)
+    principal = _principal_from_claims(user_id, payload)
+    if principal is not None:
+        valid_after = await token_revocations.valid_after_async(user_id)
+        if valid_after is not None:
+            return _ensure_not_revoked(principal, payload, valid_after)
+    return _ensure_active(await get_principal_async(db, user_id))
 
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
+    db: AsyncSession = Depends(get_async_db)
+) -> Principal:
     token = credentials.credentials
 
     try:
-        return get_user_by_token(db, token)
+        return await get_user_by_token_async(db, token)
     except TokenValidationError as exc:
         detail_map = {
             "invalid_token": "Invalid authentication credentials",
             "user_not_found": "User not found",
             "inactive_user": "Inactive user",
+            "revoked_token": "Token has been revoked",
         }
         detail = detail_map.get(str(exc), "Invalid authentication credentials")
         status_code = status.HTTP_403_FORBIDDEN if str(exc) == "inactive_user" else status.HTTP_401_UNAUTHORIZED
@@ -62,8 +108,8 @@ async def get_current_user(
 
 
 async def get_current_active_patient(
-    current_user: User = Depends(get_current_user)
-) -> User:
+    current_user: Principal = Depends(get_current_user)
+) -> Principal:
     if current_user.role not in {UserRole.PATIENT, UserRole.DOCTOR}:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -73,8 +119,8 @@ async def get_current_active_patient(
 
 
 async def get_current_active_doctor(
-    current_user: User = Depends(get_current_user)
-) -> User:
+    current_user: Principal = Depends(get_current_user)
+) -> Principal:
     if current_user.role != UserRole.DOCTOR:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -84,8 +130,8 @@ async def get_current_active_doctor(
 
 
 async def get_current_admin(
-    current_user: User = Depends(get_current_user)
-) -> User:
+    current_user: Principal = Depends(get_current_user)
+) -> Principal:
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
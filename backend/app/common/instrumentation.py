@@ -0,0 +1,141 @@
+"""Метрики HTTP-запросов и SQL на запрос.
+
+RequestMetricsMiddleware меряет время, размер ответа и число запросов в
+работе по шаблону маршрута (/api/v1/doctors/{doctor_id}, а не конкретный
+URL). На время запроса в contextvar лежит RequestStats, куда события
+курсора движков SQLAlchemy складывают число запросов и время в БД.
+Синхронные эндпоинты и зависимости FastAPI выполняет в пуле потоков с
+копией контекста, поэтому их запросы тоже попадают в счёт. Запрос с числом
+SQL больше REQUEST_QUERY_WARN_THRESHOLD пишется в лог с маршрутом —
+обычно это N+1.
+"""
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+import structlog
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.common.metrics import counter, gauge, histogram
+from app.config import settings
+
+logger = structlog.get_logger()
+
+UNMATCHED_ROUTE = "unmatched"
+KNOWN_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+
+requests_total = counter(
+    "doclink_http_requests_total", "HTTP-запросы", ["method", "route", "status"]
+)
+request_duration = histogram(
+    "doclink_http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+requests_in_progress = gauge(
+    "doclink_http_requests_in_progress", "HTTP-запросы в работе", ["method"]
+)
+response_size = histogram(
+    "doclink_http_response_size_bytes",
+    "Размер тела ответа",
+    ["route"],
+    buckets=(100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000),
+)
+db_queries = histogram(
+    "doclink_db_queries_per_request",
+    "SQL-запросы на один HTTP-запрос",
+    ["route"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200),
+)
+db_time = histogram(
+    "doclink_db_time_per_request_seconds",
+    "Суммарное время SQL на один HTTP-запрос",
+    ["route"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is not None and request_stats.get() is not None:
+        context._request_query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    stats = request_stats.get()
+    started = getattr(context, "_request_query_started", None)
+    if stats is None or started is None:
+        return
+    stats.queries += 1
+    stats.db_seconds += time.perf_counter() - started
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Подключает счёт SQL к движку (для AsyncEngine — к его sync_engine)."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class RequestMetricsMiddleware:
+    """ASGI-middleware: без BaseHTTPMiddleware, чтобы не буферизовать ответы."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"] if scope["method"] in KNOWN_METHODS else "OTHER"
+        status_code = 500
+        body_size = 0
+
+        async def send_wrapper(message) -> None:
+            nonlocal status_code, body_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                body_size += len(message.get("body", b""))
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        in_progress = requests_in_progress.labels(method)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - started
+            in_progress.dec()
+            request_stats.reset(token)
+            # Маршрут известен только после роутинга: FastAPI кладёт его в scope
+            route = scope.get("route")
+            route_path = getattr(route, "path", UNMATCHED_ROUTE)
+            requests_total.labels(method, route_path, str(status_code)).inc()
+            request_duration.labels(method, route_path).observe(duration)
+            response_size.labels(route_path).observe(body_size)
+            db_queries.labels(route_path).observe(stats.queries)
+            db_time.labels(route_path).observe(stats.db_seconds)
+            if stats.queries > settings.REQUEST_QUERY_WARN_THRESHOLD:
+                logger.warning(
+                    "Too many SQL queries per request",
+                    method=method,
+                    route=route_path,
+                    status=status_code,
+                    queries=stats.queries,
+                    db_ms=round(stats.db_seconds * 1000, 1),
+                    duration_ms=round(duration * 1000, 1),
+                )
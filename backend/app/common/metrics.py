@@ -0,0 +1,83 @@
+"""Метрики Prometheus.
+
+prometheus_client — необязательная зависимость: без него (или при
+METRICS_ENABLED=false) метрики превращаются в пустые заглушки, а
+/metrics не подключается. При нескольких воркерах uvicorn/gunicorn
+задайте PROMETHEUS_MULTIPROC_DIR — тогда /metrics собирает значения всех
+процессов.
+"""
+import itertools
+import os
+from typing import Optional, Sequence, Tuple
+
+from app.config import settings
+
+try:
+    import prometheus_client
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+ENABLED = prometheus_client is not None and settings.METRICS_ENABLED
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs) -> "_NoopMetric":
+        return self
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def dec(self, amount: float = 1) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+
+_NOOP = _NoopMetric()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()):
+    if not ENABLED:
+        return _NOOP
+    return prometheus_client.Counter(name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()):
+    if not ENABLED:
+        return _NOOP
+    # livesum: в multiprocess-режиме складываем значения живых процессов
+    return prometheus_client.Gauge(name, documentation, labelnames, multiprocess_mode="livesum")
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Optional[Sequence[float]] = None):
+    if not ENABLED:
+        return _NOOP
+    if buckets is None:
+        return prometheus_client.Histogram(name, documentation, labelnames)
+    return prometheus_client.Histogram(name, documentation, labelnames, buckets=buckets)
+
+
+class Sampler:
+    """Каждое N-е событие при доле rate: дешевле random() на горячем пути."""
+
+    def __init__(self, rate: float) -> None:
+        self.every = max(1, round(1 / rate)) if ENABLED and rate > 0 else 0
+        self._counter = itertools.count()
+
+    def __call__(self) -> bool:
+        return bool(self.every) and next(self._counter) % self.every == 0
+
+
+def render() -> Tuple[bytes, str]:
+    """Тело и Content-Type ответа /metrics."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
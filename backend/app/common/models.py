@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Enum as SQLEnum, Numeric, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Enum as SQLEnum, Numeric, JSON, Index, UniqueConstraint, text, DDL, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -33,13 +33,21 @@ class User(Base):
 
 
 class RefreshToken(Base):
+    """Сессия пользователя: refresh token хранится только как SHA-256 (app/auth/sessions.py)"""
     __tablename__ = "refresh_tokens"
+    __table_args__ = (
+        Index("ix_refresh_tokens_user_id", "user_id"),
+        Index("ix_refresh_tokens_token_hash", "token_hash", unique=True),
+        Index("ix_refresh_tokens_expires_at", "expires_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    token = Column(String(500), unique=True, nullable=False)
+    token_hash = Column(String(64), nullable=False)
+    user_agent = Column(String(255))
     expires_at = Column(DateTime(timezone=True), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True))
     
     user = relationship("User", back_populates="refresh_tokens")
 
@@ -64,6 +72,27 @@ class PatientProfile(Base):
 
 class DoctorProfile(Base):
     __tablename__ = "doctor_profiles"
+    __table_args__ = (
+        # Триграммные индексы для поиска каталога по подстроке (ILIKE '%...%')
+        Index(
+            "ix_doctor_profiles_specialty_trgm",
+            "specialty",
+            postgresql_using="gin",
+            postgresql_ops={"specialty": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_doctor_profiles_last_name_trgm",
+            "last_name",
+            postgresql_using="gin",
+            postgresql_ops={"last_name": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_doctor_profiles_first_name_trgm",
+            "first_name",
+            postgresql_using="gin",
+            postgresql_ops={"first_name": "gin_trgm_ops"},
+        ),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), unique=True, nullable=False)
@@ -89,8 +118,19 @@ class DoctorProfile(Base):
     consultations = relationship("Consultation", back_populates="doctor")
 
 
+# gin_trgm_ops нужен pg_trgm до создания таблицы через create_all
+event.listen(
+    DoctorProfile.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+
 class DoctorCertificate(Base):
     __tablename__ = "doctor_certificates"
+    __table_args__ = (
+        Index("ix_doctor_certificates_doctor_id", "doctor_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     doctor_id = Column(Integer, ForeignKey("doctor_profiles.id"), nullable=False)
@@ -106,6 +146,9 @@ class DoctorCertificate(Base):
 
 class MedicalFile(Base):
     __tablename__ = "medical_files"
+    __table_args__ = (
+        Index("ix_medical_files_patient_id", "patient_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     patient_id = Column(Integer, ForeignKey("patient_profiles.id"), nullable=False)
@@ -120,6 +163,15 @@ class MedicalFile(Base):
 
 class ScheduleSlot(Base):
     __tablename__ = "schedule_slots"
+    __table_args__ = (
+        Index("ix_schedule_slots_doctor_id_start_time", "doctor_id", "start_time"),
+        # Только свободные слоты: основной фильтр каталога записи
+        Index(
+            "ix_schedule_slots_open_start_time",
+            "start_time",
+            postgresql_where=text("is_available = true AND is_reserved = false"),
+        ),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     doctor_id = Column(Integer, ForeignKey("doctor_profiles.id"), nullable=False)
@@ -142,6 +194,11 @@ class ConsultationStatus(str, enum.Enum):
 
 class Consultation(Base):
     __tablename__ = "consultations"
+    __table_args__ = (
+        Index("ix_consultations_patient_id_created_at", "patient_id", "created_at"),
+        Index("ix_consultations_doctor_id_created_at", "doctor_id", "created_at"),
+        Index("ix_consultations_slot_id", "slot_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     patient_id = Column(Integer, ForeignKey("patient_profiles.id"), nullable=False)
@@ -165,6 +222,9 @@ class Consultation(Base):
 
 class ConsultationMessage(Base):
     __tablename__ = "consultation_messages"
+    __table_args__ = (
+        Index("ix_consultation_messages_consultation_id_created_at", "consultation_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     consultation_id = Column(Integer, ForeignKey("consultations.id"), nullable=False)
@@ -215,6 +275,9 @@ class TransactionType(str, enum.Enum):
 
 class WalletTransaction(Base):
     __tablename__ = "wallet_transactions"
+    __table_args__ = (
+        Index("ix_wallet_transactions_wallet_id_created_at", "wallet_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     wallet_id = Column(Integer, ForeignKey("wallets.id"), nullable=False)
@@ -231,6 +294,10 @@ class WalletTransaction(Base):
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        Index("ix_payments_user_id_created_at", "user_id", "created_at"),
+        Index("ix_payments_provider_transaction_id", "provider_transaction_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -244,6 +311,48 @@ class Payment(Base):
     completed_at = Column(DateTime(timezone=True))
 
 
+class PaymentCallbackEvent(Base):
+    """Сырой callback платёжной системы; одна строка на транзакцию провайдера."""
+    __tablename__ = "payment_callbacks"
+    __table_args__ = (
+        UniqueConstraint("provider", "transaction_id", name="uq_payment_callbacks_provider_transaction_id"),
+        Index(
+            "ix_payment_callbacks_pending",
+            "available_at",
+            "id",
+            postgresql_where=text("state = 'pending'"),
+        ),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String(50), nullable=False)
+    transaction_id = Column(String(255), nullable=False)
+    status = Column(String(50), nullable=False)  # статус от провайдера: pending, completed, succeeded, failed
+    amount = Column(Numeric(10, 2))
+    payload = Column(JSON)
+    state = Column(String(20), nullable=False, default="pending")  # pending, processed, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    available_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    processed_at = Column(DateTime(timezone=True))
+
+
+class ExchangeRate(Base):
+    """Курс валюты в поинтах; действует с effective_from до следующей записи."""
+    __tablename__ = "exchange_rates"
+    __table_args__ = (
+        Index("ix_exchange_rates_currency_effective_from", "currency", "effective_from"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    currency = Column(String(3), nullable=False)
+    rate = Column(Numeric(18, 6), nullable=False)
+    effective_from = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    created_by_id = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class SubscriptionPlan(Base):
     __tablename__ = "subscription_plans"
     
@@ -328,6 +437,9 @@ class DoctorEarnings(Base):
 
 class Notification(Base):
     __tablename__ = "notifications"
+    __table_args__ = (
+        Index("ix_notifications_user_id_is_read_created_at", "user_id", "is_read", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -337,3 +449,32 @@ class Notification(Base):
     is_read = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+
+class NotificationOutbox(Base):
+    """Доставка уведомления по внешнему каналу; пишется в той же транзакции, что и уведомление."""
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        Index(
+            "ix_notification_outbox_pending",
+            "channel",
+            "available_at",
+            "id",
+            postgresql_where=text("state = 'pending'"),
+        ),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    notification_id = Column(Integer, ForeignKey("notifications.id", ondelete="SET NULL"))
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    channel = Column(String(20), nullable=False)  # email, sms, push
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=False)
+    state = Column(String(20), nullable=False, default="pending")  # pending, sent, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    available_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(DateTime(timezone=True))
+    
+    notification = relationship("Notification")
+
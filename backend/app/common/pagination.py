@@ -0,0 +1,83 @@
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+# Заголовок с курсором следующей страницы для keyset-пагинации
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Unsupported cursor value: {value!r}")
+
+
+def encode_cursor(*values: Any) -> str:
+    """Упаковывает ключ последней строки страницы в непрозрачную строку."""
+    raw = json.dumps(list(values), default=_json_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """Распаковывает курсор из encode_cursor; size — ожидаемое число значений."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursorError("invalid_cursor") from exc
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursorError("invalid_cursor")
+    return values
+
+
+def decode_datetime(value: Any) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursorError("invalid_cursor") from exc
+
+
+def paginate_by_created(
+    query: Query,
+    created_column,
+    id_column,
+    cursor: Optional[str],
+    limit: int,
+    descending: bool = True,
+) -> Tuple[list, Optional[str]]:
+    """
+    Keyset-страница ORM-запроса по (created_at, id) вместо OFFSET.
+
+    Сортировка запроса заменяется на (created_at, id); возвращает строки
+    страницы и курсор следующей (None — страница последняя).
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor, 2)
+        if not isinstance(row_id, int):
+            raise InvalidCursorError("invalid_cursor")
+        key = tuple_(created_column, id_column)
+        bound = (decode_datetime(created_at), row_id)
+        query = query.filter(key < bound if descending else key > bound)
+
+    order = (
+        (created_column.desc(), id_column.desc())
+        if descending
+        else (created_column.asc(), id_column.asc())
+    )
+    rows = query.order_by(None).order_by(*order).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, created_column.key), getattr(last, id_column.key))
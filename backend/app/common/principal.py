@@ -0,0 +1,253 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+import structlog
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.common.cache import TieredCache, TTLCache
+from app.common.models import DoctorProfile, PatientProfile, User, UserRole
+from app.config import settings
+
+principal_cache = TieredCache(
+    "principal",
+    ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+    maxsize=settings.PRINCIPAL_CACHE_MAX_SIZE,
+    local_ttl=settings.PRINCIPAL_CACHE_LOCAL_TTL_SECONDS,
+    use_redis=settings.PRINCIPAL_CACHE_BACKEND == "redis",
+)
+
+logger = structlog.get_logger()
+
+# Поля Principal, которые access token несёт в stateless-режиме (AUTH_MODE)
+CLAIM_FIELDS = ("email", "role", "is_verified", "created_at", "patient_profile_id", "doctor_profile_id")
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Аутентифицированный пользователь: то, что нужно роутам без похода в БД."""
+
+    id: int
+    email: str
+    role: UserRole
+    is_active: bool
+    is_verified: bool
+    created_at: Optional[datetime]
+    patient_profile_id: Optional[int] = None
+    doctor_profile_id: Optional[int] = None
+
+    def to_cache(self) -> dict:
+        data = asdict(self)
+        data["role"] = self.role.value
+        data["created_at"] = self.created_at.isoformat() if self.created_at else None
+        return data
+
+    @classmethod
+    def from_cache(cls, data: dict) -> "Principal":
+        return cls(
+            **{
+                **data,
+                "role": UserRole(data["role"]),
+                "created_at": datetime.fromisoformat(data["created_at"]) if data["created_at"] else None,
+            }
+        )
+
+    def to_claims(self) -> dict:
+        data = self.to_cache()
+        return {field: data[field] for field in CLAIM_FIELDS}
+
+    @classmethod
+    def from_claims(cls, user_id: int, payload: dict) -> "Principal":
+        # Токены выдаются только активным; деактивация отзывает их через token_revocations
+        return cls.from_cache(
+            {**{field: payload[field] for field in CLAIM_FIELDS}, "id": user_id, "is_active": True}
+        )
+
+
+def _principal_query(user_id: int):
+    # Пользователь и оба профиля одним запросом
+    return (
+        select(User, PatientProfile.id, DoctorProfile.id)
+        .outerjoin(PatientProfile, PatientProfile.user_id == User.id)
+        .outerjoin(DoctorProfile, DoctorProfile.user_id == User.id)
+        .where(User.id == user_id)
+    )
+
+
+def _to_principal(row) -> Optional[Principal]:
+    if row is None:
+        return None
+    user, patient_profile_id, doctor_profile_id = row
+    return Principal(
+        id=user.id,
+        email=user.email,
+        role=user.role,
+        is_active=bool(user.is_active),
+        is_verified=bool(user.is_verified),
+        created_at=user.created_at,
+        patient_profile_id=patient_profile_id,
+        doctor_profile_id=doctor_profile_id,
+    )
+
+
+def get_principal(db: Session, user_id: int) -> Optional[Principal]:
+    cached = principal_cache.get(user_id)
+    if cached is not None:
+        return Principal.from_cache(cached)
+
+    principal = _to_principal(db.execute(_principal_query(user_id)).first())
+    if principal is not None:
+        principal_cache.set(user_id, principal.to_cache())
+    return principal
+
+
+async def get_principal_async(db: AsyncSession, user_id: int, use_cache: bool = True) -> Optional[Principal]:
+    """use_cache=False — прочитать из БД, минуя локальные копии других воркеров."""
+    if use_cache:
+        cached = await principal_cache.get_async(user_id)
+        if cached is not None:
+            return Principal.from_cache(cached)
+
+    result = await db.execute(_principal_query(user_id))
+    principal = _to_principal(result.first())
+    if principal is not None:
+        await principal_cache.set_async(user_id, principal.to_cache())
+    return principal
+
+
+class TokenRevocations:
+    """Момент, раньше которого access token'ы пользователя недействительны.
+
+    Нужен stateless-режиму: токен несёт роль и профили и не сверяется с БД,
+    поэтому смена роли, статуса или профилей отзывает все выданные токены,
+    а клиент получает новый через refresh. С PRINCIPAL_CACHE_BACKEND=redis
+    момент отзыва общий для воркеров (auth:valid_after:<id> с TTL времени
+    жизни access token) и кэшируется в процессе на
+    AUTH_REVOCATION_CACHE_SECONDS, включая отсутствие отзыва. Без Redis
+    отзыв виден только в процессе, где он сделан.
+
+    Отзывы процесса хранятся, пока живут отозванные токены, без вытеснения
+    по размеру: вытесненная запись молча вернула бы токенам силу. Если
+    записать отзыв в Redis не удалось, пользователь до успешной повторной
+    записи проверяется по БД (valid_after возвращает None).
+    """
+
+    def __init__(self) -> None:
+        self.ttl = settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        self.use_redis = settings.PRINCIPAL_CACHE_BACKEND == "redis"
+        self.local = TTLCache(settings.PRINCIPAL_CACHE_MAX_SIZE, settings.AUTH_REVOCATION_CACHE_SECONDS)
+        # user_id -> момент отзыва в порядке отзыва: старые записи в начале
+        self._revoked: "OrderedDict[int, float]" = OrderedDict()
+        # Отзывы, которые не удалось записать в Redis
+        self._unsynced: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"auth:valid_after:{user_id}"
+
+    def _remember(self, user_id: int, valid_after: float) -> None:
+        with self._lock:
+            self._revoked.pop(user_id, None)
+            self._revoked[user_id] = valid_after
+            # Токены, выданные до now - ttl, уже истекли: такие отзывы не нужны
+            horizon = time.time() - self.ttl
+            while self._revoked and next(iter(self._revoked.values())) < horizon:
+                self._revoked.popitem(last=False)
+
+    def _revoked_at(self, user_id: int) -> float:
+        value = self._revoked.get(user_id, 0.0)
+        return value if value >= time.time() - self.ttl else 0.0
+
+    def _write(self, user_id: int, valid_after: float) -> bool:
+        try:
+            from app.common.redis import get_redis
+
+            get_redis().set(self._key(user_id), valid_after, ex=self.ttl)
+        except Exception as exc:
+            logger.error("Token revocation write failed", user_id=user_id, error=str(exc))
+            with self._lock:
+                self._unsynced[user_id] = valid_after
+            return False
+        with self._lock:
+            if self._unsynced.get(user_id) == valid_after:
+                del self._unsynced[user_id]
+        return True
+
+    def _flush(self) -> None:
+        """Повторяет записи в Redis, которые не прошли раньше."""
+        with self._lock:
+            pending = list(self._unsynced.items())
+        for user_id, valid_after in pending:
+            if not self._write(user_id, valid_after):
+                return
+
+    def revoke(self, user_id: int) -> None:
+        valid_after = time.time()
+        self._remember(user_id, valid_after)
+        self.local.set(user_id, valid_after)
+        if not self.use_redis:
+            return
+        if self._write(user_id, valid_after):
+            self._flush()
+
+    def valid_after(self, user_id: int) -> Optional[float]:
+        """0 — отзывов не было; None — проверить отзыв не удалось, нужна БД."""
+        if not self.use_redis:
+            return self._revoked_at(user_id)
+        if user_id in self._unsynced:
+            self._flush()
+            if user_id in self._unsynced:
+                return None
+        cached = self.local.get(user_id)
+        if cached is not None:
+            return cached
+        try:
+            from app.common.redis import get_redis
+
+            raw = get_redis().get(self._key(user_id))
+        except Exception as exc:
+            logger.warning("Token revocation read failed", user_id=user_id, error=str(exc))
+            return None
+        value = max(float(raw) if raw is not None else 0.0, self._revoked_at(user_id))
+        self.local.set(user_id, value)
+        return value
+
+    async def valid_after_async(self, user_id: int) -> Optional[float]:
+        if not self.use_redis:
+            return self._revoked_at(user_id)
+        if user_id in self._unsynced:
+            # Повтор записи синхронный — уносим его с event loop
+            await asyncio.to_thread(self._flush)
+            if user_id in self._unsynced:
+                return None
+        cached = self.local.get(user_id)
+        if cached is not None:
+            return cached
+        try:
+            from app.common.redis import get_async_redis
+
+            raw = await get_async_redis().get(self._key(user_id))
+        except Exception as exc:
+            logger.warning("Token revocation read failed", user_id=user_id, error=str(exc))
+            return None
+        value = max(float(raw) if raw is not None else 0.0, self._revoked_at(user_id))
+        self.local.set(user_id, value)
+        return value
+
+
+token_revocations = TokenRevocations()
+
+
+def invalidate_principal(user_id: int) -> None:
+    """Сбрасывает кэш после смены роли, статуса или профилей пользователя."""
+    principal_cache.delete(user_id)
+    # Отзываем и в режиме principal: иначе после переключения на stateless
+    # старые токены с прежней ролью снова стали бы действительны
+    token_revocations.revoke(user_id)
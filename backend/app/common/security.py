@@ -1,14 +1,43 @@
+import asyncio
+import math
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Callable, Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from app.common.metrics import counter, gauge, histogram
 from app.config import settings
 import bcrypt
 
+# bcrypt учитывает только первые 72 байта пароля
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+password_hash_queue = gauge("doclink_password_hash_queue_depth", "Операции bcrypt, ждущие свободного потока")
+password_hash_in_progress = gauge("doclink_password_hash_in_progress", "Операции bcrypt в работе")
+password_hash_wait = histogram(
+    "doclink_password_hash_wait_seconds",
+    "Ожидание потока для bcrypt",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+password_hash_duration = histogram(
+    "doclink_password_hash_seconds",
+    "Время одной операции bcrypt",
+    ["operation"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+password_hash_rejected = counter("doclink_password_hash_rejected_total", "Отказы из-за переполненной очереди bcrypt")
+
+
+def _password_bytes(password: str) -> bytes:
+    return password.encode('utf-8')[:BCRYPT_MAX_PASSWORD_BYTES]
+
+
 # Используем прямой bcrypt для избежания проблем с инициализацией passlib
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     try:
-        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+        return bcrypt.checkpw(_password_bytes(plain_password), hashed_password.encode('utf-8'))
     except:
         # Fallback на passlib если bcrypt не работает
         pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -16,13 +45,83 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 
 def get_password_hash(password: str) -> str:
-    # Используем прямой bcrypt
-    password_bytes = password.encode('utf-8')
-    # Ограничиваем до 72 байт
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password_bytes, salt).decode('utf-8')
+    # Используем прямой bcrypt; стоимость — BCRYPT_ROUNDS
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
+    return bcrypt.hashpw(_password_bytes(password), salt).decode('utf-8')
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Хэш не bcrypt или сделан с другой стоимостью, чем BCRYPT_ROUNDS."""
+    parts = hashed_password.split("$")  # $2b$12$<соль и хэш>
+    if len(parts) != 4 or not parts[1].startswith("2"):
+        return True
+    return parts[2] != f"{settings.BCRYPT_ROUNDS:02d}"
+
+
+class PasswordHashBusyError(Exception):
+    """Очередь bcrypt переполнена: лучше быстро отказать, чем копить ожидание."""
+
+
+class PasswordHasher:
+    """
+    bcrypt (~250 мс CPU) в отдельном пуле из PASSWORD_HASH_WORKERS потоков:
+    bcrypt отпускает GIL, поэтому event loop и остальные запросы не ждут
+    входа. Ожидающих операций не больше PASSWORD_HASH_MAX_PENDING,
+    остальным — PasswordHashBusyError.
+    """
+
+    def __init__(self) -> None:
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS,
+                thread_name_prefix="password-hash",
+            )
+        return self._executor
+
+    @staticmethod
+    def _timed(operation: str, submitted: float, func: Callable, *args):
+        password_hash_queue.dec()
+        password_hash_wait.observe(time.perf_counter() - submitted)
+        password_hash_in_progress.inc()
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            password_hash_in_progress.dec()
+            password_hash_duration.labels(operation).observe(time.perf_counter() - started)
+
+    async def _run(self, operation: str, func: Callable, *args):
+        # Счётчик правится только из event loop, блокировка не нужна
+        if self._pending >= settings.PASSWORD_HASH_MAX_PENDING:
+            password_hash_rejected.inc()
+            raise PasswordHashBusyError()
+        self._pending += 1
+        password_hash_queue.inc()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._get_executor(), self._timed, operation, time.perf_counter(), func, *args
+            )
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run("verify", verify_password, plain_password, hashed_password)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -31,7 +130,10 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # iat с миллисекундами: сравнивается с моментом отзыва токенов пользователя.
+    # Отбрасываем, а не округляем: округление вверх сделало бы токен, выданный
+    # в ту же миллисекунду до отзыва, «новее» отзыва
+    to_encode.update({"exp": expire, "iat": math.floor(time.time() * 1000) / 1000})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
@@ -39,7 +141,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 def create_refresh_token(data: dict) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expire, "type": "refresh"})
+    # jti: два входа в одну секунду не должны получить одинаковый токен
+    to_encode.update({"exp": expire, "type": "refresh", "jti": secrets.token_urlsafe(16)})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
@@ -1,17 +1,247 @@
-import os
-import shutil
+import hashlib
+import mimetypes
+import re
+import threading
 import unicodedata
 import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Tuple
+from typing import BinaryIO, Iterator, Optional, Tuple
+from urllib.parse import quote
 
-UPLOAD_ROOT = Path("uploads")
+from fastapi import Request, status
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+
+UPLOAD_ROOT = Path(settings.STORAGE_LOCAL_ROOT)
+
+CHUNK_SIZE = 1024 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
 
 
 class StorageError(Exception):
     """Raised when saving or reading a stored file fails."""
 
 
+@dataclass
+class StoredObject:
+    key: str
+    size: int
+    etag: str
+    content_type: Optional[str] = None
+
+
+class StorageBackend(ABC):
+    """Хранилище файлов по ключу вида ``<folder>/<uuid>_<name>``."""
+
+    @abstractmethod
+    def save(self, fileobj: BinaryIO, key: str, content_type: Optional[str] = None) -> StoredObject:
+        ...
+
+    @abstractmethod
+    def stat(self, key: str) -> Optional[StoredObject]:
+        ...
+
+    @abstractmethod
+    def iter_range(self, key: str, start: int, end: int) -> Iterator[bytes]:
+        """Отдаёт байты [start, end] включительно кусками по CHUNK_SIZE."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    def presigned_url(
+        self,
+        key: str,
+        filename: Optional[str] = None,
+        content_type: Optional[str] = None,
+    ) -> Optional[str]:
+        """Прямая ссылка на объект в обход API или None, если бэкенд так не умеет."""
+        return None
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: Path = UPLOAD_ROOT) -> None:
+        self.root = root
+
+    def path(self, key: str) -> Path:
+        return self.root / Path(key)
+
+    def save(self, fileobj: BinaryIO, key: str, content_type: Optional[str] = None) -> StoredObject:
+        path = self.path(key)
+        digest = hashlib.md5()
+        size = 0
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("wb") as buffer:
+                while True:
+                    chunk = fileobj.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    buffer.write(chunk)
+                    size += len(chunk)
+        except OSError as exc:  # pragma: no cover - filesystem errors
+            raise StorageError(str(exc)) from exc
+        return StoredObject(key=key, size=size, etag=digest.hexdigest(), content_type=content_type)
+
+    def stat(self, key: str) -> Optional[StoredObject]:
+        try:
+            stat_result = self.path(key).stat()
+        except OSError:
+            return None
+        # Как у статики Starlette: mtime + размер, без чтения файла
+        etag = hashlib.md5(f"{stat_result.st_mtime_ns}-{stat_result.st_size}".encode()).hexdigest()
+        return StoredObject(key=key, size=stat_result.st_size, etag=etag)
+
+    def iter_range(self, key: str, start: int, end: int) -> Iterator[bytes]:
+        with self.path(key).open("rb") as source:
+            source.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = source.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, key: str) -> None:
+        try:
+            self.path(key).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as exc:  # pragma: no cover
+            raise StorageError(str(exc)) from exc
+
+
+class S3Storage(StorageBackend):
+    """S3-совместимое хранилище (MinIO в docker-compose)."""
+
+    def __init__(self) -> None:
+        self.bucket = settings.S3_BUCKET_NAME
+        self._client = None
+        self._presign_client = None
+        self._lock = threading.Lock()
+
+    def _make_client(self, endpoint_url: str):
+        import boto3
+        from botocore.config import Config
+
+        return boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            aws_access_key_id=settings.S3_ACCESS_KEY,
+            aws_secret_access_key=settings.S3_SECRET_KEY,
+            region_name=settings.S3_REGION,
+            config=Config(signature_version="s3v4", s3={"addressing_style": "path"}),
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    client = self._make_client(settings.S3_ENDPOINT_URL)
+                    self._ensure_bucket(client)
+                    self._client = client
+        return self._client
+
+    @property
+    def presign_client(self):
+        # Ссылки подписываются на внешний адрес: minio:9000 из браузера недоступен
+        if not settings.S3_PUBLIC_ENDPOINT_URL:
+            return self.client
+        if self._presign_client is None:
+            self._presign_client = self._make_client(settings.S3_PUBLIC_ENDPOINT_URL)
+        return self._presign_client
+
+    def _ensure_bucket(self, client) -> None:
+        from botocore.exceptions import ClientError
+
+        try:
+            client.head_bucket(Bucket=self.bucket)
+        except ClientError:
+            client.create_bucket(Bucket=self.bucket)
+
+    def save(self, fileobj: BinaryIO, key: str, content_type: Optional[str] = None) -> StoredObject:
+        from boto3.s3.transfer import TransferConfig
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        # upload_fileobj сам переходит на multipart выше порога и читает поток кусками
+        transfer_config = TransferConfig(
+            multipart_threshold=settings.STORAGE_MULTIPART_THRESHOLD_MB * 1024 * 1024,
+            multipart_chunksize=settings.STORAGE_MULTIPART_THRESHOLD_MB * 1024 * 1024,
+        )
+        extra_args = {"ContentType": content_type} if content_type else None
+        try:
+            self.client.upload_fileobj(
+                fileobj, self.bucket, key, ExtraArgs=extra_args, Config=transfer_config
+            )
+        except (BotoCoreError, ClientError) as exc:
+            raise StorageError(str(exc)) from exc
+        stored = self.stat(key)
+        if stored is None:
+            raise StorageError(f"Uploaded object {key} is missing")
+        return stored
+
+    def stat(self, key: str) -> Optional[StoredObject]:
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError:
+            return None
+        return StoredObject(
+            key=key,
+            size=head["ContentLength"],
+            etag=head["ETag"].strip('"'),
+            content_type=head.get("ContentType"),
+        )
+
+    def iter_range(self, key: str, start: int, end: int) -> Iterator[bytes]:
+        response = self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end}")
+        yield from response["Body"].iter_chunks(CHUNK_SIZE)
+
+    def delete(self, key: str) -> None:
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=key)
+        except (BotoCoreError, ClientError) as exc:
+            raise StorageError(str(exc)) from exc
+
+    def presigned_url(
+        self,
+        key: str,
+        filename: Optional[str] = None,
+        content_type: Optional[str] = None,
+    ) -> Optional[str]:
+        params = {"Bucket": self.bucket, "Key": key}
+        if filename:
+            params["ResponseContentDisposition"] = _content_disposition(filename)
+        if content_type:
+            params["ResponseContentType"] = content_type
+        return self.presign_client.generate_presigned_url(
+            "get_object",
+            Params=params,
+            ExpiresIn=settings.STORAGE_PRESIGNED_EXPIRE_SECONDS,
+        )
+
+
+_storage: Optional[StorageBackend] = None
+
+
+def get_storage() -> StorageBackend:
+    global _storage
+    if _storage is None:
+        _storage = S3Storage() if settings.STORAGE_BACKEND == "s3" else LocalStorage()
+    return _storage
+
+
 def _sanitize_filename(filename: str) -> str:
     if not filename:
         return uuid.uuid4().hex
@@ -24,22 +254,25 @@ def _sanitize_filename(filename: str) -> str:
 
 def save_uploaded_file(file, folder: str) -> Tuple[str, str]:
     """
-    Сохраняет файл в указанную папку uploads/<folder> и возвращает (abs, rel).
+    Сохраняет загруженный файл в хранилище под <folder>/ и возвращает (location, key).
+
+    Файл читается потоком, без загрузки целиком в память. В async-роутах
+    используйте save_uploaded_file_async.
     """
     safe_name = _sanitize_filename(getattr(file, "filename", None))
     unique_name = f"{uuid.uuid4().hex}_{safe_name}"
-    relative_path = Path(folder) / unique_name
-    absolute_path = UPLOAD_ROOT / relative_path
+    key = f"{folder.strip('/')}/{unique_name}"
 
-    try:
-        absolute_path.parent.mkdir(parents=True, exist_ok=True)
-        file.file.seek(0)
-        with absolute_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception as exc:  # pragma: no cover - filesystem errors
-        raise StorageError(str(exc)) from exc
+    storage = get_storage()
+    file.file.seek(0)
+    storage.save(file.file, key, getattr(file, "content_type", None))
 
-    return str(absolute_path), str(relative_path).replace(os.sep, "/")
+    location = str(storage.path(key)) if isinstance(storage, LocalStorage) else key
+    return location, key
+
+
+async def save_uploaded_file_async(file, folder: str) -> Tuple[str, str]:
+    return await run_in_threadpool(save_uploaded_file, file, folder)
 
 
 def save_consultation_file(file, consultation_id: int) -> Tuple[str, str]:
@@ -49,10 +282,95 @@ def save_consultation_file(file, consultation_id: int) -> Tuple[str, str]:
     return save_uploaded_file(file, f"consultations/{consultation_id}")
 
 
+async def save_consultation_file_async(file, consultation_id: int) -> Tuple[str, str]:
+    return await save_uploaded_file_async(file, f"consultations/{consultation_id}")
+
+
 def resolve_storage_path(relative_path: str) -> Path:
     """
-    Преобразует относительный путь из БД в абсолютный путь на диске.
+    Преобразует относительный путь из БД в абсолютный путь на диске (только local).
     """
     path = UPLOAD_ROOT / Path(relative_path)
     return path
 
+
+def _content_disposition(filename: str) -> str:
+    ascii_name = _sanitize_filename(filename)
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Разбирает один диапазон ``bytes=a-b``; None — диапазон невыполним."""
+    match = _RANGE_RE.match(header.strip())
+    if not match or size == 0:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N: последние N байт
+        length = int(last)
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start > end:
+        return None
+    return start, end
+
+
+def download_response(
+    request: Request,
+    key: str,
+    filename: str,
+    media_type: Optional[str] = None,
+) -> Response:
+    """
+    Ответ на скачивание файла из хранилища.
+
+    Для S3 отдаёт редирект на подписанную ссылку (байты не идут через API),
+    иначе стримит файл сам с поддержкой ETag/If-None-Match и Range/If-Range.
+    Вызывает блокирующий ввод-вывод: из async-роутов — через run_in_threadpool.
+    """
+    storage = get_storage()
+    media_type = media_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    if settings.STORAGE_PRESIGNED_DOWNLOADS:
+        url = storage.presigned_url(key, filename, media_type)
+        if url:
+            return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+
+    stored = storage.stat(key)
+    if stored is None:
+        raise StorageError(f"Object {key} not found")
+
+    etag = f'"{stored.etag}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": _content_disposition(filename),
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [value.strip() for value in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    start, end = 0, stored.size - 1
+    status_code = status.HTTP_200_OK
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = _parse_range(range_header, stored.size)
+        if byte_range is None:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={"Content-Range": f"bytes */{stored.size}"},
+            )
+        start, end = byte_range
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{stored.size}"
+
+    headers["Content-Length"] = str(max(end - start + 1, 0))
+    body = storage.iter_range(key, start, end) if stored.size else iter(())
+    return StreamingResponse(body, status_code=status_code, headers=headers, media_type=media_type)
@@ -9,11 +9,64 @@ class Settings(BaseSettings):
     # Redis
     REDIS_URL: str = "redis://localhost:6379/0"
     
+    # WebSocket signalling: memory (один воркер) или redis (pub/sub между воркерами)
+    WS_BROKER_BACKEND: str = "memory"
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SEND_TIMEOUT_SECONDS: float = 10.0
+    WS_SLOW_CONSUMER_POLICY: str = "close"  # close | drop_oldest
+    
+    # Чат консультаций: пачечная запись в БД и повтор последних сообщений при подключении
+    CHAT_FLUSH_INTERVAL_MS: int = 200
+    CHAT_FLUSH_BATCH_SIZE: int = 100
+    CHAT_BUFFER_MAX_MESSAGES: int = 10000
+    CHAT_REPLAY_MESSAGES: int = 50
+    
+    # Метрики Prometheus на /metrics (нужен prometheus_client); без METRICS_TOKEN эндпоинт не подключается
+    METRICS_ENABLED: bool = False
+    METRICS_TOKEN: str = ""
+    # Доля сообщений сигналинга, у которых меряется время доставки и отправки
+    WS_METRICS_SAMPLE_RATE: float = 0.05
+    # Больше SQL-запросов на один HTTP-запрос — предупреждение в лог (похоже на N+1)
+    REQUEST_QUERY_WARN_THRESHOLD: int = 20
+    
+    # Кэш аутентифицированных пользователей: memory или redis (общий для воркеров)
+    PRINCIPAL_CACHE_BACKEND: str = "memory"
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 60
+    PRINCIPAL_CACHE_LOCAL_TTL_SECONDS: int = 10
+    PRINCIPAL_CACHE_MAX_SIZE: int = 10000
+    
+    # Кэши данных (свободные слоты, каталог): memory или redis
+    CACHE_BACKEND: str = "memory"
+    CACHE_LOCAL_TTL_SECONDS: int = 10
+    CATALOG_CACHE_TTL_SECONDS: int = 300
+    NEXT_SLOTS_CACHE_SIZE: int = 5
+    NEXT_SLOTS_CACHE_TTL_SECONDS: int = 60
+    # Страницы истории консультаций; сбрасываются при бронировании и смене статуса
+    CONSULTATION_HISTORY_CACHE_TTL_SECONDS: int = 30
+    # Участники и статус консультации для проверок доступа; сбрасываются при смене статуса
+    CONSULTATION_ACCESS_CACHE_TTL_SECONDS: int = 300
+    # Максимальная устаревшесть статистики админ-дашборда
+    ADMIN_STATS_MAX_STALENESS_SECONDS: int = 30
+    
     # JWT
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    # principal — пользователь из кэша/БД на каждый запрос; stateless — из claims access token'а
+    # (отзыв при смене роли/статуса/профилей; с несколькими воркерами нужен PRINCIPAL_CACHE_BACKEND=redis)
+    AUTH_MODE: str = "principal"
+    AUTH_REVOCATION_CACHE_SECONDS: int = 5
+    
+    # Пароли: стоимость bcrypt (при смене хэш пересчитывается при входе) и пул хэширования
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_PENDING: int = 64
+    
+    # Сессии (refresh token'ы): database или redis (активные сессии с TTL, БД — надёжная копия)
+    SESSION_STORE_BACKEND: str = "database"
+    SESSION_PURGE_INTERVAL_SECONDS: int = 3600
+    SESSION_PURGE_BATCH_SIZE: int = 1000
     
     # S3 Storage
     S3_ENDPOINT_URL: str
@@ -21,11 +74,22 @@ class Settings(BaseSettings):
     S3_SECRET_KEY: str
     S3_BUCKET_NAME: str = "doclink-files"
     S3_REGION: str = "us-east-1"
-    
-    # Points Exchange Rates (to RUB)
+    # Адрес MinIO/S3, доступный браузеру, для подписанных ссылок (если отличается от S3_ENDPOINT_URL)
+    S3_PUBLIC_ENDPOINT_URL: str = ""
+
+    # File storage: local (диск, STORAGE_LOCAL_ROOT) | s3
+    STORAGE_BACKEND: str = "local"
+    STORAGE_LOCAL_ROOT: str = "uploads"
+    STORAGE_PRESIGNED_DOWNLOADS: bool = True
+    STORAGE_PRESIGNED_EXPIRE_SECONDS: int = 300
+    STORAGE_MULTIPART_THRESHOLD_MB: int = 8
+
+    # Points Exchange Rates (to RUB): значения по умолчанию, пока в exchange_rates нет курса
     POINTS_EXCHANGE_RATE_RUB: float = 1.0
     POINTS_EXCHANGE_RATE_USD: float = 100.0
     POINTS_EXCHANGE_RATE_EUR: float = 110.0
+    # Страховочное перечитывание курсов, если pub/sub-уведомление потерялось
+    EXCHANGE_RATES_CACHE_TTL_SECONDS: int = 300
     
     # Email
     SMTP_HOST: str = ""
@@ -33,12 +97,37 @@ class Settings(BaseSettings):
     SMTP_USER: str = ""
     SMTP_PASSWORD: str = ""
     SMTP_FROM_EMAIL: str = ""
+    SMTP_STARTTLS: bool = True
+    SMTP_TIMEOUT_SECONDS: float = 30.0
+    SMTP_POOL_SIZE: int = 4
+    
+    # Доставка уведомлений: внешние каналы (копия уведомления в приложении) и диспетчер outbox
+    NOTIFICATION_CHANNELS: str = "email"
+    NOTIFICATION_DISPATCH_WORKERS: int = 1  # задач на канал внутри API-процесса (0 — отдельный процесс)
+    NOTIFICATION_BATCH_SIZE: int = 50
+    NOTIFICATION_POLL_INTERVAL_SECONDS: float = 1.0
+    NOTIFICATION_LEASE_SECONDS: int = 120
+    NOTIFICATION_MAX_ATTEMPTS: int = 6
+    NOTIFICATION_EMAIL_RATE_PER_SECOND: float = 10.0
+    NOTIFICATION_UNREAD_CACHE_TTL_SECONDS: int = 300
+    NOTIFICATION_SYNC_SETTLE_SECONDS: int = 5
     
     # Payment Providers
     STRIPE_SECRET_KEY: str = ""
     STRIPE_PUBLISHABLE_KEY: str = ""
+    STRIPE_API_BASE: str = "https://api.stripe.com"
     CLOUDPAYMENTS_PUBLIC_ID: str = ""
     CLOUDPAYMENTS_API_SECRET: str = ""
+    # HTTP-клиент платёжных систем
+    PAYMENT_PROVIDER_TIMEOUT_SECONDS: float = 10.0
+    PAYMENT_PROVIDER_CONNECT_TIMEOUT_SECONDS: float = 3.0
+    PAYMENT_PROVIDER_MAX_RETRIES: int = 3
+    PAYMENT_PROVIDER_MAX_CONNECTIONS: int = 100
+    # Воркер начислений по callback'ам: задач внутри API-процесса (0 — только отдельный процесс)
+    PAYMENT_CALLBACK_WORKERS: int = 1
+    PAYMENT_CALLBACK_BATCH_SIZE: int = 100
+    PAYMENT_CALLBACK_POLL_INTERVAL_SECONDS: float = 0.5
+    PAYMENT_CALLBACK_MAX_ATTEMPTS: int = 8
     
     # Application
     DEBUG: bool = True
@@ -0,0 +1,125 @@
+"""Проверка доступа к консультации для REST и WebSocket.
+
+Участники консультации (user id и имена пациента и врача) и её статус
+читаются одним запросом — консультация с обоими профилями — и кэшируются по
+id консультации. Участники не меняются, а запись сбрасывается при каждой
+смене статуса (ConsultationService вызывает invalidate_access); новое имя
+из профиля подхватывается не позже CONSULTATION_ACCESS_CACHE_TTL_SECONDS.
+"""
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.common.cache import TieredCache
+from app.common.models import Consultation, DoctorProfile, PatientProfile, UserRole
+from app.common.principal import Principal
+from app.config import settings
+
+access_cache = TieredCache(
+    "consultation_access",
+    ttl=settings.CONSULTATION_ACCESS_CACHE_TTL_SECONDS,
+    local_ttl=settings.CACHE_LOCAL_TTL_SECONDS,
+    use_redis=settings.CACHE_BACKEND == "redis",
+)
+
+
+@dataclass(frozen=True)
+class ConsultationAccess:
+    """Кто участвует в консультации и в каком она статусе."""
+
+    id: int
+    patient_id: int
+    doctor_id: int
+    patient_user_id: Optional[int]
+    doctor_user_id: Optional[int]
+    status: str
+    # Имя и фамилия из профиля; по умолчанию None — для записей кэша без имён
+    patient_name: Optional[str] = None
+    doctor_name: Optional[str] = None
+
+    def participant_name(self, participant_type: str) -> Optional[str]:
+        if participant_type == "doctor":
+            return self.doctor_name
+        if participant_type == "patient":
+            return self.patient_name
+        return None
+
+    def names_by_user(self) -> Dict[int, str]:
+        """Имена участников по user id, для подписи сообщений чата."""
+        names = {}
+        if self.doctor_user_id is not None:
+            names[self.doctor_user_id] = self.doctor_name or "Врач"
+        if self.patient_user_id is not None:
+            names[self.patient_user_id] = self.patient_name or "Пациент"
+        return names
+
+
+def _full_name(first_name: Optional[str], last_name: Optional[str]) -> Optional[str]:
+    return " ".join(filter(None, (first_name, last_name))).strip() or None
+
+
+def get_access(db: Session, consultation_id: int) -> Optional[ConsultationAccess]:
+    cached = access_cache.get(consultation_id)
+    if cached is not None:
+        return ConsultationAccess(**cached)
+
+    row = db.execute(
+        select(
+            Consultation.patient_id,
+            Consultation.doctor_id,
+            Consultation.status,
+            PatientProfile.user_id.label("patient_user_id"),
+            DoctorProfile.user_id.label("doctor_user_id"),
+            PatientProfile.first_name.label("patient_first_name"),
+            PatientProfile.last_name.label("patient_last_name"),
+            DoctorProfile.first_name.label("doctor_first_name"),
+            DoctorProfile.last_name.label("doctor_last_name"),
+        )
+        .outerjoin(PatientProfile, PatientProfile.id == Consultation.patient_id)
+        .outerjoin(DoctorProfile, DoctorProfile.id == Consultation.doctor_id)
+        .where(Consultation.id == consultation_id)
+    ).first()
+    if row is None:
+        return None
+    access = ConsultationAccess(
+        id=consultation_id,
+        patient_id=row.patient_id,
+        doctor_id=row.doctor_id,
+        patient_user_id=row.patient_user_id,
+        doctor_user_id=row.doctor_user_id,
+        status=row.status.value,
+        patient_name=_full_name(row.patient_first_name, row.patient_last_name),
+        doctor_name=_full_name(row.doctor_first_name, row.doctor_last_name),
+    )
+    access_cache.set(consultation_id, asdict(access))
+    return access
+
+
+def invalidate_access(consultation_id: int) -> None:
+    access_cache.delete(consultation_id)
+
+
+def authorize(db: Session, consultation_id: int, user: Principal) -> Tuple[ConsultationAccess, str]:
+    """Консультация и participant_type (doctor/patient/admin); иначе 404 или 403."""
+    access = get_access(db, consultation_id)
+    if access is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Консультация не найдена",
+        )
+
+    # Сравниваем user id, а не роль: врач может быть пациентом у коллеги
+    if user.id == access.doctor_user_id:
+        return access, "doctor"
+    if user.id == access.patient_user_id:
+        return access, "patient"
+    if user.role == UserRole.ADMIN:
+        return access, "admin"
+
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Нет доступа к консультации",
+    )
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import structlog
+
+from app.config import settings
+
+logger = structlog.get_logger()
+
+# handler(consultation_id, envelope)
+MessageHandler = Callable[[int, dict], Awaitable[None]]
+
+# Страховочный TTL для списка участников комнаты, если воркер упал не выйдя из неё
+ROOM_MEMBERS_TTL_SECONDS = 6 * 60 * 60
+
+
+class RoomBroker(ABC):
+    """Доставляет сообщения комнат консультаций между воркерами и узлами."""
+
+    @abstractmethod
+    async def subscribe(self, consultation_id: int, handler: MessageHandler) -> None:
+        ...
+
+    @abstractmethod
+    async def unsubscribe(self, consultation_id: int, handler: MessageHandler) -> None:
+        ...
+
+    @abstractmethod
+    async def publish(self, consultation_id: int, envelope: dict) -> None:
+        ...
+
+    @abstractmethod
+    async def join(self, consultation_id: int, member_id: str) -> int:
+        """Отмечает участника в комнате и возвращает общий размер комнаты."""
+
+    @abstractmethod
+    async def leave(self, consultation_id: int, member_id: str) -> None:
+        ...
+
+    async def close(self) -> None:
+        return None
+
+
+class InMemoryBroker(RoomBroker):
+    """Брокер внутри одного процесса. Подходит для одного воркера и для тестов:
+    несколько менеджеров с общим брокером ведут себя как разные воркеры."""
+
+    def __init__(self) -> None:
+        self.handlers: Dict[int, List[MessageHandler]] = {}
+        self.members: Dict[int, Set[str]] = {}
+
+    async def subscribe(self, consultation_id: int, handler: MessageHandler) -> None:
+        self.handlers.setdefault(consultation_id, []).append(handler)
+
+    async def unsubscribe(self, consultation_id: int, handler: MessageHandler) -> None:
+        handlers = self.handlers.get(consultation_id, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            self.handlers.pop(consultation_id, None)
+
+    async def publish(self, consultation_id: int, envelope: dict) -> None:
+        for handler in list(self.handlers.get(consultation_id, [])):
+            await handler(consultation_id, envelope)
+
+    async def join(self, consultation_id: int, member_id: str) -> int:
+        members = self.members.setdefault(consultation_id, set())
+        members.add(member_id)
+        return len(members)
+
+    async def leave(self, consultation_id: int, member_id: str) -> None:
+        members = self.members.get(consultation_id)
+        if members is None:
+            return
+        members.discard(member_id)
+        if not members:
+            self.members.pop(consultation_id, None)
+
+
+class RedisBroker(RoomBroker):
+    """Redis pub/sub: по каналу на комнату, воркер подписан только на свои комнаты."""
+
+    def __init__(self, channel_prefix: str = "consultation") -> None:
+        self.channel_prefix = channel_prefix
+        self.handlers: Dict[int, List[MessageHandler]] = {}
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def _channel(self, consultation_id: int) -> str:
+        return f"{self.channel_prefix}:{consultation_id}:signal"
+
+    def _members_key(self, consultation_id: int) -> str:
+        return f"{self.channel_prefix}:{consultation_id}:members"
+
+    def _redis(self):
+        from app.common.redis import get_async_redis
+
+        return get_async_redis()
+
+    async def subscribe(self, consultation_id: int, handler: MessageHandler) -> None:
+        async with self._lock:
+            handlers = self.handlers.setdefault(consultation_id, [])
+            handlers.append(handler)
+            if len(handlers) > 1:
+                return
+            if self._pubsub is None:
+                self._pubsub = self._redis().pubsub(ignore_subscribe_messages=True)
+            await self._pubsub.subscribe(self._channel(consultation_id))
+            if self._listener is None or self._listener.done():
+                self._listener = asyncio.create_task(self._listen())
+
+    async def unsubscribe(self, consultation_id: int, handler: MessageHandler) -> None:
+        async with self._lock:
+            handlers = self.handlers.get(consultation_id, [])
+            if handler in handlers:
+                handlers.remove(handler)
+            if handlers:
+                return
+            self.handlers.pop(consultation_id, None)
+            if self._pubsub is not None:
+                await self._pubsub.unsubscribe(self._channel(consultation_id))
+
+    async def publish(self, consultation_id: int, envelope: dict) -> None:
+        await self._redis().publish(self._channel(consultation_id), json.dumps(envelope))
+
+    async def join(self, consultation_id: int, member_id: str) -> int:
+        key = self._members_key(consultation_id)
+        async with self._redis().pipeline(transaction=True) as pipe:
+            pipe.sadd(key, member_id)
+            pipe.expire(key, ROOM_MEMBERS_TTL_SECONDS)
+            pipe.scard(key)
+            _, _, size = await pipe.execute()
+        return int(size)
+
+    async def leave(self, consultation_id: int, member_id: str) -> None:
+        await self._redis().srem(self._members_key(consultation_id), member_id)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    await asyncio.sleep(0.5)
+                    continue
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+                if message is None or message.get("type") != "message":
+                    continue
+                consultation_id = int(message["channel"].split(":")[1])
+                envelope = json.loads(message["data"])
+                for handler in list(self.handlers.get(consultation_id, [])):
+                    await handler(consultation_id, envelope)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error("Consultation broker listener error", error=str(exc))
+                await asyncio.sleep(1.0)
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+
+
+def create_broker() -> RoomBroker:
+    if settings.WS_BROKER_BACKEND == "redis":
+        return RedisBroker()
+    return InMemoryBroker()
@@ -0,0 +1,102 @@
+"""Запись сообщений чата консультаций с отложенной пачкой (write-behind).
+
+Сообщение из WebSocket сначала рассылается участникам, а в БД попадает
+позже: ChatWriter копит сообщения в памяти воркера и пишет их одним
+bulk INSERT раз в CHAT_FLUSH_INTERVAL_MS или сразу по набору
+CHAT_FLUSH_BATCH_SIZE сообщений. Перед чтением истории вызывается flush(),
+поэтому свои же сообщения этого воркера в ней не теряются. Если БД
+недоступна, пачка возвращается в буфер, а буфер ограничен
+CHAT_BUFFER_MAX_MESSAGES: при переполнении add() не принимает новое
+сообщение, и отправитель получает отказ — уже принятые не отбрасываются.
+"""
+import asyncio
+from datetime import datetime
+from typing import List, Optional
+
+import structlog
+from sqlalchemy import insert
+
+from app.common.database import SessionLocal
+from app.common.models import ConsultationMessage
+from app.config import settings
+from app.consultations import metrics
+
+logger = structlog.get_logger()
+
+
+class ChatWriter:
+    def __init__(self) -> None:
+        self._buffer: List[dict] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def add(self, consultation_id: int, sender_id: int, message: str, created_at: datetime) -> bool:
+        """Ставит сообщение в очередь записи; False — буфер полон, сообщение не принято."""
+        if len(self._buffer) >= settings.CHAT_BUFFER_MAX_MESSAGES:
+            metrics.chat_rejected.inc()
+            logger.error("Chat buffer full, message rejected", consultation_id=consultation_id)
+            self._wakeup.set()
+            return False
+        self._buffer.append(
+            {
+                "consultation_id": consultation_id,
+                "sender_id": sender_id,
+                "message": message,
+                "created_at": created_at,
+            }
+        )
+        if len(self._buffer) >= settings.CHAT_FLUSH_BATCH_SIZE:
+            self._wakeup.set()
+        return True
+
+    async def flush(self) -> int:
+        """Пишет накопленное; возвращает число сохранённых сообщений."""
+        async with self._flush_lock:
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            try:
+                await asyncio.to_thread(self._insert, batch)
+            except Exception as exc:
+                # Вернуть в начало: порядок сообщений в буфере сохраняется
+                self._buffer[:0] = batch
+                logger.error("Chat flush failed", messages=len(batch), error=str(exc))
+                return 0
+            return len(batch)
+
+    @staticmethod
+    def _insert(batch: List[dict]) -> None:
+        db = SessionLocal()
+        try:
+            db.execute(insert(ConsultationMessage), batch)
+            db.commit()
+        finally:
+            db.close()
+
+    async def _run(self) -> None:
+        interval = settings.CHAT_FLUSH_INTERVAL_MS / 1000
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+
+chat_writer = ChatWriter()
@@ -1,13 +1,26 @@
 from __future__ import annotations
 
 import asyncio
-from dataclasses import dataclass
-from typing import Dict, List, Optional
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
 
+import structlog
 from fastapi import WebSocket
 
+from app.config import settings
+from app.consultations import metrics
+from app.consultations.broker import RoomBroker, create_broker
 
-@dataclass
+logger = structlog.get_logger()
+
+SLOW_CONSUMER_CLOSE_CODE = 1013  # Try Again Later
+SEND_ERROR_CLOSE_CODE = 1011  # Internal Error
+
+
+@dataclass(eq=False)
 class ConsultationConnection:
     consultation_id: int
     websocket: WebSocket
@@ -15,28 +28,90 @@ class ConsultationConnection:
     user_role: str
     participant_type: str  # doctor | patient | admin
     display_name: str
+    connection_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # Исходящая очередь и задача-писатель: медленный клиент не тормозит остальных
+    outbox: asyncio.Queue = field(init=False, repr=False)
+    writer: Optional[asyncio.Task] = field(default=None, init=False, repr=False)
+    closed: bool = field(default=False, init=False)
+    connected_at: float = field(default_factory=time.monotonic, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.outbox = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
 
 
 class ConsultationWebSocketManager:
-    """Управляет подключениями в комнатах консультаций."""
+    """Управляет подключениями в комнатах консультаций.
+
+    Локальные сокеты хранятся в ``rooms``, а рассылка идёт через брокер,
+    поэтому участники одной комнаты могут сидеть на разных воркерах.
+    Каждое сообщение сериализуется в JSON один раз и кладётся в ограниченные
+    очереди получателей; отправкой занимается отдельная задача на сокет.
+    """
 
-    def __init__(self) -> None:
+    def __init__(self, broker: Optional[RoomBroker] = None) -> None:
+        self.broker = broker or create_broker()
+        self.node_id = uuid.uuid4().hex
         self.rooms: Dict[int, List[ConsultationConnection]] = {}
         self.lock = asyncio.Lock()
+        # Подписки на брокер ведутся вне self.lock: это сетевой вызов в режиме redis
+        self._subscribed: Set[int] = set()
+        self._subscription_locks: Dict[int, list] = {}  # id комнаты -> [Lock, ожидающие]
+        # Сильные ссылки на фоновые закрытия, иначе задачу может собрать GC
+        self._closing: Set[asyncio.Task] = set()
+
+    def _member_id(self, connection: ConsultationConnection) -> str:
+        return f"{self.node_id}:{connection.connection_id}"
 
-    async def register(self, connection: ConsultationConnection) -> List[ConsultationConnection]:
+    async def register(self, connection: ConsultationConnection) -> int:
+        """Добавляет сокет в комнату и возвращает размер комнаты по всем воркерам."""
         async with self.lock:
-            room = self.rooms.setdefault(connection.consultation_id, [])
-            room.append(connection)
-            return room.copy()
+            self.rooms.setdefault(connection.consultation_id, []).append(connection)
+            connection.writer = asyncio.create_task(self._writer(connection))
+            metrics.rooms.set(len(self.rooms))
+        metrics.connections.inc()
+        await self._sync_subscription(connection.consultation_id)
+        return await self.broker.join(connection.consultation_id, self._member_id(connection))
 
     async def unregister(self, connection: ConsultationConnection) -> None:
+        connection.closed = True
+        writer = connection.writer
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
         async with self.lock:
             room = self.rooms.get(connection.consultation_id, [])
-            if connection in room:
-                room.remove(connection)
+            if connection not in room:
+                return
+            room.remove(connection)
             if not room:
                 self.rooms.pop(connection.consultation_id, None)
+            metrics.rooms.set(len(self.rooms))
+        metrics.connections.dec()
+        metrics.connection_duration.observe(time.monotonic() - connection.connected_at)
+        await self._sync_subscription(connection.consultation_id)
+        await self.broker.leave(connection.consultation_id, self._member_id(connection))
+
+    async def _sync_subscription(self, consultation_id: int) -> None:
+        """Приводит подписку на комнату к текущему составу ``rooms``.
+
+        Вход и выход в одной комнате сериализуются её собственной блокировкой,
+        и решение принимается по составу на момент захвата: гонка join/leave
+        не отпишет комнату, в которой снова кто-то есть. Другие комнаты не ждут.
+        """
+        entry = self._subscription_locks.setdefault(consultation_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                wanted = consultation_id in self.rooms
+                if wanted and consultation_id not in self._subscribed:
+                    await self.broker.subscribe(consultation_id, self._on_broker_message)
+                    self._subscribed.add(consultation_id)
+                elif not wanted and consultation_id in self._subscribed:
+                    self._subscribed.discard(consultation_id)
+                    await self.broker.unsubscribe(consultation_id, self._on_broker_message)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._subscription_locks.pop(consultation_id, None)
 
     def get_other_connections(
         self,
@@ -49,7 +124,7 @@ class ConsultationWebSocketManager:
         return [conn for conn in room if conn.user_id != exclude_user_id]
 
     async def send_personal_message(self, connection: ConsultationConnection, message: dict) -> None:
-        await connection.websocket.send_json(message)
+        self._enqueue(connection, json.dumps(message))
 
     async def broadcast(
         self,
@@ -57,14 +132,99 @@ class ConsultationWebSocketManager:
         message: dict,
         exclude_user_id: Optional[int] = None,
     ) -> None:
+        envelope = {
+            "origin": self.node_id,
+            "type": message.get("type"),
+            "payload": json.dumps(message),
+            "exclude_user_id": exclude_user_id,
+        }
+        if metrics.sample_broadcast():
+            # Отметка времени только у выборки: по ней меряется доставка через брокер
+            envelope["sent_at"] = time.time()
+        await self.broker.publish(consultation_id, envelope)
+
+    async def _on_broker_message(self, consultation_id: int, envelope: dict) -> None:
+        message_type = envelope.get("type")
+        recipients = self._deliver_local(
+            consultation_id,
+            envelope["payload"],
+            envelope.get("exclude_user_id"),
+        )
+        metrics.delivered.get(message_type, metrics.delivered_other).inc(recipients)
+        sent_at = envelope.get("sent_at")
+        if sent_at is not None:
+            metrics.fanout_seconds.get(message_type, metrics.fanout_seconds_other).observe(time.time() - sent_at)
+            metrics.fanout_recipients.observe(recipients)
+
+    def _deliver_local(
+        self,
+        consultation_id: int,
+        payload: str,
+        exclude_user_id: Optional[int] = None,
+    ) -> int:
         recipients = self.get_other_connections(consultation_id, exclude_user_id)
         for conn in recipients:
-            try:
-                await conn.websocket.send_json(message)
-            except Exception:
-                # Соединение могло разорваться без события disconnect
-                await self.unregister(conn)
+            self._enqueue(conn, payload)
+        return len(recipients)
 
+    def _enqueue(self, connection: ConsultationConnection, payload: str) -> None:
+        if connection.closed:
+            return
+        try:
+            connection.outbox.put_nowait(payload)
+            return
+        except asyncio.QueueFull:
+            pass
 
-manager = ConsultationWebSocketManager()
+        if settings.WS_SLOW_CONSUMER_POLICY == "drop_oldest":
+            connection.outbox.get_nowait()
+            connection.outbox.put_nowait(payload)
+            metrics.send_failures["dropped"].inc()
+            return
+
+        metrics.send_failures["slow_consumer"].inc()
+
+        logger.warning(
+            "Closing slow websocket consumer",
+            consultation_id=connection.consultation_id,
+            user_id=connection.user_id,
+        )
+        connection.closed = True
+        task = asyncio.create_task(self._close_connection(connection, SLOW_CONSUMER_CLOSE_CODE, "Slow consumer"))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
 
+    async def _writer(self, connection: ConsultationConnection) -> None:
+        try:
+            while True:
+                payload = await connection.outbox.get()
+                started = time.perf_counter() if metrics.sample_send() else None
+                await asyncio.wait_for(
+                    connection.websocket.send_text(payload),
+                    timeout=settings.WS_SEND_TIMEOUT_SECONDS,
+                )
+                if started is not None:
+                    metrics.send_seconds.observe(time.perf_counter() - started)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            metrics.send_failures["timeout"].inc()
+            await self._close_connection(connection, SLOW_CONSUMER_CLOSE_CODE, "Send timeout")
+        except Exception:
+            metrics.send_failures["error"].inc()
+            # Соединение могло разорваться без события disconnect; закрываем,
+            # чтобы цикл приёма в обработчике завершился, а клиент переподключился
+            await self._close_connection(connection, SEND_ERROR_CLOSE_CODE, "Send failed")
+
+    async def _close_connection(self, connection: ConsultationConnection, code: int, reason: str) -> None:
+        await self.unregister(connection)
+        try:
+            await connection.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def close(self) -> None:
+        await self.broker.close()
+
+
+manager = ConsultationWebSocketManager()
@@ -0,0 +1,72 @@
+"""Метрики WebSocket-сигналинга консультаций.
+
+Счётчики дешёвые и считаются на каждое сообщение. Замеры времени
+(доставка через брокер, отправка в сокет) снимаются только с каждого N-го
+события по WS_METRICS_SAMPLE_RATE, чтобы всплески ICE-кандидатов не
+платили за perf_counter и гистограммы. id комнаты в метки не попадает —
+число рядов не должно расти с числом консультаций.
+"""
+from app.common.metrics import Sampler, counter, gauge, histogram
+from app.config import settings
+
+MESSAGE_TYPES = ("offer", "answer", "ice", "chat", "media", "end-call", "system")
+
+rooms = gauge("doclink_ws_rooms", "Комнаты консультаций с локальными подключениями")
+connections = gauge("doclink_ws_connections", "Открытые WebSocket-подключения")
+connection_duration = histogram(
+    "doclink_ws_connection_duration_seconds",
+    "Время жизни WebSocket-подключения",
+    buckets=(1, 5, 15, 30, 60, 300, 600, 1200, 1800, 3600, 7200),
+)
+
+_received = counter("doclink_ws_messages_received_total", "Сообщения от клиентов по типам", ["type"])
+_delivered = counter("doclink_ws_messages_delivered_total", "Сообщения, поставленные в очереди получателей", ["type"])
+_fanout_seconds = histogram(
+    "doclink_ws_broadcast_fanout_seconds",
+    "От broadcast до постановки в очереди всех локальных получателей (выборка)",
+    ["type"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+fanout_recipients = histogram(
+    "doclink_ws_broadcast_recipients",
+    "Локальные получатели одного broadcast (выборка)",
+    buckets=(0, 1, 2, 3, 5, 10, 25),
+)
+send_seconds = histogram(
+    "doclink_ws_send_seconds",
+    "Отправка одного сообщения в сокет (выборка)",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+_send_failures = counter(
+    "doclink_ws_send_failures_total",
+    "Сбои отправки: timeout, error, dropped (drop_oldest), slow_consumer",
+    ["reason"],
+)
+chat_rejected = counter(
+    "doclink_chat_messages_rejected_total",
+    "Сообщения чата, не принятые из-за полного буфера записи в БД",
+)
+
+# Дочерние ряды заранее: labels() на каждое сообщение — лишний lookup под локом
+received = {message_type: _received.labels(message_type) for message_type in MESSAGE_TYPES}
+received_other = _received.labels("other")
+delivered = {message_type: _delivered.labels(message_type) for message_type in MESSAGE_TYPES}
+delivered_other = _delivered.labels("other")
+fanout_seconds = {message_type: _fanout_seconds.labels(message_type) for message_type in MESSAGE_TYPES}
+fanout_seconds_other = _fanout_seconds.labels("other")
+send_failures = {
+    reason: _send_failures.labels(reason)
+    for reason in ("timeout", "error", "dropped", "slow_consumer")
+}
+
+
+def count_received(message_type) -> None:
+    # type приходит от клиента: в метку — только известные значения
+    if isinstance(message_type, str) and message_type in received:
+        received[message_type].inc()
+    else:
+        received_other.inc()
+
+
+sample_broadcast = Sampler(settings.WS_METRICS_SAMPLE_RATE)
+sample_send = Sampler(settings.WS_METRICS_SAMPLE_RATE)
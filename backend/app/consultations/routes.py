@@ -1,5 +1,5 @@
-from datetime import datetime
-from typing import List, Optional
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
 
 from fastapi import (
     APIRouter,
@@ -8,13 +8,15 @@ from fastapi import (
     Form,
     HTTPException,
     Query,
+    Request,
+    Response,
     UploadFile,
     WebSocket,
     WebSocketDisconnect,
     status,
 )
-from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session, joinedload
+from starlette.concurrency import run_in_threadpool
 import structlog
 
 from app.common.database import SessionLocal, get_db
@@ -23,39 +25,40 @@ from app.common.dependencies import (
     get_current_user,
     get_user_by_token,
 )
+from app.common.pagination import NEXT_CURSOR_HEADER, InvalidCursorError
+from app.common.principal import Principal, invalidate_principal
 from app.common.models import (
     Consultation,
     ConsultationFile,
+    ConsultationMessage,
     ConsultationStatus,
     DoctorProfile,
     MedicalFile,
     PatientProfile,
-    User,
     UserRole,
 )
 from app.common.storage import (
     StorageError,
-    resolve_storage_path,
-    save_consultation_file,
+    download_response,
+    save_consultation_file_async,
 )
 from app.config import settings
 from app.services.consultation_service import ConsultationService
+from app.consultations.access import ConsultationAccess, authorize
+from app.consultations.chat import chat_writer
 from app.consultations.connection_manager import (
     ConsultationConnection,
     manager,
 )
+from app.consultations import metrics as ws_metrics
 from app.consultations import schemas
 
 router = APIRouter(tags=["consultations"])
 logger = structlog.get_logger()
 
 
-def _format_name(profile: Optional[object], fallback: str, email: str) -> str:
-    if not profile:
-        return fallback or email
-    parts = [getattr(profile, "first_name", None), getattr(profile, "last_name", None)]
-    name = " ".join(filter(None, parts)).strip()
-    return name or fallback or email
+def _participant_name(access: ConsultationAccess, participant_type: str, user: Principal) -> str:
+    return access.participant_name(participant_type) or user.email.split("@")[0]
 
 
 def _build_download_url(file_id: int) -> str:
@@ -89,48 +92,20 @@ def _get_consultation_details(db: Session, consultation_id: int) -> Consultation
     return consultation
 
 
-def _ensure_participant(
-    db: Session,
-    consultation: Consultation,
-    user: User,
-) -> str:
-    """Возвращает participant_type (doctor/patient) если пользователь участник."""
-    if user.role == UserRole.DOCTOR:
-        doctor_profile = (
-            db.query(DoctorProfile).filter(DoctorProfile.user_id == user.id).first()
-        )
-        if doctor_profile and doctor_profile.id == consultation.doctor_id:
-            return "doctor"
-    elif user.role == UserRole.PATIENT:
-        patient_profile = (
-            db.query(PatientProfile).filter(PatientProfile.user_id == user.id).first()
-        )
-        if patient_profile and patient_profile.id == consultation.patient_id:
-            return "patient"
-    elif user.role == UserRole.ADMIN:
-        return "admin"
-
-    raise HTTPException(
-        status_code=status.HTTP_403_FORBIDDEN,
-        detail="Нет доступа к консультации",
-    )
-
-
 @router.post("/consultations/book", response_model=schemas.ConsultationResponse)
 def book_consultation(
     booking: schemas.BookConsultationRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Забронировать консультацию"""
-    patient_profile = (
-        db.query(PatientProfile).filter(PatientProfile.user_id == current_user.id).first()
-    )
-    if not patient_profile:
+    patient_profile_id = current_user.patient_profile_id
+    if not patient_profile_id:
         patient_profile = PatientProfile(user_id=current_user.id)
         db.add(patient_profile)
         db.commit()
-        db.refresh(patient_profile)
+        patient_profile_id = patient_profile.id
+        invalidate_principal(current_user.id)
 
     doctor_profile = (
         db.query(DoctorProfile).filter(DoctorProfile.id == booking.doctor_id).first()
@@ -150,7 +125,7 @@ def book_consultation(
     try:
         consultation = ConsultationService.book_consultation(
             db,
-            patient_id=patient_profile.id,
+            patient_id=patient_profile_id,
             doctor_id=doctor_profile.id,
             slot_id=booking.slot_id,
             points_cost=booking.points_cost
@@ -165,10 +140,11 @@ def book_consultation(
 @router.post("/consultations/{consultation_id}/start", response_model=schemas.ConsultationResponse)
 def start_consultation(
     consultation_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Начать консультацию"""
+    authorize(db, consultation_id, current_user)
     try:
         consultation = ConsultationService.start_consultation(db, consultation_id)
         return schemas.ConsultationResponse.from_orm(consultation)
@@ -179,10 +155,11 @@ def start_consultation(
 @router.post("/consultations/{consultation_id}/complete", response_model=schemas.ConsultationResponse)
 def complete_consultation(
     consultation_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Завершить консультацию"""
+    authorize(db, consultation_id, current_user)
     try:
         consultation = ConsultationService.complete_consultation(db, consultation_id)
         return schemas.ConsultationResponse.from_orm(consultation)
@@ -194,10 +171,11 @@ def complete_consultation(
 def cancel_consultation(
     consultation_id: int,
     cancel_request: schemas.CancelConsultationRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Отменить консультацию"""
+    authorize(db, consultation_id, current_user)
     try:
         consultation = ConsultationService.cancel_consultation(
             db, 
@@ -211,77 +189,40 @@ def cancel_consultation(
 
 @router.get("/consultations/history", response_model=List[schemas.ConsultationResponse])
 def get_consultation_history(
-    current_user: User = Depends(get_current_user),
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    status_filter: Optional[List[str]] = Query(None, alias="status"),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db),
-    limit: int = 20
 ):
-    """Получить историю консультаций"""
-    consultations = ConsultationService.get_consultation_history(
-        db,
-        current_user.id,
-        current_user.role.value,
-        limit
-    )
-
-    doctor_ids = {consultation.doctor_id for consultation in consultations}
-    patient_ids = {consultation.patient_id for consultation in consultations}
-
-    doctor_profiles = {
-        profile.id: profile
-        for profile in db.query(DoctorProfile).filter(DoctorProfile.id.in_(doctor_ids))  # type: ignore[arg-type]
-    } if doctor_ids else {}
-    patient_profiles = {
-        profile.id: profile
-        for profile in db.query(PatientProfile).filter(PatientProfile.id.in_(patient_ids))  # type: ignore[arg-type]
-    } if patient_ids else {}
-
-    def compose_name(first_name: Optional[str], last_name: Optional[str], fallback: str) -> str:
-        parts = [first_name or "", last_name or ""]
-        name = " ".join(part.strip() for part in parts if part.strip())
-        return name or fallback
-
-    responses: List[schemas.ConsultationResponse] = []
-    for consultation in consultations:
-        base = schemas.ConsultationResponse.from_orm(consultation).model_dump()
-        doctor_profile = doctor_profiles.get(consultation.doctor_id)
-        patient_profile = patient_profiles.get(consultation.patient_id)
-        slot = consultation.slot
-
-        base["doctor_name"] = compose_name(
-            getattr(doctor_profile, "first_name", None),
-            getattr(doctor_profile, "last_name", None),
-            "Врач",
-        )
-        base["patient_name"] = compose_name(
-            getattr(patient_profile, "first_name", None),
-            getattr(patient_profile, "last_name", None),
-            "Пациент",
+    """История консультаций, новые сверху; следующая страница — по X-Next-Cursor"""
+    if current_user.role == UserRole.PATIENT:
+        role, profile_id = "patient", current_user.patient_profile_id
+    else:
+        role, profile_id = "doctor", current_user.doctor_profile_id
+    try:
+        consultations, next_cursor = ConsultationService.get_consultation_history(
+            db, role, profile_id, status_filter, cursor, limit
         )
-        base["doctor_specialty"] = getattr(doctor_profile, "specialty", None)
-        base["slot_start_time"] = slot.start_time if slot else None
-        base["slot_end_time"] = slot.end_time if slot else None
-
-        responses.append(schemas.ConsultationResponse(**base))
-
-    return responses
+    except InvalidCursorError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return consultations
 
 
 @router.get("/consultations/{consultation_id}", response_model=schemas.ConsultationDetailResponse)
 def get_consultation(
     consultation_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Получить информацию о консультации"""
+    access, _ = authorize(db, consultation_id, current_user)
     consultation = _get_consultation_details(db, consultation_id)
-    participant_type = _ensure_participant(db, consultation, current_user)
-
-    doctor_profile = db.query(DoctorProfile).filter(
-        DoctorProfile.id == consultation.doctor_id
-    ).first()
-    patient_profile = db.query(PatientProfile).filter(
-        PatientProfile.id == consultation.patient_id
-    ).first()
 
     base_data = schemas.ConsultationResponse.from_orm(consultation).model_dump(
         exclude={"doctor_name", "patient_name", "slot_start_time", "slot_end_time"}
@@ -291,13 +232,46 @@ def get_consultation(
 
     return schemas.ConsultationDetailResponse(
         **base_data,
-        doctor_name=_format_name(doctor_profile, "Врач", current_user.email),
-        patient_name=_format_name(patient_profile, "Пациент", current_user.email),
+        doctor_name=access.doctor_name or "Врач",
+        patient_name=access.patient_name or "Пациент",
         slot_start_time=slot_start,
         slot_end_time=slot_end,
     )
 
 
+def _save_file_record(
+    db: Session,
+    consultation: ConsultationAccess,
+    current_user: Principal,
+    relative_path: str,
+    file_name: str,
+    file_type: Optional[str],
+    description: Optional[str],
+) -> ConsultationFile:
+    """Файл консультации и его копия в медкарте пациента; вызывается в пуле потоков."""
+    record = ConsultationFile(
+        consultation_id=consultation.id,
+        file_url=relative_path,
+        file_name=file_name,
+        file_type=file_type,
+        uploaded_by_id=current_user.id,
+    )
+    db.add(record)
+    db.flush()
+
+    medical_file = MedicalFile(
+        patient_id=consultation.patient_id,
+        file_url=_build_download_url(record.id),
+        file_name=record.file_name,
+        file_type=record.file_type,
+        description=description or f"Файл консультации #{consultation.id}",
+    )
+    db.add(medical_file)
+    db.commit()
+    db.refresh(record)
+    return record
+
+
 @router.post(
     "/consultations/{consultation_id}/files",
     response_model=schemas.ConsultationFileResponse,
@@ -306,49 +280,33 @@ async def upload_consultation_file(
     consultation_id: int,
     file: UploadFile = File(...),
     description: Optional[str] = Form(None),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    consultation = ConsultationService.get_consultation(db, consultation_id, current_user.id)
+    consultation, participant_type = await run_in_threadpool(authorize, db, consultation_id, current_user)
 
     if not file.filename:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Файл не выбран")
 
     try:
-        _, relative_path = save_consultation_file(file, consultation_id)
+        _, relative_path = await save_consultation_file_async(file, consultation_id)
     except StorageError as exc:  # pragma: no cover
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Не удалось сохранить файл",
         ) from exc
 
-    record = ConsultationFile(
-        consultation_id=consultation_id,
-        file_url=relative_path,
-        file_name=file.filename,
-        file_type=file.content_type,
-        uploaded_by_id=current_user.id,
+    record = await run_in_threadpool(
+        _save_file_record,
+        db,
+        consultation,
+        current_user,
+        relative_path,
+        file.filename,
+        file.content_type,
+        description,
     )
-    db.add(record)
-    db.flush()
-
     download_url = _build_download_url(record.id)
-    medical_file = MedicalFile(
-        patient_id=consultation.patient_id,
-        file_url=download_url,
-        file_name=record.file_name,
-        file_type=record.file_type,
-        description=description or f"Файл консультации #{consultation_id}",
-    )
-    db.add(medical_file)
-    db.commit()
-    db.refresh(record)
-
-    if current_user.role == UserRole.DOCTOR:
-        profile = db.query(DoctorProfile).filter(DoctorProfile.user_id == current_user.id).first()
-    else:
-        profile = db.query(PatientProfile).filter(PatientProfile.user_id == current_user.id).first()
-    sender_name = _format_name(profile, current_user.email.split("@")[0], current_user.email)
 
     await manager.broadcast(
         consultation_id,
@@ -361,7 +319,7 @@ async def upload_consultation_file(
                 "downloadUrl": download_url,
                 "uploadedAt": record.uploaded_at.isoformat() if record.uploaded_at else datetime.utcnow().isoformat(),
                 "senderId": current_user.id,
-                "senderName": sender_name,
+                "senderName": _participant_name(consultation, participant_type, current_user),
             },
         },
     )
@@ -373,12 +331,12 @@ async def upload_consultation_file(
     "/consultations/{consultation_id}/files",
     response_model=List[schemas.ConsultationFileResponse],
 )
-async def list_consultation_files(
+def list_consultation_files(
     consultation_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    ConsultationService.get_consultation(db, consultation_id, current_user.id)
+    authorize(db, consultation_id, current_user)
     files = (
         db.query(ConsultationFile)
         .filter(ConsultationFile.consultation_id == consultation_id)
@@ -388,27 +346,108 @@ async def list_consultation_files(
     return [_serialize_file(record) for record in files]
 
 
-@router.get("/consultations/files/{file_id}/download")
-async def download_consultation_file(
-    file_id: int,
-    current_user: User = Depends(get_current_user),
+@router.get(
+    "/consultations/{consultation_id}/messages",
+    response_model=List[schemas.ConsultationMessageResponse],
+)
+async def list_consultation_messages(
+    consultation_id: int,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
+    """История чата, новые сверху; следующая страница — по X-Next-Cursor"""
+    await run_in_threadpool(authorize, db, consultation_id, current_user)
+    if cursor is None:
+        # Первая страница должна видеть сообщения, ещё лежащие в буфере
+        await chat_writer.flush()
+    try:
+        messages, next_cursor = await run_in_threadpool(
+            ConsultationService.get_messages, db, consultation_id, limit, cursor
+        )
+    except InvalidCursorError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return messages
+
+
+def _serialize_chat_message(message: ConsultationMessage, names: dict) -> dict:
+    return {
+        "id": message.id,
+        "text": message.message,
+        "senderId": message.sender_id,
+        "senderName": names.get(message.sender_id, ""),
+        "timestamp": message.created_at.isoformat() if message.created_at else None,
+    }
+
+
+async def _replay_chat_history(
+    db: Session,
+    connection: ConsultationConnection,
+    consultation: ConsultationAccess,
+) -> None:
+    """Последние CHAT_REPLAY_MESSAGES сообщений одним событием chat_history."""
+    if settings.CHAT_REPLAY_MESSAGES <= 0:
+        return
+    await chat_writer.flush()
+    messages, cursor = await run_in_threadpool(
+        ConsultationService.get_recent_messages, db, consultation.id, settings.CHAT_REPLAY_MESSAGES
+    )
+    names = consultation.names_by_user()
+    await manager.send_personal_message(
+        connection,
+        {
+            "type": "system",
+            "event": "chat_history",
+            "payload": {
+                "messages": [_serialize_chat_message(message, names) for message in messages],
+                "cursor": cursor,
+            },
+        },
+    )
+
+
+def _get_authorized_file(db: Session, file_id: int, current_user: Principal) -> ConsultationFile:
     record = db.query(ConsultationFile).filter(ConsultationFile.id == file_id).first()
     if not record:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Файл не найден")
+    authorize(db, record.consultation_id, current_user)
+    return record
 
-    ConsultationService.get_consultation(db, record.consultation_id, current_user.id)
-    storage_path = resolve_storage_path(record.file_url)
-    if not storage_path.exists():
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Файл недоступен")
 
-    media_type = record.file_type or "application/octet-stream"
-    return FileResponse(
-        storage_path,
-        filename=record.file_name or "attachment",
-        media_type=media_type,
-    )
+@router.get("/consultations/files/{file_id}/download")
+async def download_consultation_file(
+    file_id: int,
+    request: Request,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    record = await run_in_threadpool(_get_authorized_file, db, file_id, current_user)
+    try:
+        return await run_in_threadpool(
+            download_response,
+            request,
+            record.file_url,
+            record.file_name or "attachment",
+            record.file_type,
+        )
+    except StorageError as exc:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Файл недоступен") from exc
+
+
+def _try_transition(db: Session, transition: Callable[[Session, int], Consultation], consultation_id: int) -> None:
+    """Смена статуса из WebSocket; вызывается в пуле потоков.
+
+    ValueError — переход уже сделан другим участником или недопустим;
+    откатываем, чтобы долгоживущая сессия сокета не держала транзакцию.
+    """
+    try:
+        transition(db, consultation_id)
+    except ValueError:
+        db.rollback()
 
 
 @router.websocket("/ws/consultations/{consultation_id}")
@@ -425,34 +464,18 @@ async def consultations_websocket_endpoint(
     connection: Optional[ConsultationConnection] = None
     try:
         try:
-            user = get_user_by_token(db, token)
+            user = await run_in_threadpool(get_user_by_token, db, token)
         except TokenValidationError as exc:
             await websocket.close(code=4401, reason=str(exc))
-            db.close()
             return
 
-        consultation = _get_consultation_details(db, consultation_id)
         try:
-            participant_type = _ensure_participant(db, consultation, user)
+            consultation, participant_type = await run_in_threadpool(authorize, db, consultation_id, user)
         except HTTPException as exc:
-            await websocket.close(code=4403, reason=exc.detail)
-            db.close()
+            await websocket.close(code=4404 if exc.status_code == 404 else 4403, reason=exc.detail)
             return
 
-        if participant_type == "doctor":
-            profile = (
-                db.query(DoctorProfile).filter(DoctorProfile.user_id == user.id).first()
-            )
-        elif participant_type == "patient":
-            profile = (
-                db.query(PatientProfile)
-                .filter(PatientProfile.user_id == user.id)
-                .first()
-            )
-        else:
-            profile = None
-
-        display_name = _format_name(profile, user.email.split("@")[0], user.email)
+        display_name = _participant_name(consultation, participant_type, user)
 
         connection = ConsultationConnection(
             consultation_id=consultation_id,
@@ -464,7 +487,7 @@ async def consultations_websocket_endpoint(
         )
 
         await websocket.accept()
-        room_snapshot = await manager.register(connection)
+        room_size = await manager.register(connection)
 
         await manager.send_personal_message(
             connection,
@@ -475,12 +498,12 @@ async def consultations_websocket_endpoint(
                     "userId": user.id,
                     "role": participant_type,
                     "displayName": display_name,
-                    "roomSize": len(room_snapshot),
+                    "roomSize": room_size,
                 },
             },
         )
 
-        should_create_offer = len(room_snapshot) > 1
+        should_create_offer = room_size > 1
         await manager.send_personal_message(
             connection,
             {
@@ -489,6 +512,7 @@ async def consultations_websocket_endpoint(
                 "payload": {"shouldCreateOffer": should_create_offer},
             },
         )
+        await _replay_chat_history(db, connection, consultation)
 
         await manager.broadcast(
             consultation_id,
@@ -504,16 +528,15 @@ async def consultations_websocket_endpoint(
             exclude_user_id=connection.user_id,
         )
 
-        if should_create_offer:
-            try:
-                ConsultationService.start_consultation(db, consultation_id)
-            except ValueError:
-                pass
+        # Статус из кэша может отставать, но только в сторону более раннего
+        if should_create_offer and consultation.status == ConsultationStatus.CREATED.value:
+            await run_in_threadpool(_try_transition, db, ConsultationService.start_consultation, consultation_id)
 
         while True:
             data = await websocket.receive_json()
             message_type = data.get("type")
             payload = data.get("payload", {})
+            ws_metrics.count_received(message_type)
 
             if message_type in {"offer", "answer", "ice"}:
                 await manager.broadcast(
@@ -529,6 +552,23 @@ async def consultations_websocket_endpoint(
             elif message_type == "chat":
                 text = (payload or {}).get("text", "").strip()
                 if text:
+                    sent_at = datetime.utcnow()
+                    # Сначала в очередь записи: не сохраним — не рассылаем, а сообщаем отправителю
+                    if not chat_writer.add(
+                        consultation_id,
+                        connection.user_id,
+                        text,
+                        sent_at.replace(tzinfo=timezone.utc),
+                    ):
+                        await manager.send_personal_message(
+                            connection,
+                            {
+                                "type": "system",
+                                "event": "chat_rejected",
+                                "payload": {"text": text, "reason": "Чат временно недоступен, повторите позже"},
+                            },
+                        )
+                        continue
                     await manager.broadcast(
                         consultation_id,
                         {
@@ -537,7 +577,7 @@ async def consultations_websocket_endpoint(
                                 "text": text,
                                 "senderId": connection.user_id,
                                 "senderName": connection.display_name,
-                                "timestamp": datetime.utcnow().isoformat(),
+                                "timestamp": sent_at.isoformat(),
                             },
                         },
                     )
@@ -562,10 +602,9 @@ async def consultations_websocket_endpoint(
                         "payload": {"by": connection.user_id},
                     },
                 )
-                try:
-                    ConsultationService.complete_consultation(db, consultation_id)
-                except ValueError:
-                    pass
+                await run_in_threadpool(
+                    _try_transition, db, ConsultationService.complete_consultation, consultation_id
+                )
             else:
                 logger.warning("Unsupported websocket message", type=message_type)
 
@@ -591,4 +630,4 @@ async def consultations_websocket_endpoint(
     finally:
         if connection:
             await manager.unregister(connection)
-        db.close()
+        await run_in_threadpool(db.close)
@@ -1,3 +1,4 @@
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
 from typing import List
@@ -10,6 +11,7 @@ from app.common.models import (
 from app.consultations.schemas import (
     ConsultationCreate, ConsultationMessageCreate, ConsultationFileCreate
 )
+from app.schedule.service import ScheduleService
 from app.wallet.service import WalletService
 
 
@@ -49,16 +51,8 @@ class ConsultationService:
                 detail="Doctor not found"
             )
         
-        # Проверка баланса и заморозка поинтов
-        points_cost = doctor.consultation_price_points
-        WalletService.freeze_points(
-            db,
-            user_id,
-            points_cost,
-            description=f"Consultation reservation for slot {slot.id}"
-        )
-        
         # Создание консультации
+        points_cost = doctor.consultation_price_points
         room_id = str(uuid.uuid4())
         consultation = Consultation(
             patient_id=patient.id,
@@ -70,10 +64,33 @@ class ConsultationService:
             points_frozen=True
         )
         
-        slot.is_reserved = True
+        # Повторная проверка атомарно: параллельная бронь могла занять слот после чтения выше
+        claimed = db.execute(
+            update(ScheduleSlot)
+            .where(ScheduleSlot.id == slot.id, ScheduleSlot.is_reserved.is_(False))
+            .values(is_reserved=True),
+            execution_options={"synchronize_session": "fetch"},
+        )
+        if claimed.rowcount == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Slot already reserved"
+            )
         db.add(consultation)
+        db.flush()
+        
+        # Проверка баланса и заморозка поинтов в той же транзакции
+        WalletService.freeze_points(
+            db,
+            user_id,
+            points_cost,
+            consultation.id,
+            description=f"Consultation reservation for slot {slot.id}",
+            commit=False,
+        )
         db.commit()
         db.refresh(consultation)
+        ScheduleService.invalidate_next_slots(slot.doctor_id)
         
         return consultation
     
@@ -179,7 +196,8 @@ class ConsultationService:
                 user_id,
                 consultation.points_cost,
                 consultation_id,
-                f"Consultation #{consultation_id} completed"
+                f"Consultation #{consultation_id} completed",
+                commit=False,
             )
             consultation.points_frozen = False
         
@@ -211,7 +229,8 @@ class ConsultationService:
                 user_id,
                 consultation.points_cost,
                 consultation_id,
-                f"Consultation #{consultation_id} cancelled"
+                f"Consultation #{consultation_id} cancelled",
+                commit=False,
             )
             consultation.points_frozen = False
         
@@ -222,6 +241,7 @@ class ConsultationService:
         
         db.commit()
         db.refresh(consultation)
+        ScheduleService.invalidate_next_slots(consultation.doctor_id)
         
         return consultation
     
@@ -1,24 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status, UploadFile, File
+from pathlib import PurePosixPath
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
-from app.common.database import get_db
+from typing import List, Optional
+from app.common.database import get_async_db, get_db
 from app.common.dependencies import get_current_active_doctor, get_current_user
-from app.common.models import User, DoctorProfile, DoctorCertificate
-from app.common.storage import save_uploaded_file, resolve_storage_path, StorageError
+from app.common.pagination import NEXT_CURSOR_HEADER
+from app.common.principal import Principal
+from app.common.models import DoctorProfile
+from app.common.storage import save_uploaded_file, download_response, StorageError
 from app.doctors.schemas import (
     DoctorProfileCreate, DoctorProfileUpdate, DoctorProfileResponse,
-    DoctorCertificateCreate, DoctorCertificateResponse, DoctorListResponse
+    DoctorCertificateCreate, DoctorCertificateResponse, DoctorListResponse,
+    DoctorCatalogResponse
 )
 from app.doctors.service import DoctorService
 
 router = APIRouter(prefix="/doctors", tags=["Doctors"])
 
+CATALOG_SORT_PATTERN = "^(rating|price|experience)$"
+
 
 @router.post("/profile", response_model=DoctorProfileResponse, status_code=status.HTTP_201_CREATED)
-async def create_doctor_profile(
+def create_doctor_profile(
     profile_data: DoctorProfileCreate,
-    current_user: User = Depends(get_current_active_doctor),
+    current_user: Principal = Depends(get_current_active_doctor),
     db: Session = Depends(get_db)
 ):
     """Создание профиля врача"""
@@ -28,11 +34,11 @@ async def create_doctor_profile(
 
 @router.get("/profile", response_model=DoctorProfileResponse)
 async def get_doctor_profile(
-    current_user: User = Depends(get_current_active_doctor),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_doctor),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение профиля врача"""
-    profile = db.query(DoctorProfile).filter(DoctorProfile.user_id == current_user.id).first()
+    profile = await DoctorService.get_profile_by_user_async(db, current_user.id)
     if not profile:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -42,9 +48,9 @@ async def get_doctor_profile(
 
 
 @router.put("/profile", response_model=DoctorProfileResponse)
-async def update_doctor_profile(
+def update_doctor_profile(
     profile_data: DoctorProfileUpdate,
-    current_user: User = Depends(get_current_active_doctor),
+    current_user: Principal = Depends(get_current_active_doctor),
     db: Session = Depends(get_db)
 ):
     """Обновление профиля врача"""
@@ -53,9 +59,9 @@ async def update_doctor_profile(
 
 
 @router.post("/certificates", response_model=DoctorCertificateResponse, status_code=status.HTTP_201_CREATED)
-async def upload_certificate(
+def upload_certificate(
     certificate_data: DoctorCertificateCreate,
-    current_user: User = Depends(get_current_active_doctor),
+    current_user: Principal = Depends(get_current_active_doctor),
     db: Session = Depends(get_db)
 ):
     """Загрузка сертификата врача"""
@@ -65,34 +71,50 @@ async def upload_certificate(
 
 @router.get("/certificates", response_model=List[DoctorCertificateResponse])
 async def get_certificates(
-    current_user: User = Depends(get_current_active_doctor),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_doctor),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение списка сертификатов"""
-    profile = db.query(DoctorProfile).filter(DoctorProfile.user_id == current_user.id).first()
-    if not profile:
-        return []
-    certificates = db.query(DoctorCertificate).filter(DoctorCertificate.doctor_id == profile.id).all()
-    return certificates
+    return await DoctorService.get_certificates_async(db, current_user.id)
 
 
 @router.get("/list", response_model=List[DoctorListResponse])
 async def get_doctors_list(
+    response: Response,
     specialty: str = None,
-    db: Session = Depends(get_db)
+    q: Optional[str] = Query(None, max_length=100),
+    sort: str = Query("rating", pattern=CATALOG_SORT_PATTERN),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Получение списка врачей (курсор следующей страницы — в заголовке X-Next-Cursor)"""
+    page = await DoctorService.get_catalog_async(db, sort, specialty, q, cursor, limit)
+    if page["next_cursor"]:
+        response.headers[NEXT_CURSOR_HEADER] = page["next_cursor"]
+    return page["items"]
+
+
+@router.get("/catalog", response_model=DoctorCatalogResponse)
+async def get_doctors_catalog(
+    specialty: str = None,
+    q: Optional[str] = Query(None, max_length=100),
+    sort: str = Query("rating", pattern=CATALOG_SORT_PATTERN),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получение списка врачей"""
-    doctors = DoctorService.get_doctors_list(db, specialty)
-    return [DoctorService.serialize_list_item(doc) for doc in doctors]
+    """Каталог врачей: страница, курсор и фасеты по специальностям"""
+    return await DoctorService.get_catalog_async(db, sort, specialty, q, cursor, limit)
 
 
 @router.get("/{doctor_id}", response_model=DoctorProfileResponse)
 async def get_doctor_by_id(
     doctor_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение информации о враче по ID"""
-    doctor = db.query(DoctorProfile).filter(DoctorProfile.id == doctor_id).first()
+    doctor = await DoctorService.get_profile_async(db, doctor_id)
     if not doctor:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -102,9 +124,9 @@ async def get_doctor_by_id(
 
 
 @router.post("/profile/avatar")
-async def upload_doctor_avatar(
+def upload_doctor_avatar(
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_active_doctor),
+    current_user: Principal = Depends(get_current_active_doctor),
     db: Session = Depends(get_db),
 ):
     """Загрузка аватара врача"""
@@ -123,13 +145,15 @@ async def upload_doctor_avatar(
     profile.avatar_url = relative_path
     db.commit()
     db.refresh(profile)
+    DoctorService.invalidate_catalog()
     return {"avatar_url": DoctorService.build_avatar_url(profile)}
 
 
 @router.get("/profile/avatar/{doctor_id}")
-async def download_doctor_avatar(
+def download_doctor_avatar(
     doctor_id: int,
-    current_user: User = Depends(get_current_user),
+    request: Request,
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """Скачать аватар врача"""
@@ -137,10 +161,10 @@ async def download_doctor_avatar(
     if not doctor or not doctor.avatar_url:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar not found")
 
-    path = resolve_storage_path(doctor.avatar_url)
-    if not path.exists():
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar file missing")
-
-    filename = f"doctor-{doctor_id}-avatar{path.suffix or '.jpg'}"
-    return FileResponse(path, filename=filename)
+    suffix = PurePosixPath(doctor.avatar_url).suffix
+    filename = f"doctor-{doctor_id}-avatar{suffix or '.jpg'}"
+    try:
+        return download_response(request, doctor.avatar_url, filename)
+    except StorageError as exc:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar file missing") from exc
 
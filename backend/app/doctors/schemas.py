@@ -89,3 +89,14 @@ class DoctorListResponse(BaseModel):
     class Config:
         from_attributes = True
 
+
+class SpecialtyFacet(BaseModel):
+    specialty: str
+    count: int
+
+
+class DoctorCatalogResponse(BaseModel):
+    items: List[DoctorListResponse]
+    next_cursor: Optional[str]
+    facets: List[SpecialtyFacet]
+
@@ -1,7 +1,14 @@
+import time
+from decimal import Decimal
+from sqlalchemy import func, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
 from typing import Optional, List
+from app.common.cache import TieredCache
 from app.common.models import DoctorProfile, DoctorCertificate
+from app.common.pagination import InvalidCursorError, decode_cursor, encode_cursor
+from app.common.principal import invalidate_principal
 from app.doctors.schemas import (
     DoctorProfileCreate,
     DoctorProfileUpdate,
@@ -11,6 +18,23 @@ from app.doctors.schemas import (
 )
 from app.config import settings
 
+CATALOG_PAGE_SIZE = 50
+CATALOG_VERSION_KEY = "version"
+
+# sort -> (ключ сортировки, по убыванию); NULL приравнивается к нулю ради keyset
+CATALOG_SORTS = {
+    "rating": (func.coalesce(DoctorProfile.rating, 0), True),
+    "price": (func.coalesce(DoctorProfile.consultation_price_points, 0), False),
+    "experience": (func.coalesce(DoctorProfile.experience_years, 0), True),
+}
+
+catalog_cache = TieredCache(
+    "doctor_catalog",
+    ttl=settings.CATALOG_CACHE_TTL_SECONDS,
+    local_ttl=settings.CACHE_LOCAL_TTL_SECONDS,
+    use_redis=settings.CACHE_BACKEND == "redis",
+)
+
 
 class DoctorService:
     @staticmethod
@@ -83,6 +107,7 @@ class DoctorService:
         db.add(profile)
         db.commit()
         db.refresh(profile)
+        invalidate_principal(user_id)
         return profile
     
     @staticmethod
@@ -107,6 +132,7 @@ class DoctorService:
         
         db.commit()
         db.refresh(profile)
+        DoctorService.invalidate_catalog()
         return profile
     
     @staticmethod
@@ -134,15 +160,140 @@ class DoctorService:
         db.refresh(certificate)
         return certificate
     
+    @staticmethod
+    def _catalog_filters(specialty: Optional[str] = None, search: Optional[str] = None) -> list:
+        filters = [DoctorProfile.is_verified == True]
+        
+        # Подстрочный поиск обслуживают триграммные GIN-индексы (pg_trgm)
+        if specialty:
+            filters.append(DoctorProfile.specialty.ilike(f"%{specialty}%"))
+        if search:
+            pattern = f"%{search}%"
+            filters.append(
+                or_(
+                    DoctorProfile.last_name.ilike(pattern),
+                    DoctorProfile.first_name.ilike(pattern),
+                    DoctorProfile.specialty.ilike(pattern),
+                )
+            )
+        return filters
+    
+    @staticmethod
+    def _doctors_list_query(specialty: Optional[str] = None):
+        return select(DoctorProfile).where(*DoctorService._catalog_filters(specialty))
+    
     @staticmethod
     def get_doctors_list(
         db: Session,
         specialty: Optional[str] = None
     ) -> List[DoctorProfile]:
-        query = db.query(DoctorProfile).filter(DoctorProfile.is_verified == True)
+        query = DoctorService._doctors_list_query(specialty)
+        return db.execute(query).scalars().all()
+    
+    @staticmethod
+    async def get_doctors_list_async(
+        db: AsyncSession,
+        specialty: Optional[str] = None
+    ) -> List[DoctorProfile]:
+        query = DoctorService._doctors_list_query(specialty)
+        result = await db.execute(query)
+        return result.scalars().all()
+    
+    @staticmethod
+    async def get_catalog_async(
+        db: AsyncSession,
+        sort: str = "rating",
+        specialty: Optional[str] = None,
+        search: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = CATALOG_PAGE_SIZE,
+    ) -> dict:
+        """Страница каталога врачей с фасетами по специальностям.
         
-        if specialty:
-            query = query.filter(DoctorProfile.specialty.ilike(f"%{specialty}%"))
+        Готовые страницы кэшируются под текущей версией каталога;
+        invalidate_catalog меняет версию, и старые страницы больше не читаются.
+        """
+        version = await catalog_cache.get_async(CATALOG_VERSION_KEY) or 0
+        cache_key = f"{version}:{sort}:{specialty or ''}:{search or ''}:{cursor or ''}:{limit}"
+        cached = await catalog_cache.get_async(cache_key)
+        if cached is not None:
+            return cached
         
-        return query.all()
+        sort_key, descending = CATALOG_SORTS[sort]
+        filters = DoctorService._catalog_filters(specialty, search)
+        query = select(DoctorProfile, sort_key.label("sort_key")).where(*filters)
+        
+        if cursor:
+            try:
+                after_key, after_id = decode_cursor(cursor, 2)
+                after = tuple_(Decimal(str(after_key)), int(after_id))
+            except (InvalidCursorError, ArithmeticError, ValueError, TypeError):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid cursor"
+                )
+            current = tuple_(sort_key, DoctorProfile.id)
+            query = query.where(current < after if descending else current > after)
+        
+        if descending:
+            query = query.order_by(sort_key.desc(), DoctorProfile.id.desc())
+        else:
+            query = query.order_by(sort_key.asc(), DoctorProfile.id.asc())
+        
+        rows = (await db.execute(query.limit(limit + 1))).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last_profile, last_key = rows[-1]
+            next_cursor = encode_cursor(last_key, last_profile.id)
+        
+        # Фасеты считаются без фильтра по специальности, чтобы показывать альтернативы
+        facets_result = await db.execute(
+            select(DoctorProfile.specialty, func.count(DoctorProfile.id))
+            .where(*DoctorService._catalog_filters(search=search))
+            .where(DoctorProfile.specialty.isnot(None))
+            .group_by(DoctorProfile.specialty)
+            .order_by(func.count(DoctorProfile.id).desc(), DoctorProfile.specialty)
+        )
+        
+        page = {
+            "items": [
+                DoctorService.serialize_list_item(profile).model_dump(mode="json")
+                for profile, _ in rows
+            ],
+            "next_cursor": next_cursor,
+            "facets": [
+                {"specialty": specialty_name, "count": count}
+                for specialty_name, count in facets_result.all()
+            ],
+        }
+        await catalog_cache.set_async(cache_key, page)
+        return page
+    
+    @staticmethod
+    def invalidate_catalog() -> None:
+        catalog_cache.set(CATALOG_VERSION_KEY, time.time_ns())
+    
+    @staticmethod
+    async def get_profile_async(db: AsyncSession, doctor_id: int) -> Optional[DoctorProfile]:
+        result = await db.execute(
+            select(DoctorProfile).where(DoctorProfile.id == doctor_id)
+        )
+        return result.scalar_one_or_none()
+    
+    @staticmethod
+    async def get_profile_by_user_async(db: AsyncSession, user_id: int) -> Optional[DoctorProfile]:
+        result = await db.execute(
+            select(DoctorProfile).where(DoctorProfile.user_id == user_id)
+        )
+        return result.scalar_one_or_none()
+    
+    @staticmethod
+    async def get_certificates_async(db: AsyncSession, user_id: int) -> List[DoctorCertificate]:
+        result = await db.execute(
+            select(DoctorCertificate)
+            .join(DoctorProfile, DoctorCertificate.doctor_id == DoctorProfile.id)
+            .where(DoctorProfile.user_id == user_id)
+        )
+        return result.scalars().all()
 
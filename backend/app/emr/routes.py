@@ -3,7 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List
 from app.common.database import get_db
 from app.common.dependencies import get_current_user, get_current_active_doctor
-from app.common.models import User
+from app.common.principal import Principal
 from app.emr.schemas import EMRRecordCreate, EMRRecordUpdate, EMRRecordResponse
 from app.emr.service import EMRService
 
@@ -11,9 +11,9 @@ router = APIRouter()
 
 
 @router.post("/records", response_model=EMRRecordResponse, status_code=status.HTTP_201_CREATED)
-async def create_emr_record(
+def create_emr_record(
     record_data: EMRRecordCreate,
-    current_user: User = Depends(get_current_active_doctor),
+    current_user: Principal = Depends(get_current_active_doctor),
     db: Session = Depends(get_db)
 ):
     """Создание записи в ЭМК"""
@@ -22,9 +22,9 @@ async def create_emr_record(
 
 
 @router.get("/records/patient/{patient_id}", response_model=List[EMRRecordResponse])
-async def get_patient_records(
+def get_patient_records(
     patient_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Получение записей ЭМК пациента"""
@@ -33,8 +33,8 @@ async def get_patient_records(
 
 
 @router.get("/records/my", response_model=List[EMRRecordResponse])
-async def get_my_records(
-    current_user: User = Depends(get_current_user),
+def get_my_records(
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Получение собственных записей ЭМК"""
@@ -43,9 +43,9 @@ async def get_my_records(
 
 
 @router.get("/records/{record_id}", response_model=EMRRecordResponse)
-async def get_record(
+def get_record(
     record_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Получение записи ЭМК"""
@@ -54,10 +54,10 @@ async def get_record(
 
 
 @router.put("/records/{record_id}", response_model=EMRRecordResponse)
-async def update_record(
+def update_record(
     record_id: int,
     record_data: EMRRecordUpdate,
-    current_user: User = Depends(get_current_active_doctor),
+    current_user: Principal = Depends(get_current_active_doctor),
     db: Session = Depends(get_db)
 ):
     """Обновление записи ЭМК"""
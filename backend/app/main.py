@@ -1,8 +1,13 @@
-from fastapi import FastAPI
+import secrets
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from app.config import settings
-from app.common.database import engine, Base
+from app.common import metrics
+from app.common.database import async_engine, engine, Base
+from app.common.instrumentation import RequestMetricsMiddleware, instrument_engine
+from app.common.pagination import NEXT_CURSOR_HEADER
 import structlog
 
 # Создание таблиц
@@ -45,17 +50,54 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+# Время запросов, размер ответов и число SQL на запрос
+app.add_middleware(RequestMetricsMiddleware)
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
 
 @app.on_event("startup")
 async def startup_event():
     logger.info("DocLink API starting up")
+    from app.auth.sessions import session_purger
+    from app.consultations.chat import chat_writer
+    from app.notifications.dispatcher import dispatch_worker
+    from app.payments.rates import rate_store
+    from app.payments.worker import callback_worker
+
+    await rate_store.start()
+    await callback_worker.start()
+    await dispatch_worker.start()
+    await chat_writer.start()
+    await session_purger.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("DocLink API shutting down")
+    from app.auth.sessions import session_purger
+    from app.common.redis import close_redis
+    from app.common.security import password_hasher
+    from app.consultations.chat import chat_writer
+    from app.consultations.connection_manager import manager
+    from app.notifications.dispatcher import dispatch_worker
+    from app.payments.providers import close_providers
+    from app.payments.rates import rate_store
+    from app.payments.worker import callback_worker
+
+    await session_purger.stop()
+    await chat_writer.stop()
+    await dispatch_worker.stop()
+    await callback_worker.stop()
+    await rate_store.stop()
+    await close_providers()
+    password_hasher.close()
+    await manager.close()
+    await close_redis()
+    await async_engine.dispose()
 
 
 @app.get("/")
@@ -68,6 +110,19 @@ async def health_check():
     return {"status": "healthy"}
 
 
+if metrics.ENABLED and settings.METRICS_TOKEN:
+    @app.get("/metrics", include_in_schema=False)
+    async def prometheus_metrics(request: Request):
+        # Маршруты, размеры комнат и доли ошибок — не для публичного доступа
+        authorization = request.headers.get("authorization", "")
+        if not secrets.compare_digest(authorization.encode(), f"Bearer {settings.METRICS_TOKEN}".encode()):
+            return Response(status_code=401, headers={"WWW-Authenticate": "Bearer"})
+        body, content_type = metrics.render()
+        return Response(content=body, headers={"Content-Type": content_type})
+elif metrics.ENABLED:
+    logger.warning("METRICS_TOKEN is not set, /metrics is not exposed")
+
+
 # Импорт роутеров
 from app.auth.routes import router as auth_router
 from app.users.routes import router as users_router
@@ -79,6 +134,7 @@ from app.payments.routes import router as payments_router
 from app.emr.routes import router as emr_router
 from app.admin.routes import router as admin_router
 from app.withdrawals.routes import router as withdrawals_router
+from app.notifications.routes import router as notifications_router
 
 # Подключение роутеров
 app.include_router(auth_router, prefix=settings.API_V1_PREFIX, tags=["Auth"])
@@ -91,6 +147,7 @@ app.include_router(payments_router, prefix=settings.API_V1_PREFIX, tags=["Paymen
 app.include_router(emr_router, prefix=settings.API_V1_PREFIX, tags=["EMR"])
 app.include_router(admin_router, prefix=settings.API_V1_PREFIX, tags=["Admin"])
 app.include_router(withdrawals_router, prefix=settings.API_V1_PREFIX)
+app.include_router(notifications_router, prefix=settings.API_V1_PREFIX)
 
 
 @app.exception_handler(Exception)
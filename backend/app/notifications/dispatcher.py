@@ -0,0 +1,205 @@
+"""Диспетчер outbox уведомлений.
+
+Бизнес-код только пишет строки notification_outbox в своей транзакции
+(NotificationService.notify), поэтому скорость бронирования не зависит
+от почты. Диспетчер забирает пачку ожидающих строк одного канала,
+продлевая им available_at на NOTIFICATION_LEASE_SECONDS (если процесс
+упадёт посреди отправки, строки вернутся в очередь сами), отправляет её
+вне транзакции и записывает результат. Временные ошибки повторяются с
+растущей задержкой, после NOTIFICATION_MAX_ATTEMPTS попыток или при
+постоянной ошибке строка уходит в dead letter (state = 'dead').
+
+По умолчанию NOTIFICATION_DISPATCH_WORKERS задач на канал крутятся
+внутри API-процесса; при 0 диспетчер запускается отдельно:
+
+    cd backend
+    python -m app.notifications.dispatcher --concurrency 2
+"""
+import argparse
+import asyncio
+import signal
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+import structlog
+from sqlalchemy import select, update
+
+from app.common.database import SessionLocal
+from app.common.models import NotificationOutbox, User
+from app.config import settings
+from app.notifications.senders import OutboundMessage, close_senders, enabled_channels, get_sender
+
+logger = structlog.get_logger()
+
+MAX_RETRY_DELAY_SECONDS = 600
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(5 * 2 ** attempts, MAX_RETRY_DELAY_SECONDS))
+
+
+class NotificationDispatcher:
+    @staticmethod
+    def _claim(channel: str, batch_size: int) -> List[OutboundMessage]:
+        now = datetime.now(timezone.utc)
+        with SessionLocal() as db:
+            pending = (
+                select(NotificationOutbox.id)
+                .where(
+                    NotificationOutbox.channel == channel,
+                    NotificationOutbox.state == "pending",
+                    NotificationOutbox.available_at <= now,
+                )
+                .order_by(NotificationOutbox.available_at, NotificationOutbox.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            claimed = db.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id.in_(pending.scalar_subquery()))
+                .values(
+                    attempts=NotificationOutbox.attempts + 1,
+                    available_at=now + timedelta(seconds=settings.NOTIFICATION_LEASE_SECONDS),
+                )
+                .returning(NotificationOutbox.id, NotificationOutbox.user_id, NotificationOutbox.subject, NotificationOutbox.body),
+                execution_options={"synchronize_session": False},
+            ).all()
+            if not claimed:
+                db.rollback()
+                return []
+            emails = dict(
+                db.execute(select(User.id, User.email).where(User.id.in_({row.user_id for row in claimed}))).all()
+            )
+            db.commit()
+        return [
+            OutboundMessage(outbox_id=row.id, recipient=emails[row.user_id], subject=row.subject, body=row.body)
+            for row in sorted(claimed, key=lambda row: row.id)
+        ]
+
+    @staticmethod
+    def dispatch_batch(channel: str, batch_size: int) -> int:
+        """Отправляет до batch_size ожидающих сообщений канала; возвращает, сколько забрано."""
+        sender = get_sender(channel)
+        if sender is None:
+            return 0
+        messages = NotificationDispatcher._claim(channel, batch_size)
+        if not messages:
+            return 0
+
+        results = sender.send_batch(messages)
+
+        now = datetime.now(timezone.utc)
+        sent = [outbox_id for outbox_id, error in results.items() if error is None]
+        with SessionLocal() as db:
+            if sent:
+                db.execute(
+                    update(NotificationOutbox)
+                    .where(NotificationOutbox.id.in_(sent))
+                    .values(state="sent", sent_at=now, last_error=None),
+                    execution_options={"synchronize_session": False},
+                )
+            failed = {outbox_id: error for outbox_id, error in results.items() if error is not None}
+            if failed:
+                attempts = dict(
+                    db.execute(
+                        select(NotificationOutbox.id, NotificationOutbox.attempts)
+                        .where(NotificationOutbox.id.in_(failed))
+                    ).all()
+                )
+                changes = []
+                for outbox_id, error in failed.items():
+                    dead = error.permanent or attempts[outbox_id] >= settings.NOTIFICATION_MAX_ATTEMPTS
+                    changes.append({
+                        "id": outbox_id,
+                        "state": "dead" if dead else "pending",
+                        "last_error": str(error),
+                        "available_at": now if dead else now + _retry_delay(attempts[outbox_id]),
+                    })
+                    if dead:
+                        logger.warning("Notification dead-lettered", outbox_id=outbox_id, channel=channel, error=str(error))
+                db.execute(update(NotificationOutbox), changes)
+            db.commit()
+        return len(messages)
+
+    @staticmethod
+    def requeue_dead(channel: str) -> int:
+        """Возвращает dead letter канала в очередь (например, после починки SMTP)."""
+        with SessionLocal() as db:
+            result = db.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.channel == channel, NotificationOutbox.state == "dead")
+                .values(state="pending", attempts=0, last_error=None, available_at=datetime.now(timezone.utc)),
+                execution_options={"synchronize_session": False},
+            )
+            db.commit()
+            return result.rowcount
+
+
+class DispatchWorker:
+    def __init__(self) -> None:
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, concurrency: int = settings.NOTIFICATION_DISPATCH_WORKERS) -> None:
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._run(channel))
+            for channel in enabled_channels()
+            for _ in range(concurrency)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        await asyncio.to_thread(close_senders)
+
+    async def _run(self, channel: str) -> None:
+        batch_size = settings.NOTIFICATION_BATCH_SIZE
+        while True:
+            try:
+                dispatched = await asyncio.to_thread(NotificationDispatcher.dispatch_batch, channel, batch_size)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error("Notification dispatcher error", channel=channel, error=str(exc))
+                await asyncio.sleep(1.0)
+                continue
+            if dispatched < batch_size:
+                await asyncio.sleep(settings.NOTIFICATION_POLL_INTERVAL_SECONDS)
+
+
+dispatch_worker = DispatchWorker()
+
+
+async def _serve(concurrency: int) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await dispatch_worker.start(concurrency)
+    logger.info("Notification dispatcher started", channels=enabled_channels(), concurrency=concurrency)
+    await stop.wait()
+    await dispatch_worker.stop()
+    logger.info("Notification dispatcher stopped")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Диспетчер outbox уведомлений")
+    parser.add_argument("--concurrency", type=int, default=max(settings.NOTIFICATION_DISPATCH_WORKERS, 1))
+    parser.add_argument("--requeue-dead", metavar="CHANNEL", help="Вернуть dead letter канала в очередь и выйти")
+    args = parser.parse_args()
+    if args.requeue_dead:
+        print(f"requeued: {NotificationDispatcher.requeue_dead(args.requeue_dead)}")
+        return
+    asyncio.run(_serve(args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.orm import Session
+
+from app.common.database import get_db
+from app.common.dependencies import get_current_user
+from app.common.pagination import NEXT_CURSOR_HEADER, InvalidCursorError
+from app.common.principal import Principal
+from app.notifications.schemas import (
+    MarkAllReadResponse,
+    NotificationResponse,
+    NotificationSyncResponse,
+    UnreadCountResponse,
+)
+from app.notifications.service import NotificationService
+
+router = APIRouter(prefix="/notifications", tags=["Notifications"])
+
+
+def _invalid_cursor() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+@router.get("", response_model=List[NotificationResponse])
+def get_notifications(
+    response: Response,
+    unread_only: bool = False,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """История уведомлений, новые сверху; следующая страница — по X-Next-Cursor"""
+    try:
+        notifications, next_cursor = NotificationService.get_user_notifications(
+            db, current_user.id, unread_only, limit, cursor
+        )
+    except InvalidCursorError:
+        raise _invalid_cursor()
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return notifications
+
+
+@router.get("/unread-count", response_model=UnreadCountResponse)
+def get_unread_count(
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Число непрочитанных для бейджа (из кэша)"""
+    return {"unread": NotificationService.get_unread_count(db, current_user.id)}
+
+
+@router.get("/sync", response_model=NotificationSyncResponse)
+def sync_notifications(
+    since: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Новые уведомления после курсора since; cursor из ответа передаётся в следующий запрос"""
+    try:
+        return NotificationService.sync(db, current_user.id, since, limit)
+    except InvalidCursorError:
+        raise _invalid_cursor()
+
+
+@router.post("/read-all", response_model=MarkAllReadResponse)
+def mark_all_read(
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return {"updated": NotificationService.mark_all_read(db, current_user.id)}
+
+
+@router.post("/{notification_id}/read", response_model=NotificationResponse)
+def mark_as_read(
+    notification_id: int,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    notification = NotificationService.mark_as_read(db, notification_id, current_user.id)
+    if not notification:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Notification not found"
+        )
+    return notification
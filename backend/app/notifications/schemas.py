@@ -0,0 +1,30 @@
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
+
+
+class NotificationResponse(BaseModel):
+    id: int
+    title: str
+    message: str
+    notification_type: Optional[str]
+    is_read: bool
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
+class UnreadCountResponse(BaseModel):
+    unread: int
+
+
+class NotificationSyncResponse(BaseModel):
+    notifications: List[NotificationResponse]
+    cursor: str
+    has_more: bool
+    unread: int
+
+
+class MarkAllReadResponse(BaseModel):
+    updated: int
@@ -0,0 +1,218 @@
+"""Отправка уведомлений по внешним каналам.
+
+Сейчас настроен только email: SMTP-соединения берутся из пула и
+переиспользуются между пачками, а не открываются на каждое письмо.
+Отправители вызываются из потоков диспетчера, поэтому пул и ограничитель
+скорости потокобезопасны. Ограничение скорости действует в пределах
+одного процесса диспетчера.
+"""
+import smtplib
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from email.message import EmailMessage
+from queue import Empty, LifoQueue
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import structlog
+
+from app.config import settings
+
+logger = structlog.get_logger()
+
+# Соединение, простоявшее дольше, проверяется NOOP перед использованием
+SMTP_IDLE_CHECK_SECONDS = 30.0
+
+
+class DeliveryError(Exception):
+    """Не удалось доставить; permanent — повтор бесполезен (сразу в dead letter)."""
+
+    def __init__(self, message: str, permanent: bool = False) -> None:
+        super().__init__(message)
+        self.permanent = permanent
+
+
+@dataclass(frozen=True)
+class OutboundMessage:
+    outbox_id: int
+    recipient: str
+    subject: str
+    body: str
+
+
+class RateLimiter:
+    """Token bucket: не больше rate отправок в секунду, всплеск до burst."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self._rate = rate
+        self._capacity = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self._rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+
+class SMTPConnectionPool:
+    def __init__(self, size: int) -> None:
+        self._idle: "LifoQueue[Tuple[smtplib.SMTP, float]]" = LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT, timeout=settings.SMTP_TIMEOUT_SECONDS)
+        if settings.SMTP_STARTTLS:
+            smtp.starttls()
+        if settings.SMTP_USER:
+            smtp.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+        return smtp
+
+    def _take_idle(self) -> Optional[smtplib.SMTP]:
+        while True:
+            try:
+                smtp, released_at = self._idle.get_nowait()
+            except Empty:
+                return None
+            if time.monotonic() - released_at < SMTP_IDLE_CHECK_SECONDS:
+                return smtp
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._discard(smtp)
+
+    @staticmethod
+    def _discard(smtp: smtplib.SMTP) -> None:
+        try:
+            smtp.close()
+        except OSError:
+            pass
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        self._slots.acquire()
+        smtp = None
+        try:
+            smtp = self._take_idle() or self._connect()
+            yield smtp
+        except (smtplib.SMTPServerDisconnected, OSError):
+            if smtp is not None:
+                self._discard(smtp)
+                smtp = None
+            raise
+        finally:
+            if smtp is not None:
+                self._idle.put((smtp, time.monotonic()))
+            self._slots.release()
+
+    def close(self) -> None:
+        while True:
+            try:
+                smtp, _ = self._idle.get_nowait()
+            except Empty:
+                return
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self._discard(smtp)
+
+
+class NotificationSender(ABC):
+    channel: str = ""
+
+    @property
+    def enabled(self) -> bool:
+        return False
+
+    @abstractmethod
+    def send_batch(self, messages: List[OutboundMessage]) -> Dict[int, Optional[DeliveryError]]:
+        """Отправляет пачку; возвращает outbox_id -> ошибка (None — доставлено)."""
+
+    def close(self) -> None:
+        pass
+
+
+class EmailSender(NotificationSender):
+    channel = "email"
+
+    def __init__(self) -> None:
+        self._pool = SMTPConnectionPool(settings.SMTP_POOL_SIZE)
+        self._limiter = RateLimiter(settings.NOTIFICATION_EMAIL_RATE_PER_SECOND)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.SMTP_HOST)
+
+    @staticmethod
+    def _build(message: OutboundMessage) -> EmailMessage:
+        email = EmailMessage()
+        email["From"] = settings.SMTP_FROM_EMAIL or settings.SMTP_USER
+        email["To"] = message.recipient
+        email["Subject"] = message.subject
+        email.set_content(message.body)
+        return email
+
+    def send_batch(self, messages: List[OutboundMessage]) -> Dict[int, Optional[DeliveryError]]:
+        results: Dict[int, Optional[DeliveryError]] = {}
+        try:
+            with self._pool.connection() as smtp:
+                for message in messages:
+                    self._limiter.acquire()
+                    try:
+                        smtp.send_message(self._build(message))
+                        results[message.outbox_id] = None
+                    except smtplib.SMTPRecipientsRefused as exc:
+                        results[message.outbox_id] = DeliveryError(str(exc.recipients), permanent=True)
+                    except smtplib.SMTPResponseException as exc:
+                        # 5xx — отказ сервера, 4xx — временная ошибка
+                        results[message.outbox_id] = DeliveryError(
+                            f"{exc.smtp_code} {exc.smtp_error!r}", permanent=500 <= exc.smtp_code < 600
+                        )
+        except (smtplib.SMTPException, OSError) as exc:
+            # Соединение упало: всё, что не успели отправить, уйдёт повтором
+            logger.warning("SMTP connection failed", error=repr(exc))
+            for message in messages:
+                results.setdefault(message.outbox_id, DeliveryError(repr(exc)))
+        return results
+
+    def close(self) -> None:
+        self._pool.close()
+
+
+_senders: Dict[str, NotificationSender] = {}
+_SENDER_CLASSES = {"email": EmailSender}
+
+
+def get_sender(channel: str) -> Optional[NotificationSender]:
+    if channel not in _SENDER_CLASSES:
+        return None
+    if channel not in _senders:
+        _senders[channel] = _SENDER_CLASSES[channel]()
+    sender = _senders[channel]
+    return sender if sender.enabled else None
+
+
+def enabled_channels() -> List[str]:
+    """Каналы из NOTIFICATION_CHANNELS, для которых настроена отправка."""
+    channels = [channel.strip() for channel in settings.NOTIFICATION_CHANNELS.split(",") if channel.strip()]
+    return [channel for channel in channels if get_sender(channel) is not None]
+
+
+def close_senders() -> None:
+    for sender in _senders.values():
+        sender.close()
+    _senders.clear()
@@ -1,17 +1,32 @@
+from sqlalchemy import update
 from sqlalchemy.orm import Session
-from typing import List
-from app.common.models import Notification
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from app.common.models import Notification, NotificationOutbox
+from app.common.pagination import InvalidCursorError, decode_cursor, encode_cursor, paginate_by_created
+from app.config import settings
+from app.notifications.senders import enabled_channels
+from app.notifications.unread import track_new_notification, unread_counter
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
 
 
 class NotificationService:
     @staticmethod
-    def create_notification(
+    def notify(
         db: Session,
         user_id: int,
         title: str,
         message: str,
-        notification_type: str = "email"
+        notification_type: str = "push"
     ) -> Notification:
+        """
+        Уведомление в приложении плюс строки outbox для внешних каналов.
+        Не коммитит: всё попадает в транзакцию вызывающего кода, а
+        отправляет диспетчер (app/notifications/dispatcher.py).
+        """
         notification = Notification(
             user_id=user_id,
             title=title,
@@ -19,6 +34,30 @@ class NotificationService:
             notification_type=notification_type
         )
         db.add(notification)
+        db.add_all(
+            NotificationOutbox(
+                notification=notification,
+                user_id=user_id,
+                channel=channel,
+                subject=title,
+                body=message,
+                state="pending",
+                attempts=0,
+            )
+            for channel in enabled_channels()
+        )
+        track_new_notification(db, user_id)
+        return notification
+    
+    @staticmethod
+    def create_notification(
+        db: Session,
+        user_id: int,
+        title: str,
+        message: str,
+        notification_type: str = "email"
+    ) -> Notification:
+        notification = NotificationService.notify(db, user_id, title, message, notification_type)
         db.commit()
         db.refresh(notification)
         return notification
@@ -27,30 +66,104 @@ class NotificationService:
     def get_user_notifications(
         db: Session,
         user_id: int,
-        unread_only: bool = False
-    ) -> List[Notification]:
+        unread_only: bool = False,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Notification], Optional[str]]:
+        """Страница истории (новые сверху) и курсор следующей"""
         query = db.query(Notification).filter(Notification.user_id == user_id)
         
         if unread_only:
             query = query.filter(Notification.is_read == False)
         
-        return query.order_by(Notification.created_at.desc()).all()
+        return paginate_by_created(query, Notification.created_at, Notification.id, cursor, limit)
+    
+    @staticmethod
+    def get_unread_count(db: Session, user_id: int) -> int:
+        return unread_counter.get(db, user_id)
+    
+    @staticmethod
+    def sync(
+        db: Session,
+        user_id: int,
+        since: Optional[str] = None,
+        limit: int = 100
+    ) -> dict:
+        """
+        Уведомления, появившиеся после курсора since (без since — с начала),
+        по возрастанию id, и курсор для следующего запроса.
+
+        Курсор не продвигается дальше строк моложе
+        NOTIFICATION_SYNC_SETTLE_SECONDS: id раздаются при вставке, а видны
+        строки после коммита, и строка с меньшим id может стать видимой
+        позже большей. Свежие строки поэтому могут прийти повторно —
+        клиент схлопывает их по id.
+        """
+        last_id = 0
+        if since:
+            (last_id,) = decode_cursor(since, 1)
+            if not isinstance(last_id, int):
+                raise InvalidCursorError("invalid_cursor")
+        
+        rows = (
+            db.query(Notification)
+            .filter(Notification.user_id == user_id, Notification.id > last_id)
+            .order_by(Notification.id)
+            .limit(limit + 1)
+            .all()
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        settled_before = datetime.now(timezone.utc) - timedelta(seconds=settings.NOTIFICATION_SYNC_SETTLE_SECONDS)
+        next_id = last_id
+        for row in rows:
+            if _as_utc(row.created_at) > settled_before:
+                break
+            next_id = row.id
+        
+        return {
+            "notifications": rows,
+            "cursor": encode_cursor(next_id),
+            "has_more": has_more,
+            "unread": unread_counter.get(db, user_id),
+        }
     
     @staticmethod
     def mark_as_read(
         db: Session,
         notification_id: int,
         user_id: int
-    ) -> Notification:
-        notification = db.query(Notification).filter(
+    ) -> Optional[Notification]:
+        # Условие на is_read: счётчик уменьшается, только если строка правда поменялась
+        result = db.execute(
+            update(Notification)
+            .where(
+                Notification.id == notification_id,
+                Notification.user_id == user_id,
+                Notification.is_read == False
+            )
+            .values(is_read=True),
+            execution_options={"synchronize_session": False}
+        )
+        db.commit()
+        if result.rowcount:
+            unread_counter.add(user_id, -result.rowcount)
+        
+        return db.query(Notification).filter(
             Notification.id == notification_id,
             Notification.user_id == user_id
         ).first()
-        
-        if notification:
-            notification.is_read = True
-            db.commit()
-            db.refresh(notification)
-        
-        return notification
-
+    
+    @staticmethod
+    def mark_all_read(db: Session, user_id: int) -> int:
+        """Одним UPDATE; возвращает, сколько уведомлений отмечено"""
+        result = db.execute(
+            update(Notification)
+            .where(Notification.user_id == user_id, Notification.is_read == False)
+            .values(is_read=True),
+            execution_options={"synchronize_session": False}
+        )
+        db.commit()
+        unread_counter.set(user_id, 0)
+        return result.rowcount
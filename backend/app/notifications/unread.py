@@ -0,0 +1,130 @@
+"""Кэш счётчика непрочитанных уведомлений.
+
+Бейдж читает число из кэша, а не пересчитывает историю. Значение
+поддерживается инкрементами: NotificationService.notify копит прибавки в
+session.info, и они применяются только после коммита транзакции (откат их
+выбрасывает). mark_as_read и mark_all_read правят счётчик сами. Инкремент
+применяется только к уже закэшированному значению; если его нет,
+следующее чтение пересчитает его одним COUNT по индексу
+ix_notifications_user_id_is_read_created_at. TTL ограничивает расхождение,
+если инкремент всё же потерялся.
+"""
+import threading
+from collections import Counter
+from typing import Optional
+
+import structlog
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from app.common.cache import TTLCache
+from app.common.models import Notification
+from app.config import settings
+
+logger = structlog.get_logger()
+
+PENDING_DELTAS_KEY = "unread_notification_deltas"
+
+# Прибавить, только если ключ уже есть: иначе счётчик пересчитается из БД
+_INCR_IF_EXISTS = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+return nil
+"""
+
+
+class UnreadCounter:
+    def __init__(self) -> None:
+        self.use_redis = settings.CACHE_BACKEND == "redis"
+        self.local = TTLCache(maxsize=100_000, ttl=settings.NOTIFICATION_UNREAD_CACHE_TTL_SECONDS)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"cache:notifications_unread:{user_id}"
+
+    @staticmethod
+    def count(db: Session, user_id: int) -> int:
+        return db.scalar(
+            select(func.count(Notification.id)).where(
+                Notification.user_id == user_id, Notification.is_read.is_(False)
+            )
+        )
+
+    def _cached(self, user_id: int) -> Optional[int]:
+        if not self.use_redis:
+            return self.local.get(user_id)
+        from app.common.redis import get_redis
+
+        try:
+            value = get_redis().get(self._key(user_id))
+        except Exception as exc:
+            logger.warning("Unread counter read failed", error=str(exc))
+            return None
+        return None if value is None else int(value)
+
+    def get(self, db: Session, user_id: int) -> int:
+        value = self._cached(user_id)
+        if value is None:
+            value = self.count(db, user_id)
+            self.set(user_id, value)
+        return max(value, 0)
+
+    def set(self, user_id: int, value: int) -> None:
+        if not self.use_redis:
+            self.local.set(user_id, value)
+            return
+        from app.common.redis import get_redis
+
+        try:
+            get_redis().set(self._key(user_id), value, ex=settings.NOTIFICATION_UNREAD_CACHE_TTL_SECONDS)
+        except Exception as exc:
+            logger.warning("Unread counter write failed", error=str(exc))
+
+    def add(self, user_id: int, delta: int) -> None:
+        if not self.use_redis:
+            with self._lock:
+                value = self.local.get(user_id)
+                if value is not None:
+                    self.local.set(user_id, value + delta)
+            return
+        from app.common.redis import get_redis
+
+        try:
+            get_redis().eval(_INCR_IF_EXISTS, 1, self._key(user_id), delta)
+        except Exception as exc:
+            # Без точного значения лучше пересчитать, чем показывать неверное
+            logger.warning("Unread counter update failed", error=str(exc))
+            self.invalidate(user_id)
+
+    def invalidate(self, user_id: int) -> None:
+        if not self.use_redis:
+            self.local.delete(user_id)
+            return
+        from app.common.redis import get_redis
+
+        try:
+            get_redis().delete(self._key(user_id))
+        except Exception as exc:
+            logger.warning("Unread counter invalidation failed", error=str(exc))
+
+
+unread_counter = UnreadCounter()
+
+
+def track_new_notification(db: Session, user_id: int) -> None:
+    """Запоминает +1 к счётчику; применится после коммита db."""
+    db.info.setdefault(PENDING_DELTAS_KEY, Counter())[user_id] += 1
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending_deltas(session: Session) -> None:
+    deltas = session.info.pop(PENDING_DELTAS_KEY, None)
+    for user_id, delta in (deltas or {}).items():
+        unread_counter.add(user_id, delta)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_deltas(session: Session) -> None:
+    session.info.pop(PENDING_DELTAS_KEY, None)
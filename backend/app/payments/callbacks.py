@@ -0,0 +1,234 @@
+"""Приём и обработка callback'ов платёжных систем.
+
+Webhook только сохраняет callback в payment_callbacks и сразу отвечает
+провайдеру. Повторы одного и того же callback'а схлопываются уникальным
+ключом (provider, transaction_id). Пока статус транзакции не финальный,
+новый статус от провайдера обновляет строку и снова ставит её в очередь.
+Начисления делает воркер (app/payments/worker.py): он забирает пачку
+ожидающих строк через FOR UPDATE SKIP LOCKED, блокирует их платежи и
+проводит все пополнения пачки одним Ledger.apply. Начисление происходит
+только при переходе платежа из pending в completed, поэтому повторная
+обработка (replay) не начисляет дважды.
+"""
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import structlog
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.common.database import SessionLocal
+from app.common.models import Payment, PaymentCallbackEvent, TransactionType
+from app.config import settings
+from app.payments.schemas import PaymentCallback
+from app.wallet.ledger import Ledger, LedgerEntry
+
+logger = structlog.get_logger()
+
+SUCCESS_STATUSES = ("completed", "succeeded")
+FINAL_STATUSES = SUCCESS_STATUSES + ("failed",)
+MAX_RETRY_DELAY_SECONDS = 300
+
+_UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(2 ** attempts, MAX_RETRY_DELAY_SECONDS))
+
+
+class PaymentCallbackService:
+    @staticmethod
+    async def enqueue(db: AsyncSession, provider: str, callback_data: PaymentCallback) -> bool:
+        """
+        Сохраняет callback; возвращает False, если это повтор уже принятого
+        статуса или транзакция уже в финальном статусе.
+        """
+        table = PaymentCallbackEvent.__table__
+        now = datetime.now(timezone.utc)
+        insert = _UPSERT_INSERTS[db.get_bind().dialect.name]
+        stmt = insert(table).values(
+            provider=provider,
+            transaction_id=callback_data.transaction_id,
+            status=callback_data.status,
+            amount=callback_data.amount,
+            payload=callback_data.model_dump(mode="json"),
+            state="pending",
+            attempts=0,
+            received_at=now,
+            available_at=now,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.provider, table.c.transaction_id],
+            set_={
+                "status": stmt.excluded.status,
+                "amount": stmt.excluded.amount,
+                "payload": stmt.excluded.payload,
+                "state": "pending",
+                "attempts": 0,
+                "last_error": None,
+                "received_at": now,
+                "available_at": now,
+            },
+            where=table.c.status.notin_(FINAL_STATUSES) & (table.c.status != stmt.excluded.status),
+        ).returning(table.c.id)
+        accepted = (await db.execute(stmt)).first() is not None
+        await db.commit()
+        return accepted
+
+    @staticmethod
+    def _apply(db: Session, events: Sequence[PaymentCallbackEvent], now: datetime) -> None:
+        payments: Dict[Tuple[str, str], Payment] = {
+            (payment.payment_provider, payment.provider_transaction_id): payment
+            for payment in db.scalars(
+                select(Payment)
+                .where(Payment.provider_transaction_id.in_({event.transaction_id for event in events}))
+                .order_by(Payment.id)
+                .with_for_update()
+            )
+        }
+
+        entries: List[LedgerEntry] = []
+        for event in events:
+            event.attempts += 1
+            payment = payments.get((event.provider, event.transaction_id))
+            if payment is None:
+                # Callback мог обогнать сохранение provider_transaction_id у платежа
+                PaymentCallbackService._retry_later(event, "Payment not found", now)
+                continue
+
+            if event.status in SUCCESS_STATUSES and payment.status == "pending":
+                payment.status = "completed"
+                payment.completed_at = now
+                entries.append(
+                    LedgerEntry(
+                        payment.user_id,
+                        TransactionType.PURCHASE,
+                        Decimal(payment.points_amount),
+                        f"Payment #{payment.id}",
+                    )
+                )
+            elif event.status == "failed" and payment.status == "pending":
+                payment.status = "failed"
+
+            event.state = "processed"
+            event.processed_at = now
+            event.last_error = None
+
+        Ledger.apply(db, entries)
+
+    @staticmethod
+    def _retry_later(event: PaymentCallbackEvent, error: str, now: datetime) -> None:
+        event.last_error = error
+        if event.attempts >= settings.PAYMENT_CALLBACK_MAX_ATTEMPTS:
+            event.state = "failed"
+            logger.warning(
+                "Payment callback failed",
+                callback_id=event.id,
+                provider=event.provider,
+                transaction_id=event.transaction_id,
+                error=error,
+            )
+        else:
+            event.available_at = now + _retry_delay(event.attempts)
+
+    @staticmethod
+    def _claim(db: Session, limit: int, now: datetime, ids: Optional[Sequence[int]] = None) -> List[PaymentCallbackEvent]:
+        query = (
+            select(PaymentCallbackEvent)
+            .where(PaymentCallbackEvent.state == "pending", PaymentCallbackEvent.available_at <= now)
+            .order_by(PaymentCallbackEvent.available_at, PaymentCallbackEvent.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        if ids is not None:
+            query = query.where(PaymentCallbackEvent.id.in_(ids))
+        return list(db.scalars(query))
+
+    @staticmethod
+    def process_batch(db: Session, batch_size: int) -> int:
+        """
+        Обрабатывает до batch_size ожидающих callback'ов одной транзакцией и
+        возвращает число забранных строк. Если пачка падает целиком, её
+        строки переобрабатываются по одной, чтобы ошибка одной не держала
+        остальные.
+        """
+        now = datetime.now(timezone.utc)
+        events = PaymentCallbackService._claim(db, batch_size, now)
+        if not events:
+            db.rollback()
+            return 0
+        ids = [event.id for event in events]
+        try:
+            PaymentCallbackService._apply(db, events, now)
+            db.commit()
+            return len(ids)
+        except Exception as exc:
+            db.rollback()
+            if len(ids) == 1:
+                PaymentCallbackService._record_failure(db, ids[0], str(exc), now)
+                return 1
+            logger.warning("Payment callback batch failed, retrying one by one", size=len(ids), error=str(exc))
+
+        for callback_id in ids:
+            events = PaymentCallbackService._claim(db, 1, now, [callback_id])
+            if not events:
+                db.rollback()
+                continue
+            try:
+                PaymentCallbackService._apply(db, events, now)
+                db.commit()
+            except Exception as exc:
+                db.rollback()
+                PaymentCallbackService._record_failure(db, callback_id, str(exc), now)
+        return len(ids)
+
+    @staticmethod
+    def _record_failure(db: Session, callback_id: int, error: str, now: datetime) -> None:
+        event = db.get(PaymentCallbackEvent, callback_id, with_for_update=True)
+        if event is None or event.state != "pending":
+            db.rollback()
+            return
+        event.attempts += 1
+        PaymentCallbackService._retry_later(event, error, now)
+        db.commit()
+
+    @staticmethod
+    def process_pending(batch_size: int) -> int:
+        """process_batch в собственной сессии (для воркеров и потоков)."""
+        with SessionLocal() as db:
+            return PaymentCallbackService.process_batch(db, batch_size)
+
+    @staticmethod
+    def replay(
+        db: Session,
+        states: Sequence[str] = ("failed",),
+        provider: Optional[str] = None,
+        transaction_ids: Optional[Sequence[str]] = None,
+        since: Optional[datetime] = None,
+        dry_run: bool = False,
+    ) -> int:
+        """Возвращает подходящие callback'и в очередь; начисления не задвоятся."""
+        query = select(PaymentCallbackEvent).where(PaymentCallbackEvent.state.in_(states))
+        if provider:
+            query = query.where(PaymentCallbackEvent.provider == provider)
+        if transaction_ids:
+            query = query.where(PaymentCallbackEvent.transaction_id.in_(transaction_ids))
+        if since:
+            query = query.where(PaymentCallbackEvent.received_at >= since)
+
+        events = list(db.scalars(query.with_for_update()))
+        if dry_run:
+            db.rollback()
+            return len(events)
+
+        now = datetime.now(timezone.utc)
+        for event in events:
+            event.state = "pending"
+            event.attempts = 0
+            event.last_error = None
+            event.available_at = now
+        db.commit()
+        return len(events)
@@ -0,0 +1,181 @@
+"""Асинхронные клиенты платёжных систем.
+
+Вызовы провайдеров идут через общий на процесс httpx.AsyncClient с пулом
+соединений и таймаутами и не блокируют event loop. Временные ошибки
+(сеть, таймаут, 429, 5xx) повторяются с экспоненциальной задержкой и
+полным джиттером. Каждый запрос несёт Idempotency-Key, поэтому повтор
+после обрыва не создаст у провайдера второй платёж.
+"""
+import asyncio
+import random
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, Optional
+
+import httpx
+import structlog
+
+from app.config import settings
+
+logger = structlog.get_logger()
+
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRY_BASE_DELAY_SECONDS = 0.25
+RETRY_MAX_DELAY_SECONDS = 4.0
+
+
+class PaymentProviderError(Exception):
+    """Провайдер отклонил запрос или не ответил после всех повторов."""
+
+
+@dataclass(frozen=True)
+class ProviderIntent:
+    id: str
+    status: str
+    client_secret: Optional[str] = None
+
+
+def _retry_delay(attempt: int) -> float:
+    # Полный джиттер: клиенты, упавшие одновременно, не приходят повторно хором
+    return random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
+
+
+def to_minor_units(amount: Decimal) -> int:
+    """Сумма в копейках/центах без потерь на float."""
+    return int((Decimal(str(amount)) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+class PaymentProvider(ABC):
+    name: str = ""
+
+    def __init__(self, base_url: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self._base_url = base_url
+        self._headers = headers or {}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def enabled(self) -> bool:
+        return True
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self._base_url,
+                headers=self._headers,
+                timeout=httpx.Timeout(
+                    settings.PAYMENT_PROVIDER_TIMEOUT_SECONDS,
+                    connect=settings.PAYMENT_PROVIDER_CONNECT_TIMEOUT_SECONDS,
+                ),
+                limits=httpx.Limits(
+                    max_connections=settings.PAYMENT_PROVIDER_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.PAYMENT_PROVIDER_MAX_CONNECTIONS,
+                ),
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _should_retry(self, response: httpx.Response) -> bool:
+        return response.status_code in RETRY_STATUS_CODES
+
+    def _error_message(self, response: httpx.Response) -> str:
+        return f"HTTP {response.status_code}"
+
+    async def _request(self, method: str, path: str, idempotency_key: str, **kwargs) -> dict:
+        client = self._get_client()
+        headers = {"Idempotency-Key": idempotency_key}
+        max_retries = settings.PAYMENT_PROVIDER_MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            try:
+                response = await client.request(method, path, headers=headers, **kwargs)
+            except httpx.TransportError as exc:
+                if attempt == max_retries:
+                    raise PaymentProviderError(f"{self.name} is unavailable: {exc!r}") from exc
+                logger.warning("Payment provider request failed", provider=self.name, attempt=attempt, error=repr(exc))
+            else:
+                if response.is_success:
+                    return response.json()
+                if attempt == max_retries or not self._should_retry(response):
+                    raise PaymentProviderError(self._error_message(response))
+                logger.warning(
+                    "Payment provider request failed",
+                    provider=self.name,
+                    attempt=attempt,
+                    status_code=response.status_code,
+                )
+            await asyncio.sleep(_retry_delay(attempt))
+        raise AssertionError("unreachable")
+
+    @abstractmethod
+    async def create_intent(
+        self,
+        amount: Decimal,
+        currency: str,
+        idempotency_key: str,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> ProviderIntent:
+        ...
+
+
+class StripeProvider(PaymentProvider):
+    name = "stripe"
+
+    def __init__(self) -> None:
+        super().__init__(
+            settings.STRIPE_API_BASE,
+            headers={"Authorization": f"Bearer {settings.STRIPE_SECRET_KEY}"},
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.STRIPE_SECRET_KEY)
+
+    def _should_retry(self, response: httpx.Response) -> bool:
+        # Stripe сам подсказывает, безопасен ли повтор
+        should_retry = response.headers.get("Stripe-Should-Retry")
+        if should_retry is not None:
+            return should_retry == "true"
+        return super()._should_retry(response)
+
+    def _error_message(self, response: httpx.Response) -> str:
+        try:
+            return response.json()["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            return super()._error_message(response)
+
+    async def create_intent(
+        self,
+        amount: Decimal,
+        currency: str,
+        idempotency_key: str,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> ProviderIntent:
+        form = {"amount": str(to_minor_units(amount)), "currency": currency.lower()}
+        for key, value in (metadata or {}).items():
+            form[f"metadata[{key}]"] = str(value)
+        data = await self._request("POST", "/v1/payment_intents", idempotency_key, data=form)
+        return ProviderIntent(id=data["id"], status=data.get("status", ""), client_secret=data.get("client_secret"))
+
+
+_providers: Dict[str, PaymentProvider] = {}
+_PROVIDER_CLASSES = {"stripe": StripeProvider}
+
+
+def get_provider(name: str) -> Optional[PaymentProvider]:
+    """Клиент провайдера с серверным созданием платежа (None — создавать нечего)."""
+    if name not in _PROVIDER_CLASSES:
+        return None
+    if name not in _providers:
+        _providers[name] = _PROVIDER_CLASSES[name]()
+    provider = _providers[name]
+    return provider if provider.enabled else None
+
+
+async def close_providers() -> None:
+    for provider in _providers.values():
+        await provider.close()
+    _providers.clear()
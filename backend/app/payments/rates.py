@@ -0,0 +1,189 @@
+"""Курсы обмена валют на поинты.
+
+История курсов хранится в таблице exchange_rates. Каждый воркер держит её
+целиком в памяти, поэтому расчёт поинтов не ходит в базу. Когда админ
+меняет курсы, воркер, принявший запрос, публикует уведомление в Redis, и
+остальные воркеры сбрасывают свою копию. Сброс только меняет номер
+поколения и не ждёт идущего перечитывания; снимок, прочитанный до сброса,
+поколения не совпадёт и будет перечитан. Страховочный TTL перечитывает
+таблицу, если уведомление потерялось. Курсы с будущим effective_from
+вступают в силу сами, без сброса.
+"""
+import asyncio
+import itertools
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime, timezone
+from decimal import ROUND_DOWN, Decimal
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import structlog
+from sqlalchemy import select
+
+from app.common.database import SessionLocal
+from app.common.models import ExchangeRate
+from app.config import settings
+
+logger = structlog.get_logger()
+
+INVALIDATION_CHANNEL = "exchange_rates:changed"
+BASE_CURRENCY = "RUB"
+
+# currency -> ([effective_from...], [rate...]) по возрастанию effective_from
+RateHistory = Dict[str, Tuple[List[datetime], List[Decimal]]]
+
+
+class _Snapshot(NamedTuple):
+    history: RateHistory
+    loaded_at: float
+    generation: int
+
+
+def _default_rates() -> Dict[str, Decimal]:
+    # str(): Decimal(float) тянет двоичный хвост (Decimal(1.1) != Decimal("1.1"))
+    return {
+        "RUB": Decimal(str(settings.POINTS_EXCHANGE_RATE_RUB)),
+        "USD": Decimal(str(settings.POINTS_EXCHANGE_RATE_USD)),
+        "EUR": Decimal(str(settings.POINTS_EXCHANGE_RATE_EUR)),
+    }
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class ExchangeRateStore:
+    def __init__(self) -> None:
+        self._snapshot_state: Optional[_Snapshot] = None
+        # next() у itertools.count атомарен, сброс обходится без блокировки
+        self._generations = itertools.count(1)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._listener: Optional[asyncio.Task] = None
+
+    def _load(self) -> RateHistory:
+        history: RateHistory = {}
+        with SessionLocal() as db:
+            rows = db.execute(
+                select(ExchangeRate.currency, ExchangeRate.effective_from, ExchangeRate.rate)
+                .order_by(ExchangeRate.currency, ExchangeRate.effective_from, ExchangeRate.id)
+            ).all()
+        for currency, effective_from, rate in rows:
+            times, rates = history.setdefault(currency.upper(), ([], []))
+            times.append(_as_utc(effective_from))
+            rates.append(Decimal(rate))
+        return history
+
+    def _fresh(self) -> Optional[RateHistory]:
+        state = self._snapshot_state
+        if (
+            state is not None
+            and state.generation == self._generation
+            and time.monotonic() - state.loaded_at < settings.EXCHANGE_RATES_CACHE_TTL_SECONDS
+        ):
+            return state.history
+        return None
+
+    def _snapshot(self) -> RateHistory:
+        history = self._fresh()
+        if history is not None:
+            return history
+        # Блокировка только сводит параллельные перечитывания в одно
+        with self._lock:
+            history = self._fresh()
+            if history is None:
+                generation = self._generation
+                history = self._load()
+                self._snapshot_state = _Snapshot(history, time.monotonic(), generation)
+            return history
+
+    def get_rate(self, currency: str, at: Optional[datetime] = None) -> Decimal:
+        """Курс валюты на момент at (по умолчанию сейчас); неизвестная валюта — по курсу RUB."""
+        return self._rate(self._snapshot(), currency, at)
+
+    def _rate(self, history: RateHistory, currency: str, at: Optional[datetime]) -> Decimal:
+        currency = currency.upper()
+        moment = _as_utc(at) if at else datetime.now(timezone.utc)
+        if currency in history:
+            times, rates = history[currency]
+            index = bisect_right(times, moment)
+            if index:
+                return rates[index - 1]
+        defaults = _default_rates()
+        if currency in defaults:
+            return defaults[currency]
+        return self._rate(history, BASE_CURRENCY, at)
+
+    def current_rates(self) -> Dict[str, Decimal]:
+        currencies = set(_default_rates()) | set(self._snapshot())
+        return {currency: self.get_rate(currency) for currency in sorted(currencies)}
+
+    def to_points(self, amount: Decimal, currency: str) -> int:
+        """Сумма в поинтах; дробная часть отбрасывается."""
+        return self._points(self._snapshot(), amount, currency)
+
+    async def to_points_async(self, amount: Decimal, currency: str) -> int:
+        """to_points для event loop: перечитывание таблицы после TTL идёт в потоке."""
+        history = self._fresh()
+        if history is None:
+            history = await asyncio.to_thread(self._snapshot)
+        return self._points(history, amount, currency)
+
+    def _points(self, history: RateHistory, amount: Decimal, currency: str) -> int:
+        points = Decimal(str(amount)) * self._rate(history, currency, None)
+        return int(points.to_integral_value(rounding=ROUND_DOWN))
+
+    def invalidate(self) -> None:
+        self._generation = next(self._generations)
+
+    def notify_changed(self) -> None:
+        """Сбрасывает кэш этого воркера и рассылает сброс остальным."""
+        self.invalidate()
+        if settings.CACHE_BACKEND != "redis":
+            return
+        from app.common.redis import get_redis
+
+        try:
+            get_redis().publish(INVALIDATION_CHANNEL, str(time.time_ns()))
+        except Exception as exc:
+            # Остальные воркеры догонят по EXCHANGE_RATES_CACHE_TTL_SECONDS
+            logger.warning("Exchange rate invalidation publish failed", error=str(exc))
+
+    async def start(self) -> None:
+        if settings.CACHE_BACKEND == "redis" and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is None:
+            return
+        self._listener.cancel()
+        try:
+            await self._listener
+        except asyncio.CancelledError:
+            pass
+        self._listener = None
+
+    async def _listen(self) -> None:
+        from app.common.redis import get_async_redis
+
+        while True:
+            pubsub = get_async_redis().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Пока подписки не было, уведомления могли пройти мимо
+                self.invalidate()
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is not None and message.get("type") == "message":
+                        self.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error("Exchange rate listener error", error=str(exc))
+                await asyncio.sleep(1.0)
+            finally:
+                await pubsub.close()
+
+
+rate_store = ExchangeRateStore()
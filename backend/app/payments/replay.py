@@ -0,0 +1,54 @@
+"""Повторная обработка callback'ов платёжных систем.
+
+Возвращает callback'и в очередь воркера. Начисление привязано к переходу
+платежа из pending в completed, так что переобработка уже проведённых
+callback'ов поинты не задвоит.
+
+    cd backend
+    python -m app.payments.replay                          # все failed
+    python -m app.payments.replay --provider stripe --since 2026-10-01T00:00:00
+    python -m app.payments.replay --transaction-id pi_123 --state processed --process
+"""
+import argparse
+from datetime import datetime
+
+from app.common.database import SessionLocal
+from app.config import settings
+from app.payments.callbacks import PaymentCallbackService
+
+STATES = ("pending", "processed", "failed")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Повторная обработка callback'ов платёжных систем")
+    parser.add_argument("--state", action="append", choices=STATES, help="Состояние callback'ов (по умолчанию failed)")
+    parser.add_argument("--provider", help="stripe, cloudpayments, ...")
+    parser.add_argument("--transaction-id", action="append", dest="transaction_ids", help="Можно указать несколько раз")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="Только полученные начиная с (ISO 8601)")
+    parser.add_argument("--dry-run", action="store_true", help="Только посчитать подходящие callback'и")
+    parser.add_argument("--process", action="store_true", help="Сразу обработать очередь, не дожидаясь воркера")
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        count = PaymentCallbackService.replay(
+            db,
+            states=args.state or ("failed",),
+            provider=args.provider,
+            transaction_ids=args.transaction_ids,
+            since=args.since,
+            dry_run=args.dry_run,
+        )
+    print(f"{'matched' if args.dry_run else 'requeued'}: {count}")
+
+    if args.process and not args.dry_run:
+        processed = 0
+        while True:
+            batch = PaymentCallbackService.process_pending(settings.PAYMENT_CALLBACK_BATCH_SIZE)
+            if not batch:
+                break
+            processed += batch
+        print(f"processed: {processed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Воркер начислений по callback'ам платёжных систем.
+
+По умолчанию PAYMENT_CALLBACK_WORKERS задач крутятся внутри API-процесса.
+Если поставить 0, воркер можно запустить отдельным процессом:
+
+    cd backend
+    python -m app.payments.worker --concurrency 4
+
+Несколько воркеров (задач и процессов) не мешают друг другу: каждая пачка
+забирается через FOR UPDATE SKIP LOCKED.
+"""
+import argparse
+import asyncio
+import signal
+from typing import List
+
+import structlog
+
+from app.config import settings
+from app.payments.callbacks import PaymentCallbackService
+
+logger = structlog.get_logger()
+
+
+class CallbackWorker:
+    def __init__(self) -> None:
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, concurrency: int = settings.PAYMENT_CALLBACK_WORKERS) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(concurrency)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _run(self) -> None:
+        batch_size = settings.PAYMENT_CALLBACK_BATCH_SIZE
+        while True:
+            try:
+                processed = await asyncio.to_thread(PaymentCallbackService.process_pending, batch_size)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error("Payment callback worker error", error=str(exc))
+                await asyncio.sleep(1.0)
+                continue
+            # Полная пачка — очередь, скорее всего, не пуста; берём следующую сразу
+            if processed < batch_size:
+                await asyncio.sleep(settings.PAYMENT_CALLBACK_POLL_INTERVAL_SECONDS)
+
+
+callback_worker = CallbackWorker()
+
+
+async def _serve(concurrency: int) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await callback_worker.start(concurrency)
+    logger.info("Payment callback worker started", concurrency=concurrency)
+    await stop.wait()
+    await callback_worker.stop()
+    logger.info("Payment callback worker stopped")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Воркер начислений по callback'ам платёжных систем")
+    parser.add_argument("--concurrency", type=int, default=max(settings.PAYMENT_CALLBACK_WORKERS, 1))
+    args = parser.parse_args()
+    asyncio.run(_serve(args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
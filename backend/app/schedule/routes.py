@@ -1,13 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime
-from app.common.database import get_db
+from app.common.database import get_async_db, get_db
+from app.config import settings
 from app.common.dependencies import get_current_active_doctor, get_current_user
-from app.common.models import User, ScheduleSlot, DoctorProfile
+from app.common.pagination import NEXT_CURSOR_HEADER
+from app.common.principal import Principal
+from app.common.models import ScheduleSlot, DoctorProfile
 from app.schedule.schemas import (
     ScheduleSlotCreate, ScheduleSlotResponse, ScheduleSlotBulkCreate,
-    AvailableSlotsResponse
+    AvailableSlotsResponse, DoctorNextSlotsResponse
 )
 from app.schedule.service import ScheduleService
 
@@ -16,9 +20,9 @@ router = APIRouter()
 
 @router.post("/schedule/slots", response_model=ScheduleSlotResponse, status_code=status.HTTP_201_CREATED)
 @router.post("/slots", response_model=ScheduleSlotResponse, status_code=status.HTTP_201_CREATED, include_in_schema=False)
-async def create_slot(
+def create_slot(
     slot_data: ScheduleSlotCreate,
-    current_user: User = Depends(get_current_active_doctor),
+    current_user: Principal = Depends(get_current_active_doctor),
     db: Session = Depends(get_db)
 ):
     """Создание слота расписания для врача"""
@@ -28,9 +32,9 @@ async def create_slot(
 
 @router.post("/schedule/slots/bulk", response_model=List[ScheduleSlotResponse], status_code=status.HTTP_201_CREATED)
 @router.post("/slots/bulk", response_model=List[ScheduleSlotResponse], status_code=status.HTTP_201_CREATED, include_in_schema=False)
-async def create_slots_bulk(
+def create_slots_bulk(
     slots_data: ScheduleSlotBulkCreate,
-    current_user: User = Depends(get_current_active_doctor),
+    current_user: Principal = Depends(get_current_active_doctor),
     db: Session = Depends(get_db)
 ):
     """Массовое создание слотов расписания"""
@@ -43,33 +47,58 @@ async def create_slots_bulk(
 async def get_doctor_slots(
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    current_user: User = Depends(get_current_active_doctor),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_doctor),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение слотов расписания врача"""
-    slots = ScheduleService.get_doctor_slots(db, current_user.id, start_date, end_date)
+    slots = await ScheduleService.get_doctor_slots_async(db, current_user.id, start_date, end_date)
     return slots
 
 
 @router.get("/schedule/available", response_model=List[AvailableSlotsResponse])
 @router.get("/available", response_model=List[AvailableSlotsResponse], include_in_schema=False)
 async def get_available_slots(
+    response: Response,
     doctor_id: Optional[int] = None,
     specialty: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    limit_per_doctor: Optional[int] = Query(None, ge=1, le=50),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получение доступных слотов для записи"""
-    slots = ScheduleService.get_available_slots(db, doctor_id, specialty, start_date, end_date)
+    """Получение доступных слотов для записи.
+    
+    Курсор следующей страницы возвращается в заголовке X-Next-Cursor.
+    """
+    slots, next_cursor = await ScheduleService.get_available_slots_async(
+        db, doctor_id, specialty, start_date, end_date, cursor, limit, limit_per_doctor
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return slots
 
 
+@router.get("/schedule/next-slots", response_model=List[DoctorNextSlotsResponse])
+async def get_next_slots(
+    doctor_ids: List[int] = Query(..., max_length=100),
+    count: int = Query(3, ge=1, le=settings.NEXT_SLOTS_CACHE_SIZE),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Ближайшие свободные слоты по списку врачей (для карточек каталога)"""
+    next_slots = await ScheduleService.get_next_free_slots_async(db, doctor_ids, count)
+    return [
+        {"doctor_id": doctor_id, "slots": slots}
+        for doctor_id, slots in next_slots.items()
+    ]
+
+
 @router.delete("/schedule/slots/{slot_id}", status_code=status.HTTP_204_NO_CONTENT)
 @router.delete("/slots/{slot_id}", status_code=status.HTTP_204_NO_CONTENT, include_in_schema=False)
-async def delete_slot(
+def delete_slot(
     slot_id: int,
-    current_user: User = Depends(get_current_active_doctor),
+    current_user: Principal = Depends(get_current_active_doctor),
     db: Session = Depends(get_db)
 ):
     """Удаление слота расписания"""
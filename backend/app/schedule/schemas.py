@@ -30,3 +30,8 @@ class AvailableSlotsResponse(BaseModel):
     doctor_name: str
     slots: List[ScheduleSlotResponse]
 
+
+class DoctorNextSlotsResponse(BaseModel):
+    doctor_id: int
+    slots: List[ScheduleSlotResponse]
+
@@ -1,9 +1,27 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
 from fastapi import HTTPException, status
-from typing import Optional, List
-from datetime import datetime
+from typing import Dict, Optional, List, Tuple
+from datetime import datetime, timezone
+from app.common.cache import TieredCache
 from app.common.models import ScheduleSlot, DoctorProfile, Consultation
-from app.schedule.schemas import ScheduleSlotCreate, ScheduleSlotBulkCreate
+from app.common.pagination import InvalidCursorError, decode_cursor, decode_datetime, encode_cursor
+from app.config import settings
+from app.schedule.schemas import ScheduleSlotCreate, ScheduleSlotBulkCreate, ScheduleSlotResponse
+
+AVAILABLE_SLOTS_PAGE_SIZE = 100
+
+next_slots_cache = TieredCache(
+    "next_slots",
+    ttl=settings.NEXT_SLOTS_CACHE_TTL_SECONDS,
+    local_ttl=settings.CACHE_LOCAL_TTL_SECONDS,
+    use_redis=settings.CACHE_BACKEND == "redis",
+)
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
 
 
 class ScheduleService:
@@ -33,6 +51,7 @@ class ScheduleService:
         db.add(slot)
         db.commit()
         db.refresh(slot)
+        ScheduleService.invalidate_next_slots(doctor.id)
         return slot
     
     @staticmethod
@@ -63,6 +82,7 @@ class ScheduleService:
         db.commit()
         for slot in slots:
             db.refresh(slot)
+        ScheduleService.invalidate_next_slots(doctor.id)
         
         return slots
     
@@ -87,43 +107,212 @@ class ScheduleService:
         return query.order_by(ScheduleSlot.start_time).all()
     
     @staticmethod
-    def get_available_slots(
-        db: Session,
+    async def get_doctor_slots_async(
+        db: AsyncSession,
+        user_id: int,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> List[ScheduleSlot]:
+        query = (
+            select(ScheduleSlot)
+            .join(DoctorProfile, ScheduleSlot.doctor_id == DoctorProfile.id)
+            .where(DoctorProfile.user_id == user_id)
+        )
+        
+        if start_date:
+            query = query.where(ScheduleSlot.start_time >= start_date)
+        if end_date:
+            query = query.where(ScheduleSlot.end_time <= end_date)
+        
+        result = await db.execute(query.order_by(ScheduleSlot.start_time))
+        return result.scalars().all()
+    
+    @staticmethod
+    def _available_slots_query(
         doctor_id: Optional[int] = None,
         specialty: Optional[str] = None,
         start_date: Optional[datetime] = None,
-        end_date: Optional[datetime] = None
-    ) -> List[dict]:
-        query = db.query(ScheduleSlot).join(DoctorProfile).filter(
-            ScheduleSlot.is_available == True,
-            ScheduleSlot.is_reserved == False,
-            DoctorProfile.is_verified == True
+        end_date: Optional[datetime] = None,
+        after: Optional[Tuple[datetime, int]] = None,
+        limit: int = AVAILABLE_SLOTS_PAGE_SIZE,
+        limit_per_doctor: Optional[int] = None,
+    ):
+        """Свободные слоты вместе с именем врача одним запросом, keyset по (start_time, id)."""
+        query = (
+            select(ScheduleSlot, DoctorProfile.first_name, DoctorProfile.last_name)
+            .join(DoctorProfile, ScheduleSlot.doctor_id == DoctorProfile.id)
+            .where(
+                ScheduleSlot.is_available == True,
+                ScheduleSlot.is_reserved == False,
+                DoctorProfile.is_verified == True
+            )
         )
         
         if doctor_id:
-            query = query.filter(ScheduleSlot.doctor_id == doctor_id)
+            query = query.where(ScheduleSlot.doctor_id == doctor_id)
         if specialty:
-            query = query.filter(DoctorProfile.specialty.ilike(f"%{specialty}%"))
+            query = query.where(DoctorProfile.specialty.ilike(f"%{specialty}%"))
         if start_date:
-            query = query.filter(ScheduleSlot.start_time >= start_date)
+            query = query.where(ScheduleSlot.start_time >= start_date)
         if end_date:
-            query = query.filter(ScheduleSlot.end_time <= end_date)
+            query = query.where(ScheduleSlot.end_time <= end_date)
+        
+        slot = ScheduleSlot
+        first_name = DoctorProfile.first_name
+        last_name = DoctorProfile.last_name
+        if limit_per_doctor:
+            # Номер слота у врача считается до курсора, чтобы лимит не сбрасывался между страницами
+            position = func.row_number().over(
+                partition_by=ScheduleSlot.doctor_id,
+                order_by=(ScheduleSlot.start_time, ScheduleSlot.id),
+            ).label("position")
+            subquery = query.add_columns(position).subquery()
+            slot = aliased(ScheduleSlot, subquery)
+            first_name = subquery.c.first_name
+            last_name = subquery.c.last_name
+            query = select(slot, first_name, last_name).where(
+                subquery.c.position <= limit_per_doctor
+            )
         
-        slots = query.order_by(ScheduleSlot.start_time).all()
+        if after:
+            query = query.where(tuple_(slot.start_time, slot.id) > tuple_(*after))
         
-        # Группировка по врачам
-        result = {}
-        for slot in slots:
-            if slot.doctor_id not in result:
-                doctor = db.query(DoctorProfile).filter(DoctorProfile.id == slot.doctor_id).first()
-                result[slot.doctor_id] = {
+        # Лишняя строка показывает, есть ли следующая страница
+        return query.order_by(slot.start_time, slot.id).limit(limit + 1)
+    
+    @staticmethod
+    def _group_available_slots(rows, limit: int) -> Tuple[List[dict], Optional[str]]:
+        rows = list(rows)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1][0]
+            next_cursor = encode_cursor(last.start_time, last.id)
+        
+        # Группировка по врачам (имя врача пришло тем же запросом)
+        grouped = {}
+        for slot, first_name, last_name in rows:
+            if slot.doctor_id not in grouped:
+                grouped[slot.doctor_id] = {
                     "doctor_id": slot.doctor_id,
-                    "doctor_name": f"{doctor.first_name} {doctor.last_name}" if doctor else "",
+                    "doctor_name": f"{first_name} {last_name}",
                     "slots": []
                 }
-            result[slot.doctor_id]["slots"].append(slot)
+            grouped[slot.doctor_id]["slots"].append(slot)
         
-        return list(result.values())
+        return list(grouped.values()), next_cursor
+    
+    @staticmethod
+    def _parse_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+        if not cursor:
+            return None
+        try:
+            start_time, slot_id = decode_cursor(cursor, 2)
+            return decode_datetime(start_time), int(slot_id)
+        except (InvalidCursorError, ValueError, TypeError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+    
+    @staticmethod
+    async def get_available_slots_async(
+        db: AsyncSession,
+        doctor_id: Optional[int] = None,
+        specialty: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = AVAILABLE_SLOTS_PAGE_SIZE,
+        limit_per_doctor: Optional[int] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        query = ScheduleService._available_slots_query(
+            doctor_id, specialty, start_date, end_date,
+            ScheduleService._parse_cursor(cursor), limit, limit_per_doctor,
+        )
+        result = await db.execute(query)
+        return ScheduleService._group_available_slots(result.all(), limit)
+    
+    @staticmethod
+    def get_available_slots(
+        db: Session,
+        doctor_id: Optional[int] = None,
+        specialty: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = AVAILABLE_SLOTS_PAGE_SIZE,
+        limit_per_doctor: Optional[int] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        query = ScheduleService._available_slots_query(
+            doctor_id, specialty, start_date, end_date,
+            ScheduleService._parse_cursor(cursor), limit, limit_per_doctor,
+        )
+        return ScheduleService._group_available_slots(db.execute(query).all(), limit)
+    
+    @staticmethod
+    async def get_next_free_slots_async(
+        db: AsyncSession,
+        doctor_ids: List[int],
+        count: int,
+    ) -> Dict[int, List[dict]]:
+        """Ближайшие свободные слоты по каждому врачу для карточек каталога.
+        
+        Материализация держится в кэше на врача и сбрасывается при любом
+        изменении его слотов (invalidate_next_slots).
+        """
+        now = datetime.now(timezone.utc)
+        found: Dict[int, List[dict]] = {}
+        missing = []
+        for doctor_id in doctor_ids:
+            cached = await next_slots_cache.get_async(doctor_id)
+            if cached is None:
+                missing.append(doctor_id)
+            else:
+                found[doctor_id] = cached
+        
+        if missing:
+            position = func.row_number().over(
+                partition_by=ScheduleSlot.doctor_id,
+                order_by=(ScheduleSlot.start_time, ScheduleSlot.id),
+            ).label("position")
+            subquery = (
+                select(ScheduleSlot, position)
+                .where(
+                    ScheduleSlot.doctor_id.in_(missing),
+                    ScheduleSlot.is_available == True,
+                    ScheduleSlot.is_reserved == False,
+                    ScheduleSlot.start_time > now,
+                )
+                .subquery()
+            )
+            slot = aliased(ScheduleSlot, subquery)
+            result = await db.execute(
+                select(slot)
+                .where(subquery.c.position <= settings.NEXT_SLOTS_CACHE_SIZE)
+                .order_by(slot.doctor_id, slot.start_time, slot.id)
+            )
+            fetched: Dict[int, List[dict]] = {doctor_id: [] for doctor_id in missing}
+            for row in result.scalars().all():
+                fetched[row.doctor_id].append(
+                    ScheduleSlotResponse.model_validate(row).model_dump(mode="json")
+                )
+            for doctor_id, slots in fetched.items():
+                await next_slots_cache.set_async(doctor_id, slots)
+            found.update(fetched)
+        
+        # В кэше могли остаться уже начавшиеся слоты
+        return {
+            doctor_id: [
+                item for item in found[doctor_id]
+                if _as_utc(datetime.fromisoformat(item["start_time"])) > now
+            ][:count]
+            for doctor_id in doctor_ids
+        }
+    
+    @staticmethod
+    def invalidate_next_slots(doctor_id: int) -> None:
+        next_slots_cache.delete(doctor_id)
     
     @staticmethod
     def delete_slot(
@@ -164,4 +353,5 @@ class ScheduleService:
         
         db.delete(slot)
         db.commit()
+        ScheduleService.invalidate_next_slots(doctor.id)
 
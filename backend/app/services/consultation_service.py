@@ -1,22 +1,70 @@
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import and_, or_, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_, inspect, select, update
 from datetime import datetime, timedelta
 from decimal import Decimal
+from typing import List, Optional, Tuple
+import time
 import uuid
 import logging
 
 from app.common.models import (
     Consultation, ConsultationStatus, ScheduleSlot, 
-    Wallet, WalletTransaction, TransactionType,
+    TransactionType,
     DoctorEarnings, ConsultationMessage, EMRRecord,
-    Notification, WithdrawalStatus, Withdrawal,
+    WithdrawalStatus, Withdrawal,
     PatientProfile, DoctorProfile, User
 )
+from app.common.cache import TieredCache
+from app.common.pagination import paginate_by_created
+from app.consultations.access import invalidate_access
+from app.config import settings
+from app.notifications.service import NotificationService
+from app.schedule.service import ScheduleService
+from app.wallet.ledger import Ledger, LedgerEntry
 
 logger = logging.getLogger(__name__)
 
 COMMISSION_PERCENTAGE = 0.20  # 20% комиссия платформы
 
+history_cache = TieredCache(
+    "consultation_history",
+    ttl=settings.CONSULTATION_HISTORY_CACHE_TTL_SECONDS,
+    local_ttl=settings.CACHE_LOCAL_TTL_SECONDS,
+    use_redis=settings.CACHE_BACKEND == "redis",
+)
+
+
+def _full_name(first_name: Optional[str], last_name: Optional[str], fallback: str) -> str:
+    parts = [first_name or "", last_name or ""]
+    name = " ".join(part.strip() for part in parts if part.strip())
+    return name or fallback
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _history_item(row) -> dict:
+    # Поля ConsultationResponse в JSON-виде: страница целиком уходит в кэш
+    return {
+        "id": row.id,
+        "patient_id": row.patient_id,
+        "doctor_id": row.doctor_id,
+        "slot_id": row.slot_id,
+        "status": row.status.value,
+        "room_id": row.room_id,
+        "points_cost": row.points_cost,
+        "points_frozen": row.points_frozen,
+        "started_at": _isoformat(row.started_at),
+        "ended_at": _isoformat(row.ended_at),
+        "created_at": _isoformat(row.created_at),
+        "doctor_name": _full_name(row.doctor_first_name, row.doctor_last_name, "Врач"),
+        "patient_name": _full_name(row.patient_first_name, row.patient_last_name, "Пациент"),
+        "doctor_specialty": row.doctor_specialty,
+        "slot_start_time": _isoformat(row.slot_start_time),
+        "slot_end_time": _isoformat(row.slot_end_time),
+    }
+
 
 class ConsultationService:
     """Сервис для управления консультациями"""
@@ -30,62 +78,52 @@ class ConsultationService:
         points_cost: int
     ) -> Consultation:
         """
-        Забронировать консультацию:
-        1. Проверить доступность слота
-        2. Заморозить поинты пациента
-        3. Создать консультацию
-        4. Отправить уведомления
-        """
+        Забронировать консультацию в одной транзакции:
+        1. Занять слот (UPDATE ... WHERE is_reserved = false RETURNING)
+        2. Загрузить профили пациента и врача
+        3. Создать консультацию и уведомления
+        4. Заморозить поинты пациента
         
-        # Проверка слота
-        slot = db.query(ScheduleSlot).filter(ScheduleSlot.id == slot_id).first()
-        if not slot or not slot.is_available or slot.is_reserved:
-            raise ValueError("Слот недоступен")
-        if slot.doctor_id != doctor_id:
-            raise ValueError("Слот не принадлежит выбранному врачу")
+        Ошибки — ValueError; откат транзакции остаётся за вызывающим.
+        """
         
-        # Получить профили
-        patient_profile = db.query(PatientProfile).filter(
-            PatientProfile.id == patient_id
+        # Занять слот условным UPDATE: из параллельных броней одного слота
+        # строку получит только одна, остальные увидят is_reserved=true
+        claimed = db.execute(
+            update(ScheduleSlot)
+            .where(
+                ScheduleSlot.id == slot_id,
+                ScheduleSlot.doctor_id == doctor_id,
+                ScheduleSlot.is_available.is_(True),
+                ScheduleSlot.is_reserved.is_(False),
+            )
+            .values(is_available=False, is_reserved=True)
+            .returning(ScheduleSlot.start_time),
+            execution_options={"synchronize_session": False},
         ).first()
-        doctor_profile = db.query(DoctorProfile).filter(
-            DoctorProfile.id == doctor_id
+        if claimed is None:
+            slot_doctor_id = db.scalar(select(ScheduleSlot.doctor_id).where(ScheduleSlot.id == slot_id))
+            if slot_doctor_id is not None and slot_doctor_id != doctor_id:
+                raise ValueError("Слот не принадлежит выбранному врачу")
+            raise ValueError("Слот недоступен")
+        start_time = claimed.start_time
+        
+        # Профили пациента и врача одним запросом
+        profiles = db.execute(
+            select(
+                PatientProfile.user_id.label("patient_user_id"),
+                DoctorProfile.user_id.label("doctor_user_id"),
+                DoctorProfile.first_name,
+                DoctorProfile.last_name,
+            )
+            .select_from(PatientProfile)
+            .join(DoctorProfile, DoctorProfile.id == doctor_id)
+            .where(PatientProfile.id == patient_id)
         ).first()
-        
-        if not patient_profile or not doctor_profile:
+        if profiles is None:
             raise ValueError("Пациент или врач не найдены")
         
-        # Получить кошельки пациента
-        patient_wallet = db.query(Wallet).filter(
-            Wallet.user_id == patient_profile.user_id
-        ).first()
-        
-        if not patient_wallet:
-            raise ValueError("Кошелёк пациента не найден")
-        
-        if patient_wallet.balance < points_cost:
-            raise ValueError("Недостаточно поинтов")
-        
-        # Заморозить поинты
-        patient_wallet.balance -= points_cost
-        patient_wallet.frozen_balance += points_cost
-        
-        # Создать запись транзакции
-        transaction = WalletTransaction(
-            wallet_id=patient_wallet.id,
-            transaction_type=TransactionType.FREEZE,
-            amount=points_cost,
-            balance_before=patient_wallet.balance + points_cost,
-            balance_after=patient_wallet.balance,
-            description=f"Бронирование консультации с врачом {doctor_profile.first_name}"
-        )
-        db.add(transaction)
-        
-        # Отметить слот как зарезервированный
-        slot.is_available = False
-        slot.is_reserved = True
-        
-        # Создать консультацию
+        # Консультация, уведомления и их outbox уходят одним flush
         room_id = str(uuid.uuid4())
         consultation = Consultation(
             patient_id=patient_id,
@@ -97,48 +135,79 @@ class ConsultationService:
             points_frozen=True
         )
         db.add(consultation)
-        db.flush()
-        
-        # Создать уведомления
-        patient_notification = Notification(
-            user_id=patient_profile.user_id,
-            title="Консультация забронирована",
-            message=f"Ваша консультация с {doctor_profile.first_name} {doctor_profile.last_name} запланирована на {slot.start_time}",
-            notification_type="push"
+        NotificationService.notify(
+            db,
+            profiles.patient_user_id,
+            "Консультация забронирована",
+            f"Ваша консультация с {profiles.first_name} {profiles.last_name} запланирована на {start_time}",
         )
-        
-        doctor_notification = Notification(
-            user_id=doctor_profile.user_id,
-            title="Новая запись на консультацию",
-            message=f"Пациент записался на консультацию на {slot.start_time}",
-            notification_type="push"
+        NotificationService.notify(
+            db,
+            profiles.doctor_user_id,
+            "Новая запись на консультацию",
+            f"Пациент записался на консультацию на {start_time}",
         )
+        db.flush()
         
-        db.add(patient_notification)
-        db.add(doctor_notification)
+        # Заморозить поинты: условный UPDATE кошелька, при нехватке — InsufficientFundsError (ValueError)
+        Ledger.post(
+            db,
+            profiles.patient_user_id,
+            TransactionType.FREEZE,
+            Decimal(points_cost),
+            description=f"Бронирование консультации с врачом {profiles.first_name}",
+            consultation_id=consultation.id,
+        )
         
         db.commit()
+        ScheduleService.invalidate_next_slots(doctor_id)
+        ConsultationService.invalidate_history(patient_id, doctor_id)
         logger.info(f"Консультация забронирована: {consultation.id}")
         
         return consultation
     
+    @staticmethod
+    def _claim_status(
+        db: Session,
+        consultation_id: int,
+        allowed: List[ConsultationStatus],
+        error: str,
+        **values
+    ) -> Consultation:
+        """
+        Сменить статус условным UPDATE ... WHERE status IN (...) RETURNING:
+        из параллельных переходов одной консультации (REST, WebSocket,
+        админка) строку получит только один, остальные получат ValueError.
+        Строка остаётся заблокированной до коммита вызывающего.
+        """
+        claimed = db.execute(
+            update(Consultation)
+            .where(Consultation.id == consultation_id, Consultation.status.in_(allowed))
+            .values(**values)
+            .returning(Consultation.id),
+            execution_options={"synchronize_session": False},
+        ).first()
+        if claimed is None:
+            if db.scalar(select(Consultation.id).where(Consultation.id == consultation_id)) is None:
+                raise ValueError("Консультация не найдена")
+            raise ValueError(error)
+        return db.get(Consultation, consultation_id, populate_existing=True)
+    
     @staticmethod
     def start_consultation(db: Session, consultation_id: int) -> Consultation:
         """Начать консультацию"""
-        consultation = db.query(Consultation).filter(
-            Consultation.id == consultation_id
-        ).first()
-        
-        if not consultation:
-            raise ValueError("Консультация не найдена")
-        
-        if consultation.status != ConsultationStatus.CREATED:
-            raise ValueError("Только созданные консультации можно начать")
-        
-        consultation.status = ConsultationStatus.ACTIVE
-        consultation.started_at = datetime.utcnow()
+        consultation = ConsultationService._claim_status(
+            db,
+            consultation_id,
+            [ConsultationStatus.CREATED],
+            "Только созданные консультации можно начать",
+            status=ConsultationStatus.ACTIVE,
+            started_at=datetime.utcnow(),
+        )
         
         db.commit()
+        ConsultationService.invalidate_history(consultation.patient_id, consultation.doctor_id)
+        invalidate_access(consultation_id)
         logger.info(f"Консультация начата: {consultation_id}")
         
         return consultation
@@ -147,69 +216,50 @@ class ConsultationService:
     def complete_consultation(db: Session, consultation_id: int) -> Consultation:
         """
         Завершить консультацию:
-        1. Изменить статус
+        1. Изменить статус (условным UPDATE, см. _claim_status)
         2. Списать поинты с пациента
         3. Зачислить доход врачу (с вычетом комиссии)
-        """
-        consultation = db.query(Consultation).filter(
-            Consultation.id == consultation_id
-        ).first()
-        
-        if not consultation:
-            raise ValueError("Консультация не найдена")
-        
-        if consultation.status != ConsultationStatus.ACTIVE:
-            raise ValueError("Только активные консультации можно завершить")
-        
-        consultation.status = ConsultationStatus.COMPLETED
-        consultation.ended_at = datetime.utcnow()
-        
-        # Получить кошельки
-        patient_wallet = db.query(Wallet).filter(
-            Wallet.user_id == db.query(PatientProfile).filter(
-                PatientProfile.id == consultation.patient_id
-            ).first().user_id
-        ).first()
-        
-        doctor_wallet = db.query(Wallet).filter(
-            Wallet.user_id == db.query(DoctorProfile).filter(
-                DoctorProfile.id == consultation.doctor_id
-            ).first().user_id
-        ).first()
         
-        # Финальное списание поинтов пациента
-        patient_wallet.frozen_balance -= consultation.points_cost
-        
-        # Создать транзакцию дебита
-        transaction = WalletTransaction(
-            wallet_id=patient_wallet.id,
-            transaction_type=TransactionType.DEBIT,
-            amount=consultation.points_cost,
-            balance_before=patient_wallet.balance + consultation.points_cost,
-            balance_after=patient_wallet.balance,
-            description="Списание за консультацию",
-            related_consultation_id=consultation_id
+        Проводки делаются только после успешной смены статуса, поэтому
+        параллельные завершения и отмена не проведут их дважды.
+        """
+        consultation = ConsultationService._claim_status(
+            db,
+            consultation_id,
+            [ConsultationStatus.ACTIVE],
+            "Только активные консультации можно завершить",
+            status=ConsultationStatus.COMPLETED,
+            ended_at=datetime.utcnow(),
         )
-        db.add(transaction)
+        
+        patient_user_id = db.query(PatientProfile.user_id).filter(
+            PatientProfile.id == consultation.patient_id
+        ).scalar()
+        doctor_user_id = db.query(DoctorProfile.user_id).filter(
+            DoctorProfile.id == consultation.doctor_id
+        ).scalar()
         
         # Рассчитать доход врача
         platform_commission = Decimal(consultation.points_cost) * Decimal(COMMISSION_PERCENTAGE)
         doctor_income = Decimal(consultation.points_cost) - platform_commission
         
-        # Зачислить доход врачу
-        if doctor_wallet:
-            doctor_wallet.balance += doctor_income
-            
-            doctor_transaction = WalletTransaction(
-                wallet_id=doctor_wallet.id,
+        # Списать замороженные поинты пациента и зачислить доход врачу одной группой проводок
+        Ledger.apply(db, [
+            LedgerEntry(
+                user_id=patient_user_id,
+                transaction_type=TransactionType.DEBIT,
+                amount=Decimal(consultation.points_cost),
+                description="Списание за консультацию",
+                consultation_id=consultation_id,
+            ),
+            LedgerEntry(
+                user_id=doctor_user_id,
                 transaction_type=TransactionType.PURCHASE,
                 amount=doctor_income,
-                balance_before=doctor_wallet.balance - doctor_income,
-                balance_after=doctor_wallet.balance,
                 description=f"Доход от консультации (комиссия платформы: {platform_commission})",
-                related_consultation_id=consultation_id
-            )
-            db.add(doctor_transaction)
+                consultation_id=consultation_id,
+            ),
+        ])
         
         # Обновить earnings врача
         doctor_earnings = None
@@ -231,6 +281,8 @@ class ConsultationService:
             doctor_earnings.available_balance += doctor_income
         
         db.commit()
+        ConsultationService.invalidate_history(consultation.patient_id, consultation.doctor_id)
+        invalidate_access(consultation_id)
         logger.info(f"Консультация завершена: {consultation_id}, доход врача: {doctor_income}")
         
         return consultation
@@ -239,40 +291,30 @@ class ConsultationService:
     def cancel_consultation(db: Session, consultation_id: int, reason: str = None) -> Consultation:
         """
         Отменить консультацию:
-        1. Изменить статус
+        1. Изменить статус (условным UPDATE, см. _claim_status)
         2. Вернуть замороженные поинты пациенту
         """
-        consultation = db.query(Consultation).filter(
-            Consultation.id == consultation_id
-        ).first()
-        
-        if not consultation:
-            raise ValueError("Консультация не найдена")
-        
-        if consultation.status not in [ConsultationStatus.CREATED, ConsultationStatus.ACTIVE]:
-            raise ValueError("Можно отменить только созданные или активные консультации")
+        consultation = ConsultationService._claim_status(
+            db,
+            consultation_id,
+            [ConsultationStatus.CREATED, ConsultationStatus.ACTIVE],
+            "Можно отменить только созданные или активные консультации",
+            status=ConsultationStatus.CANCELLED,
+        )
         
         # Вернуть поинты если они заморожены
         if consultation.points_frozen:
-            patient_wallet = db.query(Wallet).filter(
-                Wallet.user_id == db.query(PatientProfile).filter(
-                    PatientProfile.id == consultation.patient_id
-                ).first().user_id
-            ).first()
-            
-            patient_wallet.frozen_balance -= consultation.points_cost
-            patient_wallet.balance += consultation.points_cost
-            
-            transaction = WalletTransaction(
-                wallet_id=patient_wallet.id,
-                transaction_type=TransactionType.UNFREEZE,
-                amount=consultation.points_cost,
-                balance_before=patient_wallet.balance - consultation.points_cost,
-                balance_after=patient_wallet.balance,
+            patient_user_id = db.query(PatientProfile.user_id).filter(
+                PatientProfile.id == consultation.patient_id
+            ).scalar()
+            Ledger.post(
+                db,
+                patient_user_id,
+                TransactionType.UNFREEZE,
+                Decimal(consultation.points_cost),
                 description=f"Возврат поинтов за отменённую консультацию. Причина: {reason}",
-                related_consultation_id=consultation_id
+                consultation_id=consultation_id,
             )
-            db.add(transaction)
         
         # Освободить слот
         slot = db.query(ScheduleSlot).filter(ScheduleSlot.id == consultation.slot_id).first()
@@ -280,40 +322,111 @@ class ConsultationService:
             slot.is_reserved = False
             slot.is_available = True
         
-        consultation.status = ConsultationStatus.CANCELLED
         db.commit()
+        ScheduleService.invalidate_next_slots(consultation.doctor_id)
+        ConsultationService.invalidate_history(consultation.patient_id, consultation.doctor_id)
+        invalidate_access(consultation_id)
         logger.info(f"Консультация отменена: {consultation_id}")
         
         return consultation
     
     @staticmethod
-    def get_consultation_history(db: Session, user_id: int, role: str, limit: int = 20) -> list:
-        """Получить историю консультаций пользователя"""
-        query = db.query(Consultation).options(joinedload(Consultation.slot))
-        if role == "patient":
-            patient = db.query(PatientProfile).filter(
-                PatientProfile.user_id == user_id
-            ).first()
-            if not patient:
-                return []
-            consultations = (
-                query.filter(Consultation.patient_id == patient.id)
-                .order_by(Consultation.created_at.desc())
-                .limit(limit)
-                .all()
-            )
-        else:  # doctor
-            doctor = db.query(DoctorProfile).filter(
-                DoctorProfile.user_id == user_id
-            ).first()
-            if not doctor:
-                return []
-            consultations = (
-                query.filter(Consultation.doctor_id == doctor.id)
-                .order_by(Consultation.created_at.desc())
-                .limit(limit)
-                .all()
+    def get_consultation_history(
+        db: Session,
+        role: str,
+        profile_id: Optional[int],
+        statuses: Optional[List[str]] = None,
+        cursor: Optional[str] = None,
+        limit: int = 20
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Страница истории консультаций (новые сверху) и курсор следующей.
+        
+        Консультации, слот и имена врача и пациента читаются одним запросом
+        по индексу (patient_id|doctor_id, created_at); строки сразу
+        превращаются в поля ConsultationResponse. Страницы кэшируются под
+        версией истории профиля, которую меняет invalidate_history.
+        """
+        if profile_id is None:
+            return [], None
+        try:
+            status_filter = sorted({ConsultationStatus(value).value for value in statuses or []})
+        except ValueError:
+            raise ValueError("Неизвестный статус консультации")
+        
+        side = "patient" if role == "patient" else "doctor"
+        version = history_cache.get(f"v:{side}:{profile_id}") or 0
+        cache_key = f"{side}:{profile_id}:{version}:{','.join(status_filter)}:{cursor or ''}:{limit}"
+        cached = history_cache.get(cache_key)
+        if cached is not None:
+            return cached["items"], cached["next_cursor"]
+        
+        owner = Consultation.patient_id if side == "patient" else Consultation.doctor_id
+        query = (
+            db.query(
+                Consultation.id,
+                Consultation.patient_id,
+                Consultation.doctor_id,
+                Consultation.slot_id,
+                Consultation.status,
+                Consultation.room_id,
+                Consultation.points_cost,
+                Consultation.points_frozen,
+                Consultation.started_at,
+                Consultation.ended_at,
+                Consultation.created_at,
+                DoctorProfile.first_name.label("doctor_first_name"),
+                DoctorProfile.last_name.label("doctor_last_name"),
+                DoctorProfile.specialty.label("doctor_specialty"),
+                PatientProfile.first_name.label("patient_first_name"),
+                PatientProfile.last_name.label("patient_last_name"),
+                ScheduleSlot.start_time.label("slot_start_time"),
+                ScheduleSlot.end_time.label("slot_end_time"),
             )
+            .outerjoin(DoctorProfile, DoctorProfile.id == Consultation.doctor_id)
+            .outerjoin(PatientProfile, PatientProfile.id == Consultation.patient_id)
+            .outerjoin(ScheduleSlot, ScheduleSlot.id == Consultation.slot_id)
+            .filter(owner == profile_id)
+        )
+        if status_filter:
+            query = query.filter(Consultation.status.in_([ConsultationStatus(value) for value in status_filter]))
         
-        return consultations
-
+        rows, next_cursor = paginate_by_created(
+            query, Consultation.created_at, Consultation.id, cursor, limit
+        )
+        items = [_history_item(row) for row in rows]
+        history_cache.set(cache_key, {"items": items, "next_cursor": next_cursor})
+        return items, next_cursor
+    
+    @staticmethod
+    def invalidate_history(patient_id: int, doctor_id: int) -> None:
+        """Сбрасывает закэшированную историю обоих участников консультации"""
+        version = time.time_ns()
+        history_cache.set(f"v:patient:{patient_id}", version)
+        history_cache.set(f"v:doctor:{doctor_id}", version)
+    
+    @staticmethod
+    def get_messages(
+        db: Session,
+        consultation_id: int,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[ConsultationMessage], Optional[str]]:
+        """Страница чата (новые сверху) и курсор следующей, по индексу (consultation_id, created_at)"""
+        query = db.query(ConsultationMessage).filter(
+            ConsultationMessage.consultation_id == consultation_id
+        )
+        return paginate_by_created(
+            query, ConsultationMessage.created_at, ConsultationMessage.id, cursor, limit
+        )
+    
+    @staticmethod
+    def get_recent_messages(
+        db: Session,
+        consultation_id: int,
+        limit: int
+    ) -> Tuple[List[ConsultationMessage], Optional[str]]:
+        """Последние limit сообщений по возрастанию времени — для повтора при подключении"""
+        messages, cursor = ConsultationService.get_messages(db, consultation_id, limit)
+        messages.reverse()
+        return messages, cursor
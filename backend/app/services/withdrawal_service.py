@@ -5,8 +5,9 @@ import logging
 
 from app.common.models import (
     Withdrawal, WithdrawalStatus, DoctorEarnings, DoctorProfile,
-    Notification, WalletTransaction, TransactionType, Wallet
+    WalletTransaction, TransactionType, Wallet
 )
+from app.notifications.service import NotificationService
 
 logger = logging.getLogger(__name__)
 
@@ -70,23 +71,21 @@ class WithdrawalService:
         earnings.available_balance -= amount
         
         # Создать уведомление администратору
-        admin_notification = Notification(
-            user_id=1,  # Администратор (нужно получать ID админа)
-            title="Новый запрос на вывод средств",
-            message=f"Врач {doctor.first_name} {doctor.last_name} запросил вывод {amount} руб.",
-            notification_type="push"
+        NotificationService.notify(
+            db,
+            1,  # Администратор (нужно получать ID админа)
+            "Новый запрос на вывод средств",
+            f"Врач {doctor.first_name} {doctor.last_name} запросил вывод {amount} руб.",
         )
         
         # Уведомить врача
-        doctor_notification = Notification(
-            user_id=doctor.user_id,
-            title="Запрос на вывод создан",
-            message=f"Ваш запрос на вывод {amount} руб. находится на рассмотрении",
-            notification_type="push"
+        NotificationService.notify(
+            db,
+            doctor.user_id,
+            "Запрос на вывод создан",
+            f"Ваш запрос на вывод {amount} руб. находится на рассмотрении",
         )
         
-        db.add(admin_notification)
-        db.add(doctor_notification)
         db.commit()
         
         logger.info(f"Запрос на вывод создан: {withdrawal.id}, врач: {doctor_id}, сумма: {amount}")
@@ -114,14 +113,12 @@ class WithdrawalService:
             DoctorProfile.id == withdrawal.doctor_id
         ).first()
         
-        notification = Notification(
-            user_id=doctor.user_id,
-            title="Запрос на вывод одобрен",
-            message=f"Ваш запрос на вывод {withdrawal.amount} руб. одобрен",
-            notification_type="push"
+        NotificationService.notify(
+            db,
+            doctor.user_id,
+            "Запрос на вывод одобрен",
+            f"Ваш запрос на вывод {withdrawal.amount} руб. одобрен",
         )
-        
-        db.add(notification)
         db.commit()
         
         logger.info(f"Запрос на вывод одобрен: {withdrawal_id}")
@@ -161,14 +158,12 @@ class WithdrawalService:
             DoctorProfile.id == withdrawal.doctor_id
         ).first()
         
-        notification = Notification(
-            user_id=doctor.user_id,
-            title="Средства выведены",
-            message=f"Средства в размере {withdrawal.amount} руб. переведены на ваш счет",
-            notification_type="push"
+        NotificationService.notify(
+            db,
+            doctor.user_id,
+            "Средства выведены",
+            f"Средства в размере {withdrawal.amount} руб. переведены на ваш счет",
         )
-        
-        db.add(notification)
         db.commit()
         
         logger.info(f"Вывод завершен: {withdrawal_id}")
@@ -203,14 +198,12 @@ class WithdrawalService:
             DoctorProfile.id == withdrawal.doctor_id
         ).first()
         
-        notification = Notification(
-            user_id=doctor.user_id,
-            title="Запрос на вывод отклонен",
-            message=f"Ваш запрос на вывод отклонен. Причина: {reason}",
-            notification_type="push"
+        NotificationService.notify(
+            db,
+            doctor.user_id,
+            "Запрос на вывод отклонен",
+            f"Ваш запрос на вывод отклонен. Причина: {reason}",
         )
-        
-        db.add(notification)
         db.commit()
         
         logger.info(f"Запрос на вывод отклонен: {withdrawal_id}")
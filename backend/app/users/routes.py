@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, status, UploadFile, File, Form
+from fastapi.responses import FileResponse, RedirectResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from app.common.database import get_db
+from app.common.database import get_async_db, get_db
 from app.common.dependencies import get_current_active_patient, get_current_user
-from app.common.models import User, PatientProfile, MedicalFile, UserRole
-from app.common.storage import save_uploaded_file, resolve_storage_path, StorageError
+from app.common.principal import Principal, invalidate_principal
+from app.common.models import PatientProfile, MedicalFile, UserRole
+from app.common.storage import save_uploaded_file, download_response, StorageError
 from app.config import settings
 from app.users.schemas import (
     PatientProfileCreate, PatientProfileUpdate, PatientProfileResponse,
@@ -17,9 +19,9 @@ router = APIRouter()
 
 
 @router.post("/profile", response_model=PatientProfileResponse, status_code=status.HTTP_201_CREATED)
-async def create_patient_profile(
+def create_patient_profile(
     profile_data: PatientProfileCreate,
-    current_user: User = Depends(get_current_active_patient),
+    current_user: Principal = Depends(get_current_active_patient),
     db: Session = Depends(get_db)
 ):
     """Создание профиля пациента"""
@@ -29,11 +31,11 @@ async def create_patient_profile(
 
 @router.get("/profile", response_model=PatientProfileResponse)
 async def get_patient_profile(
-    current_user: User = Depends(get_current_active_patient),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_patient),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение профиля пациента"""
-    profile = db.query(PatientProfile).filter(PatientProfile.user_id == current_user.id).first()
+    profile = await UserService.get_profile_async(db, current_user.id)
     if not profile:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -43,9 +45,9 @@ async def get_patient_profile(
 
 
 @router.put("/profile", response_model=PatientProfileResponse)
-async def update_patient_profile(
+def update_patient_profile(
     profile_data: PatientProfileUpdate,
-    current_user: User = Depends(get_current_active_patient),
+    current_user: Principal = Depends(get_current_active_patient),
     db: Session = Depends(get_db)
 ):
     """Обновление профиля пациента"""
@@ -54,9 +56,9 @@ async def update_patient_profile(
 
 
 @router.post("/medical-files", response_model=MedicalFileResponse, status_code=status.HTTP_201_CREATED)
-async def upload_medical_file(
+def upload_medical_file(
     file_data: MedicalFileCreate,
-    current_user: User = Depends(get_current_active_patient),
+    current_user: Principal = Depends(get_current_active_patient),
     db: Session = Depends(get_db)
 ):
     """Загрузка медицинского файла"""
@@ -65,19 +67,19 @@ async def upload_medical_file(
 
 
 @router.post("/medical-files/upload", response_model=MedicalFileResponse, status_code=status.HTTP_201_CREATED)
-async def upload_medical_file_binary(
+def upload_medical_file_binary(
     description: Optional[str] = Form(None),
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_active_patient),
+    current_user: Principal = Depends(get_current_active_patient),
     db: Session = Depends(get_db),
 ):
     """Загрузка медицинского файла (формы/сканы)"""
-    profile = db.query(PatientProfile).filter(PatientProfile.user_id == current_user.id).first()
-    if not profile:
+    profile_id = current_user.patient_profile_id
+    if not profile_id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
 
     try:
-        _, relative_path = save_uploaded_file(file, f"patients/{profile.id}/medical")
+        _, relative_path = save_uploaded_file(file, f"patients/{profile_id}/medical")
     except StorageError as exc:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -85,7 +87,7 @@ async def upload_medical_file_binary(
         ) from exc
 
     medical_file = MedicalFile(
-        patient_id=profile.id,
+        patient_id=profile_id,
         file_url=relative_path,
         file_name=file.filename or "document",
         file_type=file.content_type,
@@ -99,51 +101,52 @@ async def upload_medical_file_binary(
 
 @router.get("/medical-files", response_model=List[MedicalFileResponse])
 async def get_medical_files(
-    current_user: User = Depends(get_current_active_patient),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_patient),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение списка медицинских файлов"""
-    profile = db.query(PatientProfile).filter(PatientProfile.user_id == current_user.id).first()
-    if not profile:
-        return []
-    files = db.query(MedicalFile).filter(MedicalFile.patient_id == profile.id).all()
-    return files
+    return await UserService.get_medical_files_async(db, current_user.id)
 
 
 @router.get("/medical-files/{file_id}/download")
-async def download_medical_file(
+def download_medical_file(
     file_id: int,
-    current_user: User = Depends(get_current_active_patient),
+    request: Request,
+    current_user: Principal = Depends(get_current_active_patient),
     db: Session = Depends(get_db),
 ):
     """Скачать файл из ЭМК"""
-    profile = db.query(PatientProfile).filter(PatientProfile.user_id == current_user.id).first()
-    if not profile:
+    profile_id = current_user.patient_profile_id
+    if not profile_id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
 
     medical_file = (
         db.query(MedicalFile)
-        .filter(MedicalFile.id == file_id, MedicalFile.patient_id == profile.id)
+        .filter(MedicalFile.id == file_id, MedicalFile.patient_id == profile_id)
         .first()
     )
     if not medical_file or not medical_file.file_url:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
 
-    storage_path = resolve_storage_path(medical_file.file_url)
-    if not storage_path.exists():
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not available")
+    # Файлы из консультаций хранят ссылку на API консультаций, а не ключ хранилища
+    if medical_file.file_url.startswith(settings.API_V1_PREFIX):
+        return RedirectResponse(medical_file.file_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
 
-    return FileResponse(
-        storage_path,
-        filename=medical_file.file_name or "document",
-        media_type=medical_file.file_type or "application/octet-stream",
-    )
+    try:
+        return download_response(
+            request,
+            medical_file.file_url,
+            medical_file.file_name or "document",
+            medical_file.file_type,
+        )
+    except StorageError as exc:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not available") from exc
 
 
 @router.delete("/medical-files/{file_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_medical_file(
+def delete_medical_file(
     file_id: int,
-    current_user: User = Depends(get_current_active_patient),
+    current_user: Principal = Depends(get_current_active_patient),
     db: Session = Depends(get_db)
 ):
     """Удаление медицинского файла"""
@@ -152,9 +155,9 @@ async def delete_medical_file(
 
 
 @router.post("/profile/avatar")
-async def upload_patient_avatar(
+def upload_patient_avatar(
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_active_patient),
+    current_user: Principal = Depends(get_current_active_patient),
     db: Session = Depends(get_db),
 ):
     """Загрузка аватара пациента"""
@@ -165,6 +168,7 @@ async def upload_patient_avatar(
         db.add(profile)
         db.commit()
         db.refresh(profile)
+        invalidate_principal(current_user.id)
 
     try:
         _, relative_path = save_uploaded_file(file, f"avatars/patients/{profile.id}")
@@ -181,9 +185,9 @@ async def upload_patient_avatar(
 
 
 @router.get("/profile/avatar/{patient_id}")
-async def download_patient_avatar(
+def download_patient_avatar(
     patient_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """Скачать аватар пациента"""
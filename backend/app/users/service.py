@@ -1,6 +1,10 @@
+from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
 from app.common.models import PatientProfile, MedicalFile
+from app.common.principal import invalidate_principal
 from app.users.schemas import PatientProfileCreate, PatientProfileUpdate, MedicalFileCreate
 
 
@@ -29,6 +33,7 @@ class UserService:
         db.add(profile)
         db.commit()
         db.refresh(profile)
+        invalidate_principal(user_id)
         return profile
     
     @staticmethod
@@ -55,6 +60,22 @@ class UserService:
         db.refresh(profile)
         return profile
     
+    @staticmethod
+    async def get_profile_async(db: AsyncSession, user_id: int) -> Optional[PatientProfile]:
+        result = await db.execute(
+            select(PatientProfile).where(PatientProfile.user_id == user_id)
+        )
+        return result.scalar_one_or_none()
+    
+    @staticmethod
+    async def get_medical_files_async(db: AsyncSession, user_id: int) -> List[MedicalFile]:
+        result = await db.execute(
+            select(MedicalFile)
+            .join(PatientProfile, MedicalFile.patient_id == PatientProfile.id)
+            .where(PatientProfile.user_id == user_id)
+        )
+        return result.scalars().all()
+    
     @staticmethod
     def upload_medical_file(
         db: Session,
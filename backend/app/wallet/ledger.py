@@ -0,0 +1,135 @@
+"""Атомарные изменения балансов кошельков.
+
+Каждая проводка — один ``UPDATE wallets ... RETURNING`` с условием на
+остаток прямо в WHERE, без чтения кошелька в Python. Параллельные
+списания с одного кошелька сериализуются блокировкой строки в базе, и
+баланс не может уйти в минус. Записи WalletTransaction вставляются одним
+INSERT на всю группу проводок. Коммит остаётся за вызывающим кодом, чтобы
+проводки попадали в одну транзакцию с остальными изменениями.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+from app.common.models import TransactionType, Wallet, WalletTransaction
+
+
+class InsufficientFundsError(ValueError):
+    """Raised when a ledger entry would take a wallet balance below zero."""
+
+
+class WalletNotFoundError(ValueError):
+    """Raised when a debit-like entry targets a user without a wallet."""
+
+
+@dataclass(frozen=True)
+class LedgerEntry:
+    user_id: int
+    transaction_type: TransactionType
+    amount: Decimal
+    description: Optional[str] = None
+    consultation_id: Optional[int] = None
+
+
+# Тип проводки -> (знак для balance, знак для frozen_balance, остаток в balance_before/after)
+_EFFECTS: Dict[TransactionType, Tuple[int, int, str]] = {
+    TransactionType.PURCHASE: (1, 0, "balance"),
+    TransactionType.CREDIT: (1, 0, "balance"),
+    TransactionType.REFUND: (1, 0, "balance"),
+    TransactionType.ADJUSTMENT: (1, 0, "balance"),
+    TransactionType.FREEZE: (-1, 1, "balance"),
+    TransactionType.UNFREEZE: (1, -1, "frozen_balance"),
+    TransactionType.DEBIT: (0, -1, "frozen_balance"),
+}
+
+
+class Ledger:
+    @staticmethod
+    def _update_wallet(db: Session, entry: LedgerEntry, balance_delta: Decimal, frozen_delta: Decimal):
+        stmt = (
+            update(Wallet)
+            .where(Wallet.user_id == entry.user_id)
+            .values(
+                balance=Wallet.balance + balance_delta,
+                frozen_balance=Wallet.frozen_balance + frozen_delta,
+            )
+            .returning(Wallet.id, Wallet.balance, Wallet.frozen_balance)
+        )
+        if balance_delta < 0:
+            stmt = stmt.where(Wallet.balance >= -balance_delta)
+        if frozen_delta < 0:
+            stmt = stmt.where(Wallet.frozen_balance >= -frozen_delta)
+        return db.execute(stmt, execution_options={"synchronize_session": "fetch"}).first()
+
+    @staticmethod
+    def _apply_entry(db: Session, entry: LedgerEntry) -> dict:
+        balance_sign, frozen_sign, tracked = _EFFECTS[entry.transaction_type]
+        amount = Decimal(entry.amount)
+        balance_delta = amount * balance_sign
+        frozen_delta = amount * frozen_sign
+
+        row = Ledger._update_wallet(db, entry, balance_delta, frozen_delta)
+        if row is None:
+            wallet_exists = db.scalar(select(Wallet.id).where(Wallet.user_id == entry.user_id))
+            if wallet_exists is not None:
+                if balance_delta < 0:
+                    raise InsufficientFundsError("Недостаточно поинтов")
+                raise InsufficientFundsError("Недостаточно замороженных поинтов")
+            if balance_delta < 0 or frozen_delta < 0:
+                raise WalletNotFoundError("Кошелёк не найден")
+            # Пополнение кошелька, которого ещё нет: создаём пустой и повторяем
+            db.add(Wallet(user_id=entry.user_id, balance=Decimal("0"), frozen_balance=Decimal("0")))
+            db.flush()
+            row = Ledger._update_wallet(db, entry, balance_delta, frozen_delta)
+
+        wallet_id, balance, frozen_balance = row
+        balance_after = balance if tracked == "balance" else frozen_balance
+        delta = balance_delta if tracked == "balance" else frozen_delta
+        return {
+            "wallet_id": wallet_id,
+            "transaction_type": entry.transaction_type,
+            "amount": amount,
+            "balance_before": balance_after - delta,
+            "balance_after": balance_after,
+            "description": entry.description,
+            "related_consultation_id": entry.consultation_id,
+        }
+
+    @staticmethod
+    def apply(db: Session, entries: Sequence[LedgerEntry]) -> List[WalletTransaction]:
+        """
+        Проводит группу изменений балансов и возвращает созданные транзакции
+        в порядке entries. Не коммитит.
+
+        Кошельки обновляются в порядке user_id, чтобы две группы, задевающие
+        одни и те же кошельки (пациент и врач), не взаимоблокировались.
+        """
+        if not entries:
+            return []
+        order = sorted(range(len(entries)), key=lambda index: entries[index].user_id)
+        rows: List[Optional[dict]] = [None] * len(entries)
+        for index in order:
+            rows[index] = Ledger._apply_entry(db, entries[index])
+
+        return list(
+            db.scalars(
+                insert(WalletTransaction).returning(WalletTransaction, sort_by_parameter_order=True),
+                rows,
+            )
+        )
+
+    @staticmethod
+    def post(
+        db: Session,
+        user_id: int,
+        transaction_type: TransactionType,
+        amount: Decimal,
+        description: Optional[str] = None,
+        consultation_id: Optional[int] = None,
+    ) -> WalletTransaction:
+        """Одна проводка; см. apply."""
+        entry = LedgerEntry(user_id, transaction_type, amount, description, consultation_id)
+        return Ledger.apply(db, [entry])[0]
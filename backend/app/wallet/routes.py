@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app.common.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.common.database import get_async_db
 from app.common.dependencies import get_current_user
-from app.common.models import User, Wallet
+from app.common.principal import Principal
+from app.common.models import Wallet
 from app.wallet.schemas import WalletResponse, WalletTransactionResponse, WalletTransactionList
 from app.wallet.service import WalletService
 
@@ -11,11 +12,11 @@ router = APIRouter(prefix="/wallet", tags=["Wallet"])
 
 @router.get("/balance", response_model=WalletResponse)
 async def get_wallet_balance(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение баланса кошелька"""
-    wallet = WalletService.get_wallet(db, current_user.id)
+    wallet = await WalletService.get_wallet_async(db, current_user.id)
     return wallet
 
 
@@ -23,10 +24,10 @@ async def get_wallet_balance(
 async def get_transactions(
     limit: int = 50,
     offset: int = 0,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получение истории транзакций"""
-    transactions = WalletService.get_transactions(db, current_user.id, limit, offset)
+    transactions = await WalletService.get_transactions_async(db, current_user.id, limit, offset)
     return transactions
 
@@ -1,8 +1,11 @@
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
 from decimal import Decimal
 from typing import List
 from app.common.models import Wallet, WalletTransaction, TransactionType
+from app.wallet.ledger import InsufficientFundsError, Ledger, WalletNotFoundError
 from app.wallet.schemas import WalletTransactionResponse
 
 
@@ -18,6 +21,41 @@ class WalletService:
             db.refresh(wallet)
         return wallet
     
+    @staticmethod
+    async def get_wallet_async(db: AsyncSession, user_id: int) -> Wallet:
+        result = await db.execute(select(Wallet).where(Wallet.user_id == user_id))
+        wallet = result.scalar_one_or_none()
+        if not wallet:
+            # Создаем кошелек если его нет
+            wallet = Wallet(user_id=user_id, balance=Decimal('0'), frozen_balance=Decimal('0'))
+            db.add(wallet)
+            await db.commit()
+            await db.refresh(wallet)
+        return wallet
+    
+    @staticmethod
+    def _post(
+        db: Session,
+        user_id: int,
+        transaction_type: TransactionType,
+        amount: Decimal,
+        consultation_id: int = None,
+        description: str = None,
+        insufficient_detail: str = "Insufficient balance",
+        commit: bool = True,
+    ) -> WalletTransaction:
+        """Проводка через Ledger; commit=False оставляет её в текущей транзакции вызывающего."""
+        try:
+            transaction = Ledger.post(db, user_id, transaction_type, amount, description, consultation_id)
+        except (InsufficientFundsError, WalletNotFoundError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=insufficient_detail
+            )
+        if commit:
+            db.commit()
+        return transaction
+    
     @staticmethod
     def add_points(
         db: Session,
@@ -25,24 +63,11 @@ class WalletService:
         amount: Decimal,
         description: str = None,
         transaction_type: TransactionType = TransactionType.PURCHASE,
+        commit: bool = True,
     ) -> WalletTransaction:
-        wallet = WalletService.get_wallet(db, user_id)
-        balance_before = wallet.balance
-        wallet.balance += amount
-        balance_after = wallet.balance
-        
-        transaction = WalletTransaction(
-            wallet_id=wallet.id,
-            transaction_type=transaction_type,
-            amount=amount,
-            balance_before=balance_before,
-            balance_after=balance_after,
-            description=description
+        return WalletService._post(
+            db, user_id, transaction_type, amount, description=description, commit=commit
         )
-        db.add(transaction)
-        db.commit()
-        db.refresh(transaction)
-        return transaction
     
     @staticmethod
     def freeze_points(
@@ -50,34 +75,13 @@ class WalletService:
         user_id: int,
         amount: Decimal,
         consultation_id: int = None,
-        description: str = None
+        description: str = None,
+        commit: bool = True,
     ) -> WalletTransaction:
-        wallet = WalletService.get_wallet(db, user_id)
-        
-        if wallet.balance < amount:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Insufficient balance"
-            )
-        
-        balance_before = wallet.balance
-        wallet.balance -= amount
-        wallet.frozen_balance += amount
-        balance_after = wallet.balance
-        
-        transaction = WalletTransaction(
-            wallet_id=wallet.id,
-            transaction_type=TransactionType.FREEZE,
-            amount=amount,
-            balance_before=balance_before,
-            balance_after=balance_after,
-            related_consultation_id=consultation_id,
-            description=description
+        return WalletService._post(
+            db, user_id, TransactionType.FREEZE, amount, consultation_id, description,
+            commit=commit,
         )
-        db.add(transaction)
-        db.commit()
-        db.refresh(transaction)
-        return transaction
     
     @staticmethod
     def debit_points(
@@ -85,33 +89,14 @@ class WalletService:
         user_id: int,
         amount: Decimal,
         consultation_id: int = None,
-        description: str = None
+        description: str = None,
+        commit: bool = True,
     ) -> WalletTransaction:
-        wallet = WalletService.get_wallet(db, user_id)
-        
-        if wallet.frozen_balance < amount:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Insufficient frozen balance"
-            )
-        
-        balance_before = wallet.frozen_balance
-        wallet.frozen_balance -= amount
-        balance_after = wallet.frozen_balance
-        
-        transaction = WalletTransaction(
-            wallet_id=wallet.id,
-            transaction_type=TransactionType.DEBIT,
-            amount=amount,
-            balance_before=balance_before,
-            balance_after=balance_after,
-            related_consultation_id=consultation_id,
-            description=description
+        return WalletService._post(
+            db, user_id, TransactionType.DEBIT, amount, consultation_id, description,
+            insufficient_detail="Insufficient frozen balance",
+            commit=commit,
         )
-        db.add(transaction)
-        db.commit()
-        db.refresh(transaction)
-        return transaction
     
     @staticmethod
     def unfreeze_points(
@@ -119,34 +104,14 @@ class WalletService:
         user_id: int,
         amount: Decimal,
         consultation_id: int = None,
-        description: str = None
+        description: str = None,
+        commit: bool = True,
     ) -> WalletTransaction:
-        wallet = WalletService.get_wallet(db, user_id)
-        
-        if wallet.frozen_balance < amount:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Insufficient frozen balance"
-            )
-        
-        balance_before = wallet.frozen_balance
-        wallet.frozen_balance -= amount
-        wallet.balance += amount
-        balance_after = wallet.frozen_balance
-        
-        transaction = WalletTransaction(
-            wallet_id=wallet.id,
-            transaction_type=TransactionType.UNFREEZE,
-            amount=amount,
-            balance_before=balance_before,
-            balance_after=balance_after,
-            related_consultation_id=consultation_id,
-            description=description
+        return WalletService._post(
+            db, user_id, TransactionType.UNFREEZE, amount, consultation_id, description,
+            insufficient_detail="Insufficient frozen balance",
+            commit=commit,
         )
-        db.add(transaction)
-        db.commit()
-        db.refresh(transaction)
-        return transaction
     
     @staticmethod
     def get_transactions(
@@ -170,3 +135,32 @@ class WalletService:
             "total": total
         }
 
+    
+    @staticmethod
+    async def get_transactions_async(
+        db: AsyncSession,
+        user_id: int,
+        limit: int = 50,
+        offset: int = 0
+    ) -> dict:
+        wallet = await WalletService.get_wallet_async(db, user_id)
+        
+        result = await db.execute(
+            select(WalletTransaction)
+            .where(WalletTransaction.wallet_id == wallet.id)
+            .order_by(WalletTransaction.created_at.desc())
+            .limit(limit)
+            .offset(offset)
+        )
+        transactions = result.scalars().all()
+        
+        total = await db.scalar(
+            select(func.count(WalletTransaction.id)).where(
+                WalletTransaction.wallet_id == wallet.id
+            )
+        )
+        
+        return {
+            "transactions": transactions,
+            "total": total
+        }
@@ -5,7 +5,8 @@ from decimal import Decimal
 
 from app.common.database import get_db
 from app.common.dependencies import get_current_user
-from app.common.models import User, UserRole
+from app.common.principal import Principal
+from app.common.models import UserRole
 from app.services.withdrawal_service import WithdrawalService
 from app.withdrawals import schemas
 
@@ -15,7 +16,7 @@ router = APIRouter(tags=["withdrawals"])
 @router.post("/withdrawals/request", response_model=schemas.WithdrawalResponse)
 def request_withdrawal(
     request: schemas.WithdrawalRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Создать запрос на вывод средств (для врачей)"""
@@ -27,12 +28,9 @@ def request_withdrawal(
         )
     
     try:
-        from app.common.models import DoctorProfile
-        doctor_profile = db.query(DoctorProfile).filter(
-            DoctorProfile.user_id == current_user.id
-        ).first()
+        doctor_profile_id = current_user.doctor_profile_id
         
-        if not doctor_profile:
+        if not doctor_profile_id:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Профиль врача не найден"
@@ -40,7 +38,7 @@ def request_withdrawal(
         
         withdrawal = WithdrawalService.request_withdrawal(
             db,
-            doctor_id=doctor_profile.id,
+            doctor_id=doctor_profile_id,
             amount=Decimal(str(request.amount)),
             bank_account=request.bank_account,
             bank_name=request.bank_name
@@ -55,7 +53,7 @@ def request_withdrawal(
 @router.post("/withdrawals/{withdrawal_id}/approve", response_model=schemas.WithdrawalResponse)
 def approve_withdrawal(
     withdrawal_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Одобрить вывод (только для администратора)"""
@@ -76,7 +74,7 @@ def approve_withdrawal(
 @router.post("/withdrawals/{withdrawal_id}/complete", response_model=schemas.WithdrawalResponse)
 def complete_withdrawal(
     withdrawal_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Завершить вывод (только для администратора)"""
@@ -98,7 +96,7 @@ def complete_withdrawal(
 def reject_withdrawal(
     withdrawal_id: int,
     reject_request: schemas.RejectWithdrawalRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Отклонить вывод (только для администратора)"""
@@ -122,7 +120,7 @@ def reject_withdrawal(
 
 @router.get("/withdrawals/history", response_model=List[schemas.WithdrawalResponse])
 def get_withdrawal_history(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Получить историю выводов врача"""
@@ -134,18 +132,15 @@ def get_withdrawal_history(
         )
     
     try:
-        from app.common.models import DoctorProfile
-        doctor_profile = db.query(DoctorProfile).filter(
-            DoctorProfile.user_id == current_user.id
-        ).first()
+        doctor_profile_id = current_user.doctor_profile_id
         
-        if not doctor_profile:
+        if not doctor_profile_id:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Профиль врача не найден"
             )
         
-        withdrawals = WithdrawalService.get_withdrawal_history(db, doctor_profile.id)
+        withdrawals = WithdrawalService.get_withdrawal_history(db, doctor_profile_id)
         return [schemas.WithdrawalResponse.from_orm(w) for w in withdrawals]
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -153,7 +148,7 @@ def get_withdrawal_history(
 
 @router.get("/withdrawals/earnings", response_model=schemas.DoctorEarningsResponse)
 def get_doctor_earnings(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Получить информацию о заработках врача"""
@@ -165,18 +160,15 @@ def get_doctor_earnings(
         )
     
     try:
-        from app.common.models import DoctorProfile
-        doctor_profile = db.query(DoctorProfile).filter(
-            DoctorProfile.user_id == current_user.id
-        ).first()
+        doctor_profile_id = current_user.doctor_profile_id
         
-        if not doctor_profile:
+        if not doctor_profile_id:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Профиль врача не найден"
             )
         
-        earnings = WithdrawalService.get_doctor_earnings(db, doctor_profile.id)
+        earnings = WithdrawalService.get_doctor_earnings(db, doctor_profile_id)
         return schemas.DoctorEarningsResponse.from_orm(earnings)
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -0,0 +1,84 @@
+"""Локальная имитация Stripe API для тестов и замеров задержек.
+
+Отвечает на POST /v1/payment_intents с заданной задержкой и долей
+временных ошибок (503 со Stripe-Should-Retry: true). Повтор с тем же
+Idempotency-Key возвращает тот же PaymentIntent, как настоящий Stripe.
+
+    cd backend
+    python -m benchmarks.fake_stripe --port 12111 --latency-ms 200 --error-rate 0.05
+    # и в .env: STRIPE_API_BASE=http://127.0.0.1:12111  STRIPE_SECRET_KEY=sk_test_fake
+"""
+import argparse
+import asyncio
+import random
+import uuid
+from typing import Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_app(latency_ms: float = 200.0, jitter_ms: float = 50.0, error_rate: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Fake Stripe")
+    intents: Dict[str, dict] = {}
+    app.state.stats = {"requests": 0, "errors": 0, "replayed": 0, "created": 0}
+
+    @app.post("/v1/payment_intents")
+    async def create_payment_intent(request: Request):
+        stats = app.state.stats
+        stats["requests"] += 1
+        await asyncio.sleep(max(0.0, random.gauss(latency_ms, jitter_ms)) / 1000)
+
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return JSONResponse({"error": {"message": "Invalid API Key provided"}}, status_code=401)
+        if random.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse(
+                {"error": {"message": "Fake temporary failure"}},
+                status_code=503,
+                headers={"Stripe-Should-Retry": "true"},
+            )
+
+        key = request.headers.get("Idempotency-Key")
+        if key and key in intents:
+            stats["replayed"] += 1
+            return JSONResponse(intents[key], headers={"Idempotent-Replayed": "true"})
+
+        form = await request.form()
+        intent_id = f"pi_fake_{uuid.uuid4().hex[:24]}"
+        intent = {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": int(form.get("amount", 0)),
+            "currency": form.get("currency", "usd"),
+            "status": "requires_payment_method",
+            "client_secret": f"{intent_id}_secret_{uuid.uuid4().hex[:16]}",
+            "metadata": {key[9:-1]: value for key, value in form.items() if key.startswith("metadata[")},
+        }
+        if key:
+            intents[key] = intent
+        stats["created"] += 1
+        return intent
+
+    @app.get("/stats")
+    async def get_stats():
+        return app.state.stats
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Средняя задержка ответа")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="Разброс задержки (σ)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 503")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency_ms, args.jitter_ms, args.error_rate), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
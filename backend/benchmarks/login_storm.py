@@ -0,0 +1,102 @@
+"""Шторм входов: bcrypt в event loop против пула password_hasher.
+
+Внутри одного event loop — как в одном воркере API — запускает N проверок
+пароля с заданным параллелизмом и одновременно каждые 10 мс делает
+«посторонний» запрос (маленький JSON-ответ). Режим inline повторяет
+прежний путь (verify_password прямо в async-обработчике), режим pool —
+password_hasher из app/common/security.py. Для каждого режима печатает
+пропускную способность входов, их латентность и латентность посторонних
+запросов: в режиме pool её p99 должен оставаться плоским. База не нужна.
+
+    cd backend
+    python -m benchmarks.login_storm --logins 200 --concurrency 50 --rounds 12
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.common.security import get_password_hash, password_hasher, verify_password  # noqa: E402
+from app.config import settings  # noqa: E402
+
+PROBE_INTERVAL_SECONDS = 0.01
+PASSWORD = "correct horse battery staple"
+
+
+async def _probe(stop: asyncio.Event, latencies: List[float]) -> None:
+    while not stop.is_set():
+        scheduled = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL_SECONDS)
+        json.dumps({"status": "healthy"})
+        latencies.append(time.perf_counter() - scheduled - PROBE_INTERVAL_SECONDS)
+
+
+def _percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values) or [0.0]
+    return ordered[min(int(len(ordered) * share), len(ordered) - 1)]
+
+
+async def _run(mode: str, hashed: str, logins: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = 0
+
+    async def login() -> None:
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if mode == "inline":
+                    valid = verify_password(PASSWORD, hashed)
+                else:
+                    valid = await password_hasher.verify(PASSWORD, hashed)
+                failures += not valid
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    probes: List[float] = []
+    prober = asyncio.create_task(_probe(stop, probes))
+    await asyncio.sleep(PROBE_INTERVAL_SECONDS * 5)
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await prober
+
+    print(f"[{mode:>6}] {logins} logins in {elapsed:.2f}s ({logins / elapsed:.1f}/s), failures: {failures}")
+    print(f"         login latency ms p50 {statistics.median(latencies) * 1000:.0f}, "
+          f"p99 {_percentile(latencies, 0.99) * 1000:.0f}")
+    print(f"         unrelated request latency ms p50 {statistics.median(probes) * 1000:.1f}, "
+          f"p99 {_percentile(probes, 0.99) * 1000:.1f}, max {max(probes) * 1000:.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=settings.BCRYPT_ROUNDS, help="Стоимость bcrypt")
+    parser.add_argument("--workers", type=int, default=settings.PASSWORD_HASH_WORKERS, help="Потоков в пуле")
+    parser.add_argument("--mode", choices=("inline", "pool", "both"), default="both")
+    args = parser.parse_args()
+
+    settings.BCRYPT_ROUNDS = args.rounds
+    settings.PASSWORD_HASH_WORKERS = args.workers
+    settings.PASSWORD_HASH_MAX_PENDING = max(settings.PASSWORD_HASH_MAX_PENDING, args.concurrency)
+    hashed = get_password_hash(PASSWORD)
+    print(f"bcrypt rounds {args.rounds}, pool workers {args.workers}, cpu {os.cpu_count()}")
+
+    for mode in ("inline", "pool") if args.mode == "both" else (args.mode,):
+        asyncio.run(_run(mode, hashed, args.logins, args.concurrency))
+    password_hasher.close()
+
+
+if __name__ == "__main__":
+    main()
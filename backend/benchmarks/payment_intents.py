@@ -0,0 +1,134 @@
+"""Создание PaymentIntent под нагрузкой: async-клиент против синхронного SDK.
+
+Поднимает в фоне fake Stripe (benchmarks/fake_stripe.py) с заданной
+задержкой и долей ошибок и создаёт N платежей с заданным параллелизмом
+внутри одного event loop — как это делают запросы одного воркера API.
+Режим sdk повторяет прежний путь (stripe.PaymentIntent.create прямо в
+обработчике), режим async — StripeProvider. Для каждого режима печатает
+пропускную способность, латентность и задержку event loop (насколько
+опаздывает тикер с периодом 10 мс — столько ждут все остальные запросы
+воркера). В конце проверяет идемпотентность повтора с тем же ключом.
+
+    cd backend
+    python -m benchmarks.payment_intents --requests 500 --concurrency 50 --latency-ms 200 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from decimal import Decimal
+from typing import List, Tuple
+
+import stripe
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings  # noqa: E402
+from app.payments.providers import StripeProvider  # noqa: E402
+from benchmarks.fake_stripe import create_app  # noqa: E402
+
+TICK_SECONDS = 0.01
+
+
+def _start_fake_stripe(latency_ms: float, error_rate: float) -> Tuple[str, uvicorn.Server]:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(
+        uvicorn.Config(create_app(latency_ms, latency_ms / 4, error_rate), host="127.0.0.1", port=port, log_level="warning")
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+
+async def _loop_lag(stop: asyncio.Event, lags: List[float]) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(time.perf_counter() - started - TICK_SECONDS)
+
+
+async def _run(mode: str, requests: int, concurrency: int) -> None:
+    provider = StripeProvider()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = 0
+
+    async def create(index: int) -> None:
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if mode == "sdk":
+                    # Прежний путь: синхронный вызов прямо в обработчике
+                    stripe.PaymentIntent.create(
+                        amount=1000, currency="usd", idempotency_key=f"bench-{mode}-{index}",
+                        metadata={"payment_id": index},
+                    )
+                else:
+                    await provider.create_intent(
+                        Decimal("10.00"), "USD", f"bench-{mode}-{index}", {"payment_id": str(index)}
+                    )
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    lags: List[float] = []
+    ticker = asyncio.create_task(_loop_lag(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(create(index) for index in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+
+    ordered = sorted(latencies)
+    lag = sorted(lags) or [0.0]
+    print(f"[{mode:>5}] {requests} intents in {elapsed:.2f}s ({requests / elapsed:.0f}/s), failures: {failures}")
+    print(f"        latency ms p50 {statistics.median(ordered) * 1000:.0f}, "
+          f"p95 {ordered[int(len(ordered) * 0.95)] * 1000:.0f}, max {ordered[-1] * 1000:.0f}")
+    print(f"        event loop lag ms p50 {statistics.median(lag) * 1000:.1f}, "
+          f"p99 {lag[int(len(lag) * 0.99)] * 1000:.1f}, max {lag[-1] * 1000:.1f}")
+
+    if mode == "async":
+        first = await provider.create_intent(Decimal("1"), "USD", "bench-idempotency")
+        second = await provider.create_intent(Decimal("1"), "USD", "bench-idempotency")
+        print(f"        idempotent retry returns same intent: {'OK' if first.id == second.id else 'FAIL'}")
+        await provider.close()
+        if first.id != second.id:
+            sys.exit(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Задержка fake Stripe")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="Доля ответов 503 у fake Stripe")
+    parser.add_argument("--mode", choices=("sdk", "async", "both"), default="both")
+    args = parser.parse_args()
+
+    base_url, server = _start_fake_stripe(args.latency_ms, args.error_rate)
+    settings.STRIPE_API_BASE = base_url
+    settings.STRIPE_SECRET_KEY = "sk_test_fake"
+    print(f"fake stripe: {base_url}, latency {args.latency_ms:.0f} ms, error rate {args.error_rate:.0%}")
+
+    for mode in ("sdk", "async") if args.mode == "both" else (args.mode,):
+        if mode == "sdk":
+            stripe.api_key = settings.STRIPE_SECRET_KEY
+            stripe.api_base = base_url
+            stripe.max_network_retries = settings.PAYMENT_PROVIDER_MAX_RETRIES
+        asyncio.run(_run(mode, args.requests, args.concurrency))
+
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
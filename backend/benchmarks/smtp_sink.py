@@ -0,0 +1,133 @@
+"""Локальный SMTP-сервер-приёмник для тестов доставки уведомлений.
+
+Принимает письма и никуда их не отправляет: печатает тему и адресата,
+при --maildir сохраняет каждое письмо в .eml. Умеет изображать сбои:
+--temp-fail-rate отвечает на DATA 451 (диспетчер повторит), а адреса,
+содержащие --bounce (по умолчанию "bounce"), получают 550 на RCPT
+(письмо сразу уходит в dead letter).
+
+    cd backend
+    python -m benchmarks.smtp_sink --port 1025 --maildir /tmp/mail
+    # и в .env: SMTP_HOST=127.0.0.1  SMTP_PORT=1025  SMTP_STARTTLS=false  SMTP_FROM_EMAIL=noreply@doclink.local
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from email import message_from_bytes
+from email.header import decode_header, make_header
+from typing import List, Optional
+
+
+class SMTPSink:
+    def __init__(self, maildir: Optional[str] = None, temp_fail_rate: float = 0.0, bounce: str = "bounce",
+                 latency_ms: float = 0.0, quiet: bool = False) -> None:
+        self.maildir = maildir
+        self.temp_fail_rate = temp_fail_rate
+        self.bounce = bounce
+        self.latency = latency_ms / 1000
+        self.quiet = quiet
+        self.received = 0
+        self.connections = 0
+        if maildir:
+            os.makedirs(maildir, exist_ok=True)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+
+        async def reply(line: str) -> None:
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        sender: Optional[str] = None
+        recipients: List[str] = []
+        await reply("220 doclink smtp sink")
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                line = raw.decode(errors="replace").rstrip("\r\n")
+                command = line[:4].upper()
+                if command in ("EHLO", "HELO"):
+                    await reply("250-doclink smtp sink\r\n250-8BITMIME\r\n250 SMTPUTF8" if command == "EHLO" else "250 OK")
+                elif command == "MAIL":
+                    sender, recipients = line[10:].strip(), []
+                    await reply("250 OK")
+                elif command == "RCPT":
+                    recipient = line[8:].strip().strip("<>")
+                    if self.bounce and self.bounce in recipient:
+                        await reply("550 No such user")
+                    else:
+                        recipients.append(recipient)
+                        await reply("250 OK")
+                elif command == "DATA":
+                    if not recipients:
+                        await reply("554 No valid recipients")
+                        continue
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = bytearray()
+                    while True:
+                        chunk = await reader.readline()
+                        if chunk in (b".\r\n", b".\n", b""):
+                            break
+                        data += chunk[1:] if chunk.startswith(b"..") else chunk
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    if random.random() < self.temp_fail_rate:
+                        await reply("451 Temporary failure, try again later")
+                    else:
+                        self._store(sender, recipients, bytes(data))
+                        await reply("250 OK: queued")
+                    sender, recipients = None, []
+                elif command == "RSET":
+                    sender, recipients = None, []
+                    await reply("250 OK")
+                elif command == "NOOP":
+                    await reply("250 OK")
+                elif command == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        finally:
+            writer.close()
+
+    def _store(self, sender: Optional[str], recipients: List[str], data: bytes) -> None:
+        self.received += 1
+        if self.maildir:
+            path = os.path.join(self.maildir, f"{time.time_ns()}-{self.received}.eml")
+            with open(path, "wb") as file:
+                file.write(data)
+        if not self.quiet:
+            subject = str(make_header(decode_header(message_from_bytes(data).get("Subject", ""))))
+            print(f"#{self.received} {sender} -> {', '.join(recipients)}: {subject}", flush=True)
+
+
+async def serve(sink: SMTPSink, host: str, port: int) -> None:
+    server = await asyncio.start_server(sink.handle, host, port)
+    print(f"SMTP sink listening on {host}:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--maildir", help="Каталог для .eml")
+    parser.add_argument("--temp-fail-rate", type=float, default=0.0, help="Доля писем с ответом 451")
+    parser.add_argument("--bounce", default="bounce", help="Подстрока адреса, которому отвечать 550")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Задержка ответа на DATA")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+    sink = SMTPSink(args.maildir, args.temp_fail_rate, args.bounce, args.latency_ms, args.quiet)
+    try:
+        asyncio.run(serve(sink, args.host, args.port))
+    except KeyboardInterrupt:
+        print(f"received: {sink.received}, connections: {sink.connections}")
+
+
+if __name__ == "__main__":
+    main()
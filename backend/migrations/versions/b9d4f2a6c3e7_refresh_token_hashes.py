@@ -0,0 +1,41 @@
+"""Refresh token hashes
+
+Revision ID: b9d4f2a6c3e7
+Revises: a3e7c5f9d8b4
+Create Date: 2026-10-17 19:04:51.230418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9d4f2a6c3e7'
+down_revision = 'a3e7c5f9d8b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('refresh_tokens', sa.Column('token_hash', sa.String(length=64), nullable=True))
+    op.add_column('refresh_tokens', sa.Column('user_agent', sa.String(length=255), nullable=True))
+    op.add_column('refresh_tokens', sa.Column('last_used_at', sa.DateTime(timezone=True), nullable=True))
+    # Истёкшие строки переносить незачем; живые токены продолжают работать
+    op.execute('DELETE FROM refresh_tokens WHERE expires_at <= now()')
+    op.execute("UPDATE refresh_tokens SET token_hash = encode(sha256(convert_to(token, 'UTF8')), 'hex')")
+    op.alter_column('refresh_tokens', 'token_hash', nullable=False)
+    op.drop_column('refresh_tokens', 'token')
+    op.create_index(op.f('ix_refresh_tokens_token_hash'), 'refresh_tokens', ['token_hash'], unique=True)
+    op.create_index(op.f('ix_refresh_tokens_expires_at'), 'refresh_tokens', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_refresh_tokens_expires_at'), table_name='refresh_tokens')
+    op.drop_index(op.f('ix_refresh_tokens_token_hash'), table_name='refresh_tokens')
+    # Сами токены из хэшей не восстановить: после отката всем нужно войти заново
+    op.execute('DELETE FROM refresh_tokens')
+    op.add_column('refresh_tokens', sa.Column('token', sa.String(length=500), nullable=False))
+    op.create_unique_constraint('refresh_tokens_token_key', 'refresh_tokens', ['token'])
+    op.drop_column('refresh_tokens', 'last_used_at')
+    op.drop_column('refresh_tokens', 'user_agent')
+    op.drop_column('refresh_tokens', 'token_hash')
@@ -0,0 +1,56 @@
+"""Hot path indexes
+
+Revision ID: c41f7e9a2d15
+Revises: b7a8aa6c6252
+Create Date: 2026-10-17 09:12:40.518223
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f7e9a2d15'
+down_revision = 'b7a8aa6c6252'
+branch_labels = None
+depends_on = None
+
+
+# doctor_profiles.user_id, patient_profiles.user_id, wallets.user_id и
+# refresh_tokens.token уже покрыты индексами своих UNIQUE-ограничений.
+
+
+def upgrade() -> None:
+    op.create_index(op.f('ix_refresh_tokens_user_id'), 'refresh_tokens', ['user_id'], unique=False)
+    op.create_index(op.f('ix_doctor_certificates_doctor_id'), 'doctor_certificates', ['doctor_id'], unique=False)
+    op.create_index(op.f('ix_medical_files_patient_id'), 'medical_files', ['patient_id'], unique=False)
+    op.create_index(op.f('ix_schedule_slots_doctor_id_start_time'), 'schedule_slots', ['doctor_id', 'start_time'], unique=False)
+    op.create_index(
+        op.f('ix_schedule_slots_open_start_time'),
+        'schedule_slots',
+        ['start_time'],
+        unique=False,
+        postgresql_where=sa.text('is_available = true AND is_reserved = false'),
+    )
+    op.create_index(op.f('ix_consultations_patient_id_created_at'), 'consultations', ['patient_id', 'created_at'], unique=False)
+    op.create_index(op.f('ix_consultations_doctor_id_created_at'), 'consultations', ['doctor_id', 'created_at'], unique=False)
+    op.create_index(op.f('ix_consultations_slot_id'), 'consultations', ['slot_id'], unique=False)
+    op.create_index(op.f('ix_consultation_messages_consultation_id_created_at'), 'consultation_messages', ['consultation_id', 'created_at'], unique=False)
+    op.create_index(op.f('ix_wallet_transactions_wallet_id_created_at'), 'wallet_transactions', ['wallet_id', 'created_at'], unique=False)
+    op.create_index(op.f('ix_payments_user_id_created_at'), 'payments', ['user_id', 'created_at'], unique=False)
+    op.create_index(op.f('ix_notifications_user_id_is_read_created_at'), 'notifications', ['user_id', 'is_read', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_notifications_user_id_is_read_created_at'), table_name='notifications')
+    op.drop_index(op.f('ix_payments_user_id_created_at'), table_name='payments')
+    op.drop_index(op.f('ix_wallet_transactions_wallet_id_created_at'), table_name='wallet_transactions')
+    op.drop_index(op.f('ix_consultation_messages_consultation_id_created_at'), table_name='consultation_messages')
+    op.drop_index(op.f('ix_consultations_slot_id'), table_name='consultations')
+    op.drop_index(op.f('ix_consultations_doctor_id_created_at'), table_name='consultations')
+    op.drop_index(op.f('ix_consultations_patient_id_created_at'), table_name='consultations')
+    op.drop_index(op.f('ix_schedule_slots_open_start_time'), table_name='schedule_slots')
+    op.drop_index(op.f('ix_schedule_slots_doctor_id_start_time'), table_name='schedule_slots')
+    op.drop_index(op.f('ix_medical_files_patient_id'), table_name='medical_files')
+    op.drop_index(op.f('ix_doctor_certificates_doctor_id'), table_name='doctor_certificates')
+    op.drop_index(op.f('ix_refresh_tokens_user_id'), table_name='refresh_tokens')
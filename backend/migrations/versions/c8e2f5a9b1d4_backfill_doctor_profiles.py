@@ -0,0 +1,34 @@
+"""Backfill missing doctor profiles
+
+Revision ID: c8e2f5a9b1d4
+Revises: b9d4f2a6c3e7
+Create Date: 2026-10-17 19:42:17.508213
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8e2f5a9b1d4'
+down_revision = 'b9d4f2a6c3e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Профиль врача создают регистрация и смена роли; здесь — для старых
+    # пользователей, которым его раньше досоздавал список заявок в админке
+    op.execute(
+        """
+        INSERT INTO doctor_profiles (user_id, is_verified, verification_status, consultation_price_points)
+        SELECT users.id, false, 'pending', 0
+        FROM users
+        WHERE users.role = 'DOCTOR'
+          AND NOT EXISTS (SELECT 1 FROM doctor_profiles WHERE doctor_profiles.user_id = users.id)
+        """
+    )
+
+
+def downgrade() -> None:
+    # Досозданные профили не отличить от созданных при регистрации
+    pass
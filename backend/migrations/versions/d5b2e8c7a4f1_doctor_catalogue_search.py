@@ -0,0 +1,50 @@
+"""Doctor catalogue search indexes
+
+Revision ID: d5b2e8c7a4f1
+Revises: c41f7e9a2d15
+Create Date: 2026-10-17 11:03:27.904112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5b2e8c7a4f1'
+down_revision = 'c41f7e9a2d15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(
+        op.f('ix_doctor_profiles_specialty_trgm'),
+        'doctor_profiles',
+        ['specialty'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'specialty': 'gin_trgm_ops'},
+    )
+    op.create_index(
+        op.f('ix_doctor_profiles_last_name_trgm'),
+        'doctor_profiles',
+        ['last_name'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'last_name': 'gin_trgm_ops'},
+    )
+    op.create_index(
+        op.f('ix_doctor_profiles_first_name_trgm'),
+        'doctor_profiles',
+        ['first_name'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'first_name': 'gin_trgm_ops'},
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_doctor_profiles_first_name_trgm'), table_name='doctor_profiles')
+    op.drop_index(op.f('ix_doctor_profiles_last_name_trgm'), table_name='doctor_profiles')
+    op.drop_index(op.f('ix_doctor_profiles_specialty_trgm'), table_name='doctor_profiles')
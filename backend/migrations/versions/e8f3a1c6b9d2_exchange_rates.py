@@ -0,0 +1,37 @@
+"""Exchange rates history
+
+Revision ID: e8f3a1c6b9d2
+Revises: d5b2e8c7a4f1
+Create Date: 2026-10-17 13:41:05.216634
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8f3a1c6b9d2'
+down_revision = 'd5b2e8c7a4f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('exchange_rates',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('currency', sa.String(length=3), nullable=False),
+    sa.Column('rate', sa.Numeric(precision=18, scale=6), nullable=False),
+    sa.Column('effective_from', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('created_by_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['created_by_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_exchange_rates_id'), 'exchange_rates', ['id'], unique=False)
+    op.create_index(op.f('ix_exchange_rates_currency_effective_from'), 'exchange_rates', ['currency', 'effective_from'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_exchange_rates_currency_effective_from'), table_name='exchange_rates')
+    op.drop_index(op.f('ix_exchange_rates_id'), table_name='exchange_rates')
+    op.drop_table('exchange_rates')
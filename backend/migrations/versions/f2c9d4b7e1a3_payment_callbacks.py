@@ -0,0 +1,45 @@
+"""Payment callbacks inbox and provider transaction index
+
+Revision ID: f2c9d4b7e1a3
+Revises: e8f3a1c6b9d2
+Create Date: 2026-10-17 15:02:44.871305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c9d4b7e1a3'
+down_revision = 'e8f3a1c6b9d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('payment_callbacks',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('provider', sa.String(length=50), nullable=False),
+    sa.Column('transaction_id', sa.String(length=255), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('amount', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('payload', sa.JSON(), nullable=True),
+    sa.Column('state', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('received_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('available_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('provider', 'transaction_id', name='uq_payment_callbacks_provider_transaction_id')
+    )
+    op.create_index(op.f('ix_payment_callbacks_id'), 'payment_callbacks', ['id'], unique=False)
+    op.create_index('ix_payment_callbacks_pending', 'payment_callbacks', ['available_at', 'id'], unique=False, postgresql_where=sa.text("state = 'pending'"))
+    op.create_index('ix_payments_provider_transaction_id', 'payments', ['provider_transaction_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_payments_provider_transaction_id', table_name='payments')
+    op.drop_index('ix_payment_callbacks_pending', table_name='payment_callbacks', postgresql_where=sa.text("state = 'pending'"))
+    op.drop_index(op.f('ix_payment_callbacks_id'), table_name='payment_callbacks')
+    op.drop_table('payment_callbacks')
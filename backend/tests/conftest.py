@@ -0,0 +1,86 @@
+"""Общие фикстуры тестов.
+
+Тесты идут на базе из TEST_DATABASE_URL (по умолчанию временный файл
+SQLite). Схема создаётся перед каждым тестом и удаляется после него.
+"""
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+import pytest_asyncio
+
+_TMP_DIR = tempfile.mkdtemp(prefix="doclink-tests-")
+os.environ["DATABASE_URL"] = os.environ.get("TEST_DATABASE_URL", f"sqlite:///{_TMP_DIR}/test.db")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("S3_ENDPOINT_URL", "http://localhost:9000")
+os.environ.setdefault("S3_ACCESS_KEY", "test")
+os.environ.setdefault("S3_SECRET_KEY", "test")
+
+from app.common.database import AsyncSessionLocal, Base, SessionLocal, async_engine, engine  # noqa: E402
+from app.common.models import (  # noqa: E402
+    DoctorProfile,
+    PatientProfile,
+    ScheduleSlot,
+    User,
+    UserRole,
+    Wallet,
+)
+
+
+@pytest.fixture(autouse=True)
+def schema():
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest_asyncio.fixture
+async def async_db():
+    async with AsyncSessionLocal() as session:
+        yield session
+    # Соединения пула привязаны к event loop теста
+    await async_engine.dispose()
+
+
+def create_user(db, email: str, role: UserRole = UserRole.PATIENT, balance: int = 0) -> User:
+    """Пользователь с профилем по роли и кошельком."""
+    user = User(email=email, password_hash="x", role=role, is_verified=True)
+    db.add(user)
+    db.flush()
+    if role == UserRole.DOCTOR:
+        db.add(DoctorProfile(user_id=user.id, first_name="Пётр", last_name="Иванов", is_verified=True))
+    else:
+        db.add(PatientProfile(user_id=user.id, first_name="Иван", last_name="Сидоров"))
+    db.add(Wallet(user_id=user.id, balance=Decimal(balance), frozen_balance=Decimal("0")))
+    db.commit()
+    return user
+
+
+def create_slot(db, doctor_id: int) -> ScheduleSlot:
+    start = datetime.now(timezone.utc) + timedelta(days=1)
+    slot = ScheduleSlot(
+        doctor_id=doctor_id,
+        start_time=start,
+        end_time=start + timedelta(hours=1),
+        is_available=True,
+        is_reserved=False,
+    )
+    db.add(slot)
+    db.commit()
+    return slot
+
+
+def wallet_of(db, user_id: int) -> Wallet:
+    db.expire_all()
+    return db.query(Wallet).filter(Wallet.user_id == user_id).one()
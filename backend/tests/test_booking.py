@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.common.database import SessionLocal
+from app.common.models import Consultation, ScheduleSlot, UserRole
+from app.services.consultation_service import ConsultationService
+from app.wallet.ledger import InsufficientFundsError
+from tests.conftest import create_slot, create_user, wallet_of
+
+
+@pytest.fixture
+def doctor(db):
+    return create_user(db, "d@example.com", role=UserRole.DOCTOR).doctor_profile
+
+
+def test_booking_claims_slot_and_freezes_points(db, doctor):
+    patient = create_user(db, "p@example.com", balance=100)
+    slot = create_slot(db, doctor.id)
+
+    consultation = ConsultationService.book_consultation(db, patient.patient_profile.id, doctor.id, slot.id, 40)
+
+    db.expire_all()
+    assert consultation.slot_id == slot.id
+    assert (slot.is_available, slot.is_reserved) == (False, True)
+    wallet = wallet_of(db, patient.id)
+    assert (wallet.balance, wallet.frozen_balance) == (60, 40)
+
+
+def test_reserved_slot_cannot_be_booked_again(db, doctor):
+    first = create_user(db, "p1@example.com", balance=100)
+    second = create_user(db, "p2@example.com", balance=100)
+    slot = create_slot(db, doctor.id)
+    ConsultationService.book_consultation(db, first.patient_profile.id, doctor.id, slot.id, 10)
+
+    with pytest.raises(ValueError, match="Слот недоступен"):
+        ConsultationService.book_consultation(db, second.patient_profile.id, doctor.id, slot.id, 10)
+
+
+def test_slot_of_another_doctor_is_rejected(db, doctor):
+    other = create_user(db, "d2@example.com", role=UserRole.DOCTOR).doctor_profile
+    patient = create_user(db, "p@example.com", balance=100)
+    slot = create_slot(db, other.id)
+
+    with pytest.raises(ValueError, match="не принадлежит"):
+        ConsultationService.book_consultation(db, patient.patient_profile.id, doctor.id, slot.id, 10)
+
+
+def test_insufficient_points_release_the_slot(db, doctor):
+    patient = create_user(db, "p@example.com", balance=5)
+    slot = create_slot(db, doctor.id)
+
+    with pytest.raises(InsufficientFundsError):
+        ConsultationService.book_consultation(db, patient.patient_profile.id, doctor.id, slot.id, 10)
+    db.rollback()
+
+    db.expire_all()
+    assert (slot.is_available, slot.is_reserved) == (True, False)
+    assert db.query(Consultation).count() == 0
+
+
+def test_concurrent_bookings_of_one_slot_have_one_winner(db, doctor):
+    patient_ids = [
+        create_user(db, f"p{index}@example.com", balance=100).patient_profile.id for index in range(6)
+    ]
+    doctor_id = doctor.id
+    slot_id = create_slot(db, doctor_id).id
+
+    def book(patient_id: int) -> bool:
+        with SessionLocal() as session:
+            try:
+                ConsultationService.book_consultation(session, patient_id, doctor_id, slot_id, 10)
+                return True
+            except ValueError:
+                session.rollback()
+                return False
+
+    with ThreadPoolExecutor(max_workers=len(patient_ids)) as pool:
+        results = list(pool.map(book, patient_ids))
+
+    assert results.count(True) == 1
+    consultations = db.query(Consultation).filter(Consultation.slot_id == slot_id).all()
+    assert len(consultations) == 1
+    assert consultations[0].patient_id == patient_ids[results.index(True)]
+    assert db.get(ScheduleSlot, slot_id).is_reserved is True
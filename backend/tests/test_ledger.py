@@ -0,0 +1,181 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import pytest
+
+from app.common.database import SessionLocal
+from app.common.models import (
+    Consultation,
+    ConsultationStatus,
+    PatientProfile,
+    TransactionType,
+    UserRole,
+    WalletTransaction,
+)
+from app.services.consultation_service import ConsultationService
+from app.wallet.ledger import InsufficientFundsError, Ledger, LedgerEntry, WalletNotFoundError
+from tests.conftest import create_slot, create_user, wallet_of
+
+
+def test_freeze_moves_points_and_records_balances(db):
+    user = create_user(db, "p@example.com", balance=100)
+
+    transaction = Ledger.post(db, user.id, TransactionType.FREEZE, Decimal(30))
+    db.commit()
+
+    wallet = wallet_of(db, user.id)
+    assert (wallet.balance, wallet.frozen_balance) == (70, 30)
+    assert (transaction.balance_before, transaction.balance_after) == (100, 70)
+
+
+def test_insufficient_balance_leaves_wallet_untouched(db):
+    user = create_user(db, "p@example.com", balance=10)
+
+    with pytest.raises(InsufficientFundsError):
+        Ledger.post(db, user.id, TransactionType.FREEZE, Decimal(11))
+    db.rollback()
+
+    wallet = wallet_of(db, user.id)
+    assert (wallet.balance, wallet.frozen_balance) == (10, 0)
+    assert db.query(WalletTransaction).count() == 0
+
+
+def test_debit_cannot_exceed_frozen_balance(db):
+    user = create_user(db, "p@example.com", balance=100)
+    Ledger.post(db, user.id, TransactionType.FREEZE, Decimal(20))
+    db.commit()
+
+    with pytest.raises(InsufficientFundsError):
+        Ledger.post(db, user.id, TransactionType.DEBIT, Decimal(21))
+    db.rollback()
+
+    assert wallet_of(db, user.id).frozen_balance == 20
+
+
+def test_credit_creates_missing_wallet_and_debit_requires_one(db):
+    user = create_user(db, "p@example.com")
+    db.delete(wallet_of(db, user.id))
+    db.commit()
+
+    with pytest.raises(WalletNotFoundError):
+        Ledger.post(db, user.id, TransactionType.FREEZE, Decimal(1))
+    db.rollback()
+
+    Ledger.post(db, user.id, TransactionType.CREDIT, Decimal(5))
+    db.commit()
+    assert wallet_of(db, user.id).balance == 5
+
+
+def test_failed_group_is_not_partially_applied(db):
+    doctor = create_user(db, "d@example.com", balance=0)
+    patient = create_user(db, "p@example.com", balance=5)
+
+    with pytest.raises(InsufficientFundsError):
+        Ledger.apply(db, [
+            LedgerEntry(doctor.id, TransactionType.CREDIT, Decimal(10)),
+            LedgerEntry(patient.id, TransactionType.FREEZE, Decimal(10)),
+        ])
+    db.rollback()
+
+    assert wallet_of(db, doctor.id).balance == 0
+    assert wallet_of(db, patient.id).balance == 5
+
+
+def test_concurrent_freezes_never_overdraw(db):
+    user_id = create_user(db, "p@example.com", balance=50).id
+
+    def freeze() -> bool:
+        with SessionLocal() as session:
+            try:
+                Ledger.post(session, user_id, TransactionType.FREEZE, Decimal(10))
+                session.commit()
+                return True
+            except InsufficientFundsError:
+                session.rollback()
+                return False
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: freeze(), range(8)))
+
+    wallet = wallet_of(db, user_id)
+    assert results.count(True) == 5
+    assert (wallet.balance, wallet.frozen_balance) == (0, 50)
+    assert db.query(WalletTransaction).count() == 5
+
+
+def _active_consultation(db, points: int = 30) -> Consultation:
+    doctor = create_user(db, "d@example.com", role=UserRole.DOCTOR).doctor_profile
+    # Лишние замороженные поинты: без них повторное списание остановил бы кошелёк
+    patient = create_user(db, "p@example.com", balance=100)
+    Ledger.post(db, patient.id, TransactionType.FREEZE, Decimal(40))
+    db.commit()
+    slot = create_slot(db, doctor.id)
+    consultation = ConsultationService.book_consultation(db, patient.patient_profile.id, doctor.id, slot.id, points)
+    return ConsultationService.start_consultation(db, consultation.id)
+
+
+def _run_concurrently(*calls) -> list:
+    def run(call) -> str:
+        with SessionLocal() as session:
+            try:
+                call(session)
+                return "ok"
+            except ValueError:
+                session.rollback()
+                return "rejected"
+
+    with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        return list(pool.map(run, calls))
+
+
+def test_consultation_is_settled_once_under_concurrent_completes(db):
+    consultation = _active_consultation(db)
+    consultation_id, patient_id = consultation.id, consultation.patient_id
+
+    results = _run_concurrently(
+        *(lambda session: ConsultationService.complete_consultation(session, consultation_id) for _ in range(4))
+    )
+
+    assert results.count("ok") == 1
+    debits = db.query(WalletTransaction).filter(
+        WalletTransaction.related_consultation_id == consultation_id,
+        WalletTransaction.transaction_type == TransactionType.DEBIT,
+    )
+    assert debits.count() == 1
+    patient_user_id = db.get(PatientProfile, patient_id).user_id
+    assert wallet_of(db, patient_user_id).frozen_balance == 40
+
+
+def test_complete_and_cancel_race_has_one_outcome(db):
+    consultation = _active_consultation(db)
+    consultation_id, patient_id = consultation.id, consultation.patient_id
+
+    results = _run_concurrently(
+        lambda session: ConsultationService.complete_consultation(session, consultation_id),
+        lambda session: ConsultationService.cancel_consultation(session, consultation_id, "race"),
+    )
+
+    assert results.count("ok") == 1
+    db.expire_all()
+    status = db.get(Consultation, consultation_id).status
+    settled = db.query(WalletTransaction).filter(
+        WalletTransaction.related_consultation_id == consultation_id,
+        WalletTransaction.transaction_type.in_([TransactionType.DEBIT, TransactionType.UNFREEZE]),
+    ).all()
+    assert [transaction.transaction_type for transaction in settled] == [
+        TransactionType.DEBIT if status == ConsultationStatus.COMPLETED else TransactionType.UNFREEZE
+    ]
+    patient_user_id = db.get(PatientProfile, patient_id).user_id
+    assert wallet_of(db, patient_user_id).frozen_balance == 40
+
+
+def test_second_complete_is_rejected(db):
+    consultation = _active_consultation(db)
+    ConsultationService.complete_consultation(db, consultation.id)
+
+    with pytest.raises(ValueError, match="активные"):
+        ConsultationService.complete_consultation(db, consultation.id)
+    db.rollback()
+
+    with pytest.raises(ValueError, match="не найдена"):
+        ConsultationService.cancel_consultation(db, consultation.id + 1)
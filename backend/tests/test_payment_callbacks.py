@@ -0,0 +1,78 @@
+from decimal import Decimal
+
+import pytest
+
+from app.common.models import Payment, PaymentCallbackEvent, WalletTransaction
+from app.payments.callbacks import PaymentCallbackService
+from app.payments.schemas import PaymentCallback
+from tests.conftest import create_user, wallet_of
+
+pytestmark = pytest.mark.asyncio
+
+
+def _payment(db, user_id: int, transaction_id: str = "tx-1") -> Payment:
+    payment = Payment(
+        user_id=user_id,
+        amount=Decimal("100.00"),
+        points_amount=100,
+        payment_provider="stripe",
+        provider_transaction_id=transaction_id,
+        status="pending",
+    )
+    db.add(payment)
+    db.commit()
+    return payment
+
+
+async def _enqueue(async_db, status: str, transaction_id: str = "tx-1") -> bool:
+    callback = PaymentCallback(transaction_id=transaction_id, status=status, amount=Decimal("100.00"))
+    return await PaymentCallbackService.enqueue(async_db, "stripe", callback)
+
+
+async def test_repeated_callback_is_stored_once(db, async_db):
+    assert await _enqueue(async_db, "completed") is True
+    assert await _enqueue(async_db, "completed") is False
+
+    assert db.query(PaymentCallbackEvent).count() == 1
+
+
+async def test_new_status_updates_the_same_row(db, async_db):
+    user = create_user(db, "p@example.com")
+    _payment(db, user.id)
+
+    assert await _enqueue(async_db, "pending") is True
+    PaymentCallbackService.process_batch(db, 10)
+    assert await _enqueue(async_db, "completed") is True
+    PaymentCallbackService.process_batch(db, 10)
+
+    event = db.query(PaymentCallbackEvent).one()
+    assert (event.status, event.state) == ("completed", "processed")
+    assert wallet_of(db, user.id).balance == 100
+
+
+async def test_completed_payment_is_credited_once(db, async_db):
+    user = create_user(db, "p@example.com")
+    payment = _payment(db, user.id)
+
+    await _enqueue(async_db, "completed")
+    assert PaymentCallbackService.process_batch(db, 10) == 1
+    # Повтор после финального статуса не принимается, replay не начисляет второй раз
+    assert await _enqueue(async_db, "succeeded") is False
+    assert PaymentCallbackService.replay(db, states=("processed",)) == 1
+    PaymentCallbackService.process_batch(db, 10)
+
+    db.expire_all()
+    assert payment.status == "completed"
+    assert wallet_of(db, user.id).balance == 100
+    assert db.query(WalletTransaction).count() == 1
+
+
+async def test_callback_before_payment_is_retried(db, async_db):
+    user = create_user(db, "p@example.com")
+
+    await _enqueue(async_db, "completed", transaction_id="tx-late")
+    PaymentCallbackService.process_batch(db, 10)
+
+    event = db.query(PaymentCallbackEvent).one()
+    assert (event.state, event.attempts, event.last_error) == ("pending", 1, "Payment not found")
+    assert wallet_of(db, user.id).balance == 0
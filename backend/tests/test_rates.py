@@ -0,0 +1,49 @@
+import threading
+from decimal import Decimal
+
+from app.payments.rates import ExchangeRateStore
+
+
+def test_invalidation_during_reload_is_not_lost():
+    store = ExchangeRateStore()
+    loading = threading.Event()
+    release = threading.Event()
+    loads = []
+
+    def load():
+        loads.append(len(loads))
+        if len(loads) == 1:
+            loading.set()
+            release.wait(5)
+            return {"USD": ([], [])}
+        return {"USD": ([], []), "EUR": ([], [])}
+
+    store._load = load
+    reader = threading.Thread(target=store._snapshot)
+    reader.start()
+    assert loading.wait(5)
+
+    # Сброс не ждёт идущего перечитывания
+    invalidator = threading.Thread(target=store.invalidate)
+    invalidator.start()
+    invalidator.join(1)
+    assert not invalidator.is_alive()
+    release.set()
+    reader.join(5)
+
+    assert "EUR" in store._snapshot()
+    assert len(loads) == 2
+
+
+def test_snapshot_is_reused_until_invalidated(db):
+    store = ExchangeRateStore()
+    loads = []
+    original = store._load
+    store._load = lambda: loads.append(1) or original()
+
+    assert store.to_points(Decimal("10"), "RUB") == store.to_points(Decimal("10"), "RUB")
+    assert len(loads) == 1
+
+    store.invalidate()
+    store.to_points(Decimal("10"), "RUB")
+    assert len(loads) == 2
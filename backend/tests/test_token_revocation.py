@@ -0,0 +1,160 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.auth.service import AuthService
+from app.common import dependencies
+from app.common.dependencies import TokenValidationError, get_user_by_token
+from app.common.models import UserRole
+from app.common.principal import TokenRevocations, get_principal, invalidate_principal, principal_cache
+from app.config import settings
+from app.main import app
+from tests.conftest import create_user
+
+
+class FakeRedis:
+    """Redis в памяти; down=True — каждое обращение падает."""
+
+    def __init__(self) -> None:
+        self.data = {}
+        self.down = False
+
+    def _check(self) -> None:
+        if self.down:
+            raise ConnectionError("redis is down")
+
+    def set(self, key, value, ex=None) -> None:
+        self._check()
+        self.data[key] = str(value)
+
+    def get(self, key):
+        self._check()
+        return self.data.get(key)
+
+
+@pytest.fixture
+def revocations(monkeypatch):
+    monkeypatch.setattr(settings, "AUTH_MODE", "stateless")
+    store = TokenRevocations()
+    monkeypatch.setattr(dependencies, "token_revocations", store)
+    monkeypatch.setattr("app.common.principal.token_revocations", store)
+    principal_cache.local.clear()
+    yield store
+    principal_cache.local.clear()
+
+
+@pytest.fixture
+def redis_revocations(monkeypatch, revocations):
+    redis = FakeRedis()
+    monkeypatch.setattr("app.common.redis.get_redis", lambda: redis)
+    revocations.use_redis = True
+    return revocations, redis
+
+
+def _token(db, user_id: int) -> str:
+    return AuthService._access_token(get_principal(db, user_id), 0)
+
+
+def _promote(db, user) -> None:
+    user.role = UserRole.ADMIN
+    db.commit()
+
+
+def test_stateless_token_is_trusted_until_revoked(db, revocations):
+    user = create_user(db, "p@example.com")
+    token = _token(db, user.id)
+    _promote(db, user)
+
+    # Без отзыва роль берётся из токена, а не из БД
+    assert get_user_by_token(db, token).role == UserRole.PATIENT
+
+    invalidate_principal(user.id)
+    with pytest.raises(TokenValidationError, match="revoked_token"):
+        get_user_by_token(db, token)
+
+    # iat с точностью до миллисекунды: новый токен должен быть выдан позже отзыва
+    time.sleep(0.01)
+    assert get_user_by_token(db, _token(db, user.id)).role == UserRole.ADMIN
+
+
+def test_revocations_are_not_evicted_by_size(monkeypatch, db):
+    monkeypatch.setattr(settings, "PRINCIPAL_CACHE_MAX_SIZE", 2)
+    store = TokenRevocations()
+
+    for user_id in range(1, 6):
+        store.revoke(user_id)
+
+    assert all(store.valid_after(user_id) > 0 for user_id in range(1, 6))
+
+
+def test_expired_revocations_are_pruned():
+    store = TokenRevocations()
+    store.ttl = 0.05
+    store.revoke(1)
+    time.sleep(0.1)
+    store.revoke(2)
+
+    assert store.valid_after(1) == 0.0
+    assert list(store._revoked) == [2]
+
+
+def test_revocation_is_shared_through_redis(db, redis_revocations):
+    revocations, redis = redis_revocations
+    user = create_user(db, "p@example.com")
+    token = _token(db, user.id)
+
+    revocations.revoke(user.id)
+    revocations.local.clear()
+
+    assert redis.data[revocations._key(user.id)]
+    with pytest.raises(TokenValidationError, match="revoked_token"):
+        get_user_by_token(db, token)
+
+
+def test_failed_redis_write_falls_back_to_database(db, redis_revocations):
+    revocations, redis = redis_revocations
+    user = create_user(db, "p@example.com")
+    token = _token(db, user.id)
+    _promote(db, user)
+
+    redis.down = True
+    invalidate_principal(user.id)
+    redis.down = False
+    redis.data.clear()
+
+    # Пока запись не дошла до Redis, claims не доверяем и идём в БД;
+    # проверка заодно повторяет запись
+    assert revocations._unsynced
+    with pytest.raises(TokenValidationError, match="revoked_token"):
+        get_user_by_token(db, token)
+    assert not revocations._unsynced
+    assert revocations._key(user.id) in redis.data
+
+
+def test_unavailable_redis_uses_database_principal(db, redis_revocations):
+    revocations, redis = redis_revocations
+    user = create_user(db, "p@example.com")
+    token = _token(db, user.id)
+    _promote(db, user)
+
+    redis.down = True
+    invalidate_principal(user.id)
+
+    assert revocations.valid_after(user.id) is None
+    assert get_user_by_token(db, token).role == UserRole.ADMIN
+
+
+def test_anonymous_email_verification_does_not_revoke_tokens(db, revocations):
+    user = create_user(db, "p@example.com")
+    user.is_verified = False
+    db.commit()
+    token = _token(db, user.id)
+
+    client = TestClient(app)
+    for _ in range(2):
+        response = client.post("/api/v1/verify-email", json={"email": "p@example.com", "code": "000000"})
+        assert response.json() == {"verified": True}
+
+    assert revocations.valid_after(user.id) == 0.0
+    assert get_user_by_token(db, token).id == user.id
@@ -390,6 +390,25 @@ const ConsultationRoom: React.FC = () => {
               } else if (evt === 'call_ended') {
                  setConnectionStatus('ended');
                  cleanup();
+              } else if (evt === 'chat_history') {
+                 // Последние сообщения чата при подключении; при переподключении уже показанный чат не трогаем
+                 const restored: Message[] = (payload.messages || []).map((m: any) => ({
+                   id: `msg-${m.id}`,
+                   senderId: m.senderId,
+                   senderName: m.senderName,
+                   text: m.text,
+                   timestamp: new Date(m.timestamp).toLocaleTimeString('ru-RU', { hour:'2-digit', minute:'2-digit' })
+                 }));
+                 setMessages(prev => prev.some(m => !m.fileUrl) ? prev : [...restored, ...prev]);
+              } else if (evt === 'chat_rejected') {
+                 // Сервер не смог принять сообщение: показываем, что оно не отправлено
+                 setMessages(prev => [...prev, {
+                   id: `rejected-${Date.now()}`,
+                   senderId: 0,
+                   senderName: 'Система',
+                   text: `Сообщение не отправлено: «${payload.text}». ${payload.reason}`,
+                   timestamp: new Date().toLocaleTimeString('ru-RU', { hour:'2-digit', minute:'2-digit' })
+                 }]);
               }
               break;
             